@@ -8,6 +8,9 @@
 # .\Send-KeyPress.ps1 -KeyCode 0x41
 # String:
 # .\Send-KeyPress.ps1 -String "Hello World"
+# Server (used by key_injector.py, the C# type is compiled once):
+# .\Send-KeyPress.ps1 -Serve
+#   reads one key code per line from stdin, e.g. 0x28, and answers 'ok' after each key
 
 # KeyCodes can be found on the [MSDN Site](https://msdn.microsoft.com/en-us/library/windows/desktop/dd375731(v=vs.85).aspx)
 # Multiple Keycodes can be sent in an array of bytes to achieve modified keypresses.
@@ -21,7 +24,9 @@ Param (
 	[Parameter(position=0, mandatory=$true, parametersetname='keyCode')]
 	[byte[]]$KeyCode,
 	[Parameter(position=0, mandatory=$true, parametersetname='string')]
-	[string]$String
+	[string]$String,
+	[Parameter(mandatory=$true, parametersetname='serve')]
+	[switch]$Serve
 )
 
 $code = @"
@@ -212,4 +217,14 @@ switch($PSCmdlet.ParameterSetName){
 	'key' { [KBEmulator]::SendCharacter($Char) }
 	'keyCode' { [KBEmulator]::SendKeyCode($KeyCode) }
 	'string' { [KBEmulator]::SendString($String) }
+	'serve' {
+		while (($line = [Console]::In.ReadLine()) -ne $null) {
+			$line = $line.Trim()
+			if ($line -eq '') { continue }
+			[byte[]]$codes = $line.Split(',') | %{ [Convert]::ToByte($_.Trim(), 16) }
+			[KBEmulator]::SendKeyCode($codes)
+			[Console]::Out.WriteLine('ok')
+			[Console]::Out.Flush()
+		}
+	}
 }
@@ -0,0 +1,96 @@
+"""Throughput of the batch decoder on synthetic controller floods.
+
+Builds batches of mod wheel / expression / channel aftertouch traffic with a
+pedal press every ``pedal_every`` messages, then times the old per-message loop
+and ``PedalDecoder``. The old loop also shows how many edges it loses by
+stopping at the first unmapped CC of a batch.
+
+    python -m benchmarks.bench_decoder [messages] [batch_size] [pedal_every]
+"""
+import random
+import sys
+import time
+
+from midi_decoder import PedalDecoder
+
+LEFT_PEDAL = 67
+MID_PEDAL = 66
+MAPPING = {LEFT_PEDAL: 'Page_Down', MID_PEDAL: 'Page_Up'}
+
+
+def flood(messages, batch_size, pedal_every, seed=1):
+    rnd = random.Random(seed)
+    events = []
+    ts = 0
+    pedal_on = False
+    for i in range(messages):
+        ts += 1
+        if i % pedal_every == 0:
+            # alternate press / release of the left pedal
+            events.append([[0xB0, LEFT_PEDAL, 0 if pedal_on else 127, 0], ts])
+            pedal_on = not pedal_on
+            continue
+        kind = rnd.random()
+        if kind < 0.5:
+            events.append([[0xB0, 1, rnd.randrange(128), 0], ts])     # mod wheel
+        elif kind < 0.8:
+            events.append([[0xB0, 11, rnd.randrange(128), 0], ts])    # expression
+        else:
+            events.append([[0xD0, rnd.randrange(128), 0, 0], ts])     # channel aftertouch
+    return [events[i:i + batch_size] for i in range(0, len(events), batch_size)]
+
+
+def legacy_decode(batches, stop_at_unmapped=True):
+    """The loop that used to live in midi_page_turn(), minus sendkey()."""
+    ccdata = {cc: [True, key] for cc, key in MAPPING.items()}
+    edges = 0
+    for data in batches:
+        for d in data:
+            st = d[0][0]
+            cc = d[0][1]
+            val = d[0][2]
+            if st >> 4 != 0b1011:
+                continue
+            if cc not in ccdata.keys():
+                if stop_at_unmapped:
+                    break
+                continue
+            if val > 0:
+                if ccdata[cc][0]:
+                    edges += 1
+                    ccdata[cc][0] = False
+            else:
+                ccdata[cc][0] = True
+    return edges
+
+
+def table_decode(batches):
+    decoder = PedalDecoder(MAPPING)
+    edges = 0
+    for data in batches:
+        edges += len(decoder.decode(data))
+    return edges
+
+
+def bench(name, fn, batches, messages):
+    t0 = time.perf_counter()
+    edges = fn(batches)
+    elapsed = time.perf_counter() - t0
+    print(f'{name:8s} {messages / elapsed / 1e6:6.2f} M msg/s  '
+          f'{elapsed / messages * 1e9:7.1f} ns/msg  edges {edges}')
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    pedal_every = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+    batches = flood(messages, batch_size, pedal_every)
+    print(f'{messages} messages, batches of {batch_size}, '
+          f'{(messages + pedal_every - 1) // pedal_every // 2} expected edges')
+    bench('legacy', legacy_decode, batches, messages)
+    bench('fixed', lambda b: legacy_decode(b, stop_at_unmapped=False), batches, messages)
+    bench('table', table_decode, batches, messages)
+
+
+if __name__ == '__main__':
+    main()
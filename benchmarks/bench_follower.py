@@ -0,0 +1,160 @@
+"""Score follower: alignment throughput and page turn timing error.
+
+Synthetic performances of a generated piece (chords of 1-3 notes, page breaks
+every ``PAGE_BEATS`` beats) with rubato, timing jitter, rolled chords, wrong,
+missing and extra notes are fed to a ScoreFollower in ``read()`` batches. The
+turn timing error of each page break is the device time of the automatic turn
+minus the time the first onset at or after ``lead`` beats before the break was
+played: turns are fired on notes, that is the earliest one can come.
+
+- cost per note for pieces of growing length (should stay flat)
+- timing error and missed turns for a few band widths
+
+With a reference and a recording (midi_record.py) the recorded performance is
+replayed instead and the turns are listed; there is no ground truth then.
+
+    python -m benchmarks.bench_follower [onsets]
+    python -m benchmarks.bench_follower REFERENCE RECORDING.mptrec [PAGE_BREAK_BEATS]
+"""
+import bisect
+import math
+import random
+import sys
+import time
+
+from midi_record import read_recording
+from page_output import Turn
+from score_follower import ScoreFollower, load_reference, parse_beats, LEAD_BEATS, BAND
+from telemetry import percentile
+
+PAGE_BEATS = 32
+BPM = 96
+LENGTHS = (1_000, 10_000, 100_000)
+BANDS = (8, 16, 32, 64)
+TURN = Turn('next', None, None)
+
+
+def make_piece(onsets, seed=1):
+    rnd = random.Random(seed)
+    piece = []
+    beat = 0.0
+    pitch = 60
+    for _ in range(onsets):
+        pitch = max(40, min(84, pitch + rnd.choice((-5, -3, -2, -1, 1, 2, 3, 5))))
+        chord = {pitch} | {pitch - rnd.choice((3, 4, 7, 12)) for _ in range(rnd.choice((0, 0, 1, 2)))}
+        piece.append((beat, frozenset(chord)))
+        beat += rnd.choice((0.5, 0.5, 1, 1, 1, 1.5, 2))
+    breaks = [b * PAGE_BEATS for b in range(1, int(beat // PAGE_BEATS) + 1)]
+    return piece, breaks
+
+
+def tempo_map(seed=2, step=0.25):
+    """Function beat -> ms of a performance with slow rubato and drift."""
+    rnd = random.Random(seed)
+    times = [0.0]
+    drift = 0.0
+
+    def time_of(beat):
+        while (len(times) - 1) * step < beat + step:
+            b = (len(times) - 1) * step
+            nonlocal drift
+            drift = max(-0.1, min(0.1, drift + rnd.gauss(0, 0.005)))
+            bpm = BPM * (1 + 0.12 * math.sin(2 * math.pi * b / 24) + drift)
+            times.append(times[-1] + step * 60000 / bpm)
+        i = int(beat / step)
+        return times[i] + (beat / step - i) * (times[i + 1] - times[i])
+    return time_of
+
+
+def perform(piece, time_of, seed=3, wrong=0.04, dropped=0.03, extra=0.02, jitter_ms=12, roll_ms=25,
+            read_ms=1):
+    """``read()`` batches of one performance of ``piece``."""
+    rnd = random.Random(seed)
+    events = []
+    for beat, pitches in piece:
+        t0 = time_of(beat) + rnd.gauss(0, jitter_ms)
+        for k, pitch in enumerate(sorted(pitches)):
+            if rnd.random() < dropped:
+                continue
+            if rnd.random() < wrong:
+                pitch += rnd.choice((-2, -1, 1, 2))
+            events.append((t0 + k * rnd.uniform(0, roll_ms), pitch))
+        if rnd.random() < extra:
+            events.append((t0 + rnd.uniform(-50, 50), rnd.randrange(40, 85)))
+    events.sort()
+    batches = []
+    batch = []
+    batch_end = None
+    for t, pitch in events:
+        ts = max(0, int(t))
+        if batch and ts >= batch_end:
+            batches.append(batch)
+            batch = []
+        if not batch:
+            batch_end = ts + read_ms
+        batch.append([[0x90, pitch, 80, 0], ts])
+    if batch:
+        batches.append(batch)
+    return batches, len(events)
+
+
+def run(piece, breaks, batches, band, lead=LEAD_BEATS):
+    follower = ScoreFollower(piece, breaks, TURN, lead=lead, band=band)
+    t0 = time.perf_counter()
+    for batch in batches:
+        follower.feed(batch)
+    return follower, time.perf_counter() - t0
+
+
+def timing(follower, time_of, lead=LEAD_BEATS):
+    fired = {page_break: ts for ts, _beat, page_break in follower.turns}
+    beats = follower.beats
+    due = {b: time_of(beats[bisect.bisect_left(beats, b - lead)]) for b in follower.breaks}
+    errors = [fired[b] - due[b] for b in follower.breaks if b in fired]
+    missed = sum(b not in fired for b in follower.breaks)
+    return errors, missed
+
+
+def synthetic(onsets):
+    time_of = tempo_map()
+    print(f'cost per note, band {BAND}')
+    for n in LENGTHS:
+        piece, breaks = make_piece(n)
+        batches, notes = perform(piece, time_of)
+        follower, seconds = run(piece, breaks, batches, BAND)
+        print(f'  {n:7d} onsets {notes:7d} notes  {seconds / notes * 1e6:7.2f} us/note  '
+              f'{notes / seconds:9.0f} notes/s')
+    piece, breaks = make_piece(onsets)
+    batches, notes = perform(piece, time_of)
+    print(f'turn timing, {onsets} onsets, {len(breaks)} page breaks, lead {LEAD_BEATS:g} beats, {BPM} bpm +-12%')
+    for band in BANDS:
+        follower, seconds = run(piece, breaks, batches, band)
+        errors, missed = timing(follower, time_of)
+        absolute = [abs(e) for e in errors]
+        print(f'  band {band:3d}  {seconds / notes * 1e6:6.2f} us/note  error mean {sum(errors) / max(1, len(errors)):+7.1f} ms  '
+              f'|error| p50 {percentile(absolute, 50):6.1f} ms  p90 {percentile(absolute, 90):6.1f} ms  '
+              f'max {max(absolute) if absolute else 0:7.1f} ms  missed {missed}  turns {len(follower.turns)}')
+
+
+def replay(reference, recording, page_breaks=None):
+    onsets, breaks = load_reference(reference)
+    if page_breaks:
+        breaks = parse_beats(page_breaks)
+    batches = [batch for _host, batch in read_recording(recording)]
+    follower, seconds = run(onsets, breaks, batches, BAND)
+    notes = max(1, follower.notes)
+    print(f'{follower.notes} notes, {seconds / notes * 1e6:.2f} us/note')
+    for ts, beat, page_break in follower.turns:
+        print(f'  turn at {ts:9d} ms  beat {beat:8g}  page break {page_break:g}')
+    print(f'{len(follower.turns)} of {len(follower.breaks)} page breaks turned')
+
+
+def main():
+    if len(sys.argv) > 2:
+        replay(*sys.argv[1:4])
+    else:
+        synthetic(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Per-key latency of the persistent injectors vs. the one-process-per-key path.
+
+Sends a harmless key (Shift) N times through each injector that can be created
+here and prints latency percentiles. Needs an X display (xtest), /dev/uinput
+access (uinput) or Windows (helper); injectors that cannot start are skipped.
+
+    python -m benchmarks.bench_injector [count] [window_id]
+"""
+import platform
+import sys
+import time
+
+from key_injector import INJECTORS
+from telemetry import percentile
+
+
+def harmless_key():
+    """Shift, as every injector names it."""
+    return '0x10' if platform.system() == 'Windows' else 'Shift_L'
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    window = sys.argv[2] if len(sys.argv) > 2 else None
+    key = harmless_key()
+
+    for name, cls in INJECTORS.items():
+        try:
+            injector = cls(window)
+        except Exception as e:
+            print(f'{name:10s} skipped: {e!r}')
+            continue
+        samples = []
+        try:
+            # first key pays for lazy setup (keycode lookup, helper compile)
+            injector.send(key)
+            for _ in range(count):
+                t0 = time.perf_counter()
+                injector.send(key)
+                samples.append((time.perf_counter() - t0) * 1000)
+        except Exception as e:
+            print(f'{name:10s} failed: {e!r}')
+            continue
+        finally:
+            injector.close()
+        print(f'{name:10s} mean {sum(samples) / len(samples):8.3f} ms  '
+              f'p50 {percentile(samples, 50):8.3f} ms  p99 {percentile(samples, 99):8.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Idle CPU and wake-up latency of the receive loop strategies.
+
+Compares the old ``poll()`` + ``sleep(0)`` spin loop with the backoff wait of the
+pygame backend and the event wake-up used by the rtmidi backend. No MIDI device is
+needed: a feeder thread plays the role of the instrument and stamps each pedal
+press with the time it "arrived".
+
+    python -m benchmarks.bench_input_idle [seconds] [presses_per_second]
+"""
+import sys
+import threading
+import time
+from collections import deque
+
+from midi_input import PygameMidiInput, RtMidiInput
+from telemetry import LoopStats
+
+
+class _Port:
+    """Stands in for pygame.midi.Input: poll()/read() over a deque."""
+
+    def __init__(self):
+        self.pending = deque()
+
+    def poll(self):
+        return bool(self.pending)
+
+    def read(self, n):
+        out = []
+        while self.pending and len(out) < n:
+            out.append(self.pending.popleft())
+        return out
+
+
+def now_ms():
+    return time.perf_counter() * 1000
+
+
+def feeder(push, stop, rate):
+    while not stop.is_set():
+        time.sleep(1 / rate)
+        push([[176, 67, 127, 0], now_ms()])
+
+
+def run(name, wait, read, push, seconds, rate):
+    stats = LoopStats()
+    stop = threading.Event()
+    t = threading.Thread(target=feeder, args=(push, stop, rate), daemon=True)
+    t.start()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        if not wait():
+            continue
+        for d in read(256):
+            stats.record_latency(now_ms() - d[1])
+    stop.set()
+    t.join()
+    s = stats.summary()
+    print(f'{name:10s} cpu {s["cpu_percent"]:6.1f}%  '
+          f'latency p50 {s["latency_p50_ms"]:.3f} ms  p99 {s["latency_p99_ms"]:.3f} ms  '
+          f'max {s["latency_max_ms"]:.3f} ms  ({s["edges"]} presses)')
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    port = _Port()
+
+    def spin_wait():
+        time.sleep(0)
+        return port.poll()
+    run('spin', spin_wait, port.read, port.pending.append, seconds, rate)
+
+    backoff = PygameMidiInput(0, 'bench')
+    backoff.midi_in = _Port()
+    run('backoff', lambda: backoff.wait(0.1), backoff.read, backoff.midi_in.pending.append,
+        seconds, rate)
+
+    event = RtMidiInput(0, 'bench')
+
+    def push_event(msg):
+        event._pending.append(msg)
+        event._ready.set()
+    run('event', lambda: event.wait(0.1), event.read, push_event, seconds, rate)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Lookup cost of the compiled mapping table against the number of rules.
+
+Decodes the same flood of channel voice messages (notes, controllers, program
+changes on every channel) with mappings of a growing number of random rules.
+The rules use numbers 0-63 and the flood 64-127, except for one mapped pedal
+every ``pedal_every`` messages, so every mapping sees the same number of edges.
+The compiled ``ActionTable`` should cost the same per message whatever the rule
+count; a plain scan over the rules is timed next to it for comparison.
+
+    python -m benchmarks.bench_mapping [messages]
+"""
+import random
+import sys
+import time
+
+from midi_decoder import Rule, PedalDecoder, KINDS
+
+RULE_COUNTS = (2, 16, 128, 1024, 4096)
+# the scan gets slow quickly, keep it to the smaller mappings
+SCAN_MAX_RULES = 1024
+
+
+def random_rules(n, seed=1):
+    rnd = random.Random(seed)
+    rules = []
+    for i in range(n):
+        kind = rnd.choice(('cc', 'cc', 'note', 'program'))
+        rules.append(Rule(kind, rnd.randrange(16), rnd.randrange(64), 'next', f'key{i}'))
+    # the pedal of traffic()
+    rules.append(Rule('cc', 0, 0, 'next', 'pedal'))
+    return rules
+
+
+def traffic(messages, batch_size=256, pedal_every=100, seed=2):
+    rnd = random.Random(seed)
+    events = []
+    pedal_on = False
+    for ts in range(messages):
+        if ts % pedal_every == 0:
+            events.append([[0xB0, 0, 0 if pedal_on else 127, 0], ts])
+            pedal_on = not pedal_on
+            continue
+        status = rnd.choice((0x80, 0x90, 0xB0, 0xB0, 0xB0, 0xC0, 0xD0)) | rnd.randrange(16)
+        events.append([[status, 64 + rnd.randrange(64), rnd.randrange(128), 0], ts])
+    return [events[i:i + batch_size] for i in range(0, len(events), batch_size)]
+
+
+def scan_decode(rules, batches):
+    """Match every message against every rule, the naive way."""
+    statuses = [(KINDS[r.kind] | r.channel, r.number) for r in rules]
+    hits = 0
+    for data in batches:
+        for msg, _ts in data:
+            key = (msg[0], msg[1])
+            for match in statuses:
+                if match == key:
+                    hits += 1
+                    break
+    return hits
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    batches = traffic(messages)
+    print(f'{messages} messages, ns/msg')
+    print(f'{"rules":>6s} {"table":>8s} {"scan":>10s}')
+    for n in RULE_COUNTS:
+        rules = random_rules(n)
+        decoder = PedalDecoder(rules, debounce_ms=0)
+        edges = []
+        table = timed(lambda: [edges.extend(decoder.decode(data)) for data in batches])
+        line = f'{len(rules):6d} {table / messages * 1e9:8.1f}'
+        if n <= SCAN_MAX_RULES:
+            scan = timed(lambda: scan_decode(rules, batches))
+            line += f' {scan / messages * 1e9:10.1f}'
+        else:
+            line += f' {"-":>10s}'
+        print(f'{line}   edges {len(edges)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Cost of the instrumentation: PollTimings, scrapes and the sampling profiler.
+
+Replays a controller flood as fast as possible through PedalSession.poll() and
+a KeyDispatcher with a null send, like bench_pipeline, and reports:
+
+- CPU per message without instrumentation, with PollTimings, and with the
+  profiler sampling every thread at 200 Hz
+- time to render the metrics of the pipeline, and one scrape over HTTP
+
+    python -m benchmarks.bench_metrics [repeats]
+"""
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.bench_pipeline import synthetic_recording
+from dispatch import KeyDispatcher, COALESCE_NONE
+from metrics import MetricsRegistry, MetricsServer, SamplingProfiler
+from midi_page_turn2 import DEFAULT_RULES
+from midi_record import ReplayInput
+from pedal_session import PedalSession
+from telemetry import PollTimings, percentile
+
+
+def run(flood, timings=False, profiler=None):
+    midi_in = ReplayInput(flood, speed=None)
+    session = PedalSession(midi_in, DEFAULT_RULES).open()
+    if timings:
+        session.timings = PollTimings()
+    dispatcher = KeyDispatcher(lambda key, count: None, maxsize=1024, coalesce=COALESCE_NONE).start()
+    if profiler is not None:
+        profiler.start()
+    cpu = time.process_time()
+    try:
+        while True:
+            if midi_in.wait(0.1):
+                session.poll(dispatcher)
+    except EOFError:
+        pass
+    cpu = time.process_time() - cpu
+    if profiler is not None:
+        profiler.stop()
+    dispatcher.stop()
+    return session, dispatcher, cpu / session.stats.events * 1e6
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    flood = synthetic_recording(seconds=5, presses_per_second=4, flood_per_second=20000)
+    print(f'{sum(len(b) for _t, b in flood)} messages in {len(flood)} batches, best of {repeats}')
+    for name, options in (('plain', {}), ('PollTimings', {'timings': True}),
+                          ('PollTimings + profiler', {'timings': True, 'profiler': True})):
+        best = None
+        for _ in range(repeats):
+            profiler = SamplingProfiler(directory=tempfile.gettempdir()) if options.get('profiler') else None
+            session, dispatcher, us = run(flood, options.get('timings', False), profiler)
+            best = us if best is None else min(best, us)
+        extra = f'  {profiler.samples} samples' if profiler is not None else ''
+        print(f'  {name:24s} {best:.3f} us CPU/msg{extra}')
+
+    registry = MetricsRegistry([session], dispatcher, SamplingProfiler())
+    text = registry.render()
+    renders = []
+    for _ in range(200):
+        t0 = time.perf_counter()
+        registry.render()
+        renders.append((time.perf_counter() - t0) * 1000)
+    print(f'render: {len(text.splitlines())} lines, {len(text)} bytes, '
+          f'p50 {percentile(renders, 50):.3f} ms  max {max(renders):.3f} ms')
+
+    server = MetricsServer(registry, port=0).start()
+    try:
+        scrapes = []
+        for _ in range(50):
+            t0 = time.perf_counter()
+            with urllib.request.urlopen(server.where) as r:
+                r.read()
+            scrapes.append((time.perf_counter() - t0) * 1000)
+    finally:
+        server.stop()
+    print(f'HTTP scrape: p50 {percentile(scrapes, 50):.3f} ms  max {max(scrapes):.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Page turn pipeline benchmarks on a replayed or synthetic recording.
+
+Feeds a recording through ReplayInput -> PedalSession.poll() (the hot path of
+midi_page_turn()) -> KeyDispatcher -> a null injector, so it runs on a headless
+box without an instrument, and reports:
+
+- pedal-edge-to-keystroke latency percentiles at real-time speed
+- throughput and CPU per message under a controller flood, replayed as fast as possible
+
+    python -m benchmarks.bench_pipeline [recording.mptrec]
+"""
+import random
+import sys
+import time
+
+from dispatch import KeyDispatcher, COALESCE_NONE
+from midi_page_turn2 import DEFAULT_RULES, LEFT_PEDAL
+from midi_record import ReplayInput, read_recording
+from pedal_session import PedalSession
+from telemetry import percentile
+
+
+def synthetic_recording(seconds=5, presses_per_second=4, flood_per_second=0, batch_interval=0.001, seed=1):
+    """Batches of pedal presses/releases plus an optional mod wheel flood."""
+    rnd = random.Random(seed)
+    batches = []
+    t = 0.0
+    ts = 0
+    press_every = 1 / presses_per_second if presses_per_second else None
+    next_press = 0.0
+    pressed = False
+    carry = 0.0
+    while t < seconds:
+        batch = []
+        carry += flood_per_second * batch_interval
+        while carry >= 1:
+            carry -= 1
+            batch.append([[0xB0, 1, rnd.randrange(128), 0], ts])
+        if press_every is not None and t >= next_press:
+            # press, then release half a period later
+            batch.append([[0xB0, LEFT_PEDAL, 0 if pressed else 127, 0], ts])
+            pressed = not pressed
+            next_press += press_every / 2
+        if batch:
+            batches.append((t, batch))
+        t += batch_interval
+        ts = int(t * 1000)
+    return batches
+
+
+def run(batches, speed, max_events=256):
+    midi_in = ReplayInput(batches, speed=speed)
+    injected = []
+
+    def send(key, count):
+        # stamp on the replay clock, the same clock as the edge timestamps
+        injected.append(midi_in.time())
+
+    session = PedalSession(midi_in, DEFAULT_RULES)
+    dispatcher = KeyDispatcher(send, maxsize=1024, coalesce=COALESCE_NONE).start()
+    stats = session.stats
+    edges = []
+    session.open()
+    t0 = time.perf_counter()
+    try:
+        while True:
+            if not midi_in.wait(0.1):
+                continue
+            edges.extend(session.poll(dispatcher, max_events))
+    except EOFError:
+        pass
+    elapsed = time.perf_counter() - t0
+    cpu = time.process_time() - stats.start_cpu
+    dispatcher.stop()
+    latencies = [i - e.timestamp for e, i in zip(edges, injected)]
+    return stats, dispatcher, latencies, elapsed, cpu
+
+
+def main():
+    if len(sys.argv) > 1:
+        recording = read_recording(sys.argv[1])
+        print(f'replaying {sys.argv[1]}')
+    else:
+        recording = synthetic_recording()
+        print('replaying a synthetic recording (4 presses/s for 5 s)')
+
+    stats, dispatcher, latencies, elapsed, cpu = run(recording, speed=1.0)
+    print(f'edge-to-keystroke latency: {len(latencies)} edges  '
+          f'p50 {percentile(latencies, 50)} ms  p90 {percentile(latencies, 90)} ms  '
+          f'p99 {percentile(latencies, 99)} ms  max {max(latencies, default=0)} ms')
+    print(f'  decoder-side latency: {stats.format()}')
+    print(f'  dispatch: {dispatcher.format()}')
+
+    flood = recording if len(sys.argv) > 1 else synthetic_recording(
+        seconds=5, presses_per_second=4, flood_per_second=20000)
+    events = sum(len(b) for _t, b in flood)
+    stats, dispatcher, latencies, elapsed, cpu = run(flood, speed=None)
+    print(f'flood throughput: {events} events in {elapsed * 1000:.1f} ms = '
+          f'{events / elapsed / 1e6:.2f} M msg/s, {cpu / events * 1e6:.3f} us CPU/msg, '
+          f'{len(latencies)} edges')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Fan-out latency and loss of the network relay, all on one host.
+
+Starts ``receivers`` RelayReceiver processes, then sends ``turns`` page turns
+``interval`` seconds apart through a RelayOutput:
+
+- ``multicast``: one datagram to the group, every receiver joined it
+- ``unicast``: one datagram per receiver, each on its own port
+
+with every datagram sent once and ``REPEAT`` times. Reports the one-way latency
+over all receivers, the worst receiver's p99, the duplicates dropped and the
+page turns that never arrived. The host's clock is shared, so the one-way
+numbers are exact. Loopback multicast needs a multicast route (the default
+route is enough); the mode is skipped when the group cannot be joined.
+
+    python -m benchmarks.bench_relay [receivers] [turns] [interval]
+"""
+import multiprocessing
+import sys
+import time
+
+from net_relay import RelayOutput, RelayReceiver, DEFAULT_GROUP, REPEAT
+from page_output import Turn
+from telemetry import percentile
+
+BASE_PORT = 47600
+
+
+def receive(group, port, done, results):
+    try:
+        receiver = RelayReceiver(lambda *turn: None, group, port).start()
+    except OSError as e:
+        results.put(('error', repr(e)))
+        return
+    results.put(('ready', port))
+    done.wait()
+    # the last copies may still be in flight
+    time.sleep(0.2)
+    receiver.stop()
+    results.put(('done', receiver.summary(), list(receiver.latencies)))
+
+
+def run(mode, receivers, turns, interval, repeat):
+    ctx = multiprocessing.get_context('fork')
+    done = ctx.Event()
+    results = ctx.Queue()
+    group = DEFAULT_GROUP if mode == 'multicast' else None
+    ports = [BASE_PORT] * receivers if group else [BASE_PORT + i for i in range(receivers)]
+    processes = [ctx.Process(target=receive, args=(group, port, done, results), daemon=True) for port in ports]
+    for p in processes:
+        p.start()
+    try:
+        for _ in processes:
+            message = results.get(timeout=10)
+            if message[0] == 'error':
+                print(f'{mode:10s} repeat {repeat}: skipped, {message[1]}')
+                return
+        targets = [(group, BASE_PORT)] if group else [('127.0.0.1', port) for port in ports]
+        output = RelayOutput(targets=targets, repeat=repeat)
+        send = []
+        turn = Turn('next', None, None)
+        for _ in range(turns):
+            t0 = time.perf_counter()
+            output.turn(turn)
+            send.append((time.perf_counter() - t0) * 1000)
+            time.sleep(interval)
+        output.close()
+        done.set()
+        summaries = [results.get(timeout=10) for _ in processes]
+    finally:
+        done.set()
+        for p in processes:
+            p.join(5)
+    latencies = [ms for _, _, samples in summaries for ms in samples]
+    worst = max(s['p99_ms'] for _, s, _ in summaries)
+    received = sum(s['received'] for _, s, _ in summaries)
+    lost = turns * receivers - received
+    duplicates = sum(s['duplicates'] for _, s, _ in summaries)
+    print(f'{mode:10s} repeat {repeat}  send p50 {percentile(send, 50):.3f} ms  '
+          f'one-way p50 {percentile(latencies, 50):.3f} ms  p99 {percentile(latencies, 99):.3f} ms  '
+          f'max {max(latencies) if latencies else 0:.3f} ms  worst receiver p99 {worst:.3f} ms  '
+          f'lost {lost} ({100 * lost / (turns * receivers):.2f}%)  duplicates {duplicates}')
+
+
+def main():
+    receivers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    interval = float(sys.argv[3]) if len(sys.argv) > 3 else 0.002
+    print(f'{receivers} receivers, {turns} turns {interval * 1000:g} ms apart')
+    for mode in ('multicast', 'unicast'):
+        for repeat in (1, REPEAT):
+            run(mode, receivers, turns, interval, repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Cold start time of the CLI module.
+
+Runs ``python -X importtime -c "import midi_page_turn2"`` in a fresh interpreter
+and lists the slowest imports, then times a fresh process from spawn until the
+MIDI subsystem is initialised and (with a device id) the input is open, i.e.
+until the app would be listening.
+
+    python -m benchmarks.bench_startup [runs] [device_id]
+"""
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LISTEN_SCRIPT = """
+import midi_page_turn2
+midi_page_turn2.init_midi()
+device_id = {device_id!r}
+if device_id is not None:
+    from midi_input import open_input
+    open_input(device_id).close()
+"""
+
+
+def import_times():
+    """(cumulative_us, module) of every import, from -X importtime."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import midi_page_turn2'],
+                          cwd=ROOT, capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _self_us, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.rstrip()))
+    return rows, proc.returncode
+
+
+def time_process(args):
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable] + args, cwd=ROOT, capture_output=True, text=True)
+    return (time.perf_counter() - t0) * 1000, proc
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    device_id = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    rows, returncode = import_times()
+    if returncode != 0:
+        print('import midi_page_turn2 failed')
+    rows.sort(reverse=True)
+    print('slowest imports (cumulative):')
+    for cumulative, name in rows[:10]:
+        print(f'  {cumulative / 1000:8.2f} ms  {name.strip()}')
+
+    baseline = min(time_process(['-c', 'pass'])[0] for _ in range(runs))
+    imported = min(time_process(['-c', 'import midi_page_turn2'])[0] for _ in range(runs))
+    print(f'interpreter start        {baseline:8.2f} ms')
+    print(f'import midi_page_turn2   {imported:8.2f} ms')
+
+    samples = []
+    for _ in range(runs):
+        elapsed, proc = time_process(['-c', LISTEN_SCRIPT.format(device_id=device_id)])
+        if proc.returncode != 0:
+            print('start to listening failed:', proc.stderr.strip().splitlines()[-1])
+            return
+        samples.append(elapsed)
+    what = 'input open' if device_id is not None else 'MIDI initialised'
+    print(f'start to {what:15s} {min(samples):8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""Latency and cost of the MIDI thru.
+
+A feeder thread plays pitch bends carrying a 14 bit sequence number, plus pedal
+presses (CC 67) that the mapping consumes, into an input read by
+PedalSession.poll() with a MidiThru. Reported:
+
+- forward() cost per message by batch size, for a whole-batch write
+  (pygame.midi.Output) and a write per message (rtmidi), with and without
+  consumed messages to filter out
+- latency from the feeder to the thru output, and the part added by the thru
+  (from the end of read() to the write), for isolated notes and a flood
+
+By default the input is simulated in-process (the real RtMidiInput code behind
+its callback) and the output records the write time. ``--virtual`` plays into a
+virtual ALSA / CoreMIDI port and compares, message by message, the arrival time
+on the thru port with a second receiver connected directly to the source
+(python-rtmidi).
+
+    python -m benchmarks.bench_thru [--seconds 5] [--rate 20000] [--virtual]
+"""
+import argparse
+import threading
+import time
+from time import perf_counter
+
+from benchmarks.stress_input import SimulatedRtMidiInput
+from dispatch import KeyDispatcher
+from midi_page_turn2 import DEFAULT_RULES, LEFT_PEDAL
+from midi_thru import MidiThru, RtMidiThru, LENGTHS, VIRTUAL_PORT
+from pedal_session import PedalSession
+from telemetry import percentile
+
+ISOLATED_RATE = 100
+PRESSES_PER_SECOND = 4
+SOURCE_PORT = 'midi page turn thru bench'
+SEQ_MASK = 0x3FFF
+
+
+class NullThru(MidiThru):
+    """pygame.midi.Output: one call for the whole batch."""
+
+    def write(self, batch):
+        pass
+
+
+class PerMessageThru(MidiThru):
+    """rtmidi: one call per message, sliced to its length."""
+
+    def write(self, batch):
+        send = self._send
+        lengths = LENGTHS
+        for msg, _timestamp in batch:
+            send(msg[:lengths[msg[0]]])
+
+    def _send(self, message):
+        pass
+
+
+class SinkThru(MidiThru):
+    """Records when each pitch bend is written, and when its batch was read."""
+
+    def __init__(self, stamps, consumed=()):
+        super().__init__(consumed)
+        self.stamps = stamps
+        self.read_at = 0.0
+        self.total = []
+        self.added = []
+
+    def write(self, batch):
+        now = perf_counter()
+        stamps = self.stamps
+        added = now - self.read_at
+        for msg, _timestamp in batch:
+            if msg[0] == 0xE0:
+                self.total.append(now - stamps[msg[1] | msg[2] << 7])
+                self.added.append(added)
+
+
+def forward_cost(sizes=(1, 16, 256), messages=200000):
+    indices = PedalSession(SimulatedRtMidiInput(None, 'bench'), DEFAULT_RULES).decoder.actions.indices()
+    print('forward() per message:')
+    for size in sizes:
+        plain = [[[0xE0, i & 0x7F, 64, 0], i] for i in range(size)]
+        # one consumed pedal message in the batch: the filtered path
+        pedal = list(plain)
+        pedal[size // 2] = [[0xB0, LEFT_PEDAL, 127, 0], size // 2]
+        row = []
+        for cls in (NullThru, PerMessageThru):
+            for batch in (plain, pedal):
+                thru = cls(indices)
+                forward = thru.forward
+                n = max(1, messages // size)
+                t0 = perf_counter()
+                for _ in range(n):
+                    forward(batch)
+                row.append((perf_counter() - t0) / (n * size) * 1e9)
+        print(f'  batch {size:4d}  whole batch {row[0]:6.0f} ns ({row[1]:6.0f} ns with a pedal)  '
+              f'per message {row[2]:6.0f} ns ({row[3]:6.0f} ns with a pedal)')
+
+
+def feed(push, stamps, rate, seconds, stop):
+    """Pitch bends at ``rate`` and pedal presses, in bursts of one millisecond."""
+    start = perf_counter()
+    seq = 0
+    pedals = 0
+    next_pedal = 0.0
+    pressed = False
+    while not stop.is_set():
+        t = perf_counter() - start
+        if t >= seconds:
+            break
+        while seq < t * rate:
+            i = seq & SEQ_MASK
+            stamps[i] = perf_counter()
+            push([0xE0, i & 0x7F, i >> 7])
+            seq += 1
+        if t >= next_pedal:
+            push([0xB0, LEFT_PEDAL, 0 if pressed else 127])
+            pedals += 1
+            pressed = not pressed
+            next_pedal += 0.5 / PRESSES_PER_SECOND
+        time.sleep(0.001 if rate > 1000 else 1 / rate)
+    return seq, pedals
+
+
+def run_simulated(rate, seconds):
+    stamps = [0.0] * (SEQ_MASK + 1)
+    midi_in = SimulatedRtMidiInput(None, 'bench')
+    thru = SinkThru(stamps)
+    session = PedalSession(midi_in, DEFAULT_RULES, thru=thru).open()
+    read = midi_in.read
+
+    def stamped_read(max_events):
+        data = read(max_events)
+        thru.read_at = perf_counter()
+        return data
+
+    midi_in.read = stamped_read
+    dispatcher = KeyDispatcher(lambda key, count: None, maxsize=1024).start()
+    stop = threading.Event()
+    result = {}
+    feeder = threading.Thread(target=lambda: result.setdefault('sent', feed(midi_in.push, stamps, rate, seconds,
+                                                                            stop)), daemon=True)
+    feeder.start()
+    try:
+        while feeder.is_alive() or midi_in.wait(0):
+            if midi_in.wait(0.05):
+                session.poll(dispatcher)
+    finally:
+        stop.set()
+        feeder.join()
+        dispatcher.stop()
+    sent, pedals = result['sent']
+    return sent, pedals, thru, thru.total, thru.added
+
+
+class VirtualReceiver:
+    """An rtmidi input on ``port`` stamping the arrival of each pitch bend."""
+
+    def __init__(self, port):
+        import rtmidi
+        from midi_input import find_port
+        self.arrivals = {}
+        self.midi_in = rtmidi.MidiIn()
+        self.midi_in.open_port(find_port(self.midi_in.get_ports(), port))
+        self.midi_in.set_callback(self._on_message)
+
+    def _on_message(self, event, data=None):
+        message, _delta = event
+        if message[0] == 0xE0:
+            self.arrivals[message[1] | message[2] << 7] = perf_counter()
+
+    def close(self):
+        self.midi_in.close_port()
+
+
+def run_virtual(rate, seconds):
+    import rtmidi
+    from midi_input import RtMidiInput
+    source = rtmidi.MidiOut()
+    source.open_virtual_port(SOURCE_PORT)
+    midi_in = RtMidiInput(None, SOURCE_PORT)
+    session = PedalSession(midi_in, DEFAULT_RULES, thru=RtMidiThru()).open()
+    thru = session.thru.open()
+    direct = VirtualReceiver(SOURCE_PORT)
+    through = VirtualReceiver(VIRTUAL_PORT)
+    dispatcher = KeyDispatcher(lambda key, count: None, maxsize=1024).start()
+    stamps = [0.0] * (SEQ_MASK + 1)
+    stop = threading.Event()
+    result = {}
+    feeder = threading.Thread(target=lambda: result.setdefault('sent', feed(source.send_message, stamps, rate,
+                                                                            seconds, stop)), daemon=True)
+    feeder.start()
+    try:
+        while feeder.is_alive() or midi_in.wait(0.2):
+            if midi_in.wait(0.05):
+                session.poll(dispatcher)
+    finally:
+        stop.set()
+        feeder.join()
+        dispatcher.stop()
+        time.sleep(0.2)
+        for port in (direct, through, session, thru):
+            port.close()
+        source.close_port()
+    sent, pedals = result['sent']
+    total = [t - stamps[seq] for seq, t in through.arrivals.items()]
+    added = [t - direct.arrivals[seq] for seq, t in through.arrivals.items() if seq in direct.arrivals]
+    return sent, pedals, thru, total, added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='MIDI thru latency')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--rate', type=int, default=20000, help='flood messages per second')
+    parser.add_argument('--virtual', action='store_true', help='through virtual MIDI ports (python-rtmidi)')
+    args = parser.parse_args(argv)
+
+    forward_cost()
+    run = run_virtual if args.virtual else run_simulated
+    added_label = 'vs. direct' if args.virtual else 'added by thru'
+    print(f'{"virtual ports" if args.virtual else "simulated input"}, {args.seconds:g} s per load:')
+    for name, rate in (('isolated', ISOLATED_RATE), ('flood', args.rate)):
+        sent, pedals, thru, total, added = run(rate, args.seconds)
+        ms = [t * 1000 for t in total]
+        added = [t * 1000 for t in added]
+        print(f'  {name:8s} {rate:6d} msg/s  forwarded {thru.forwarded}/{sent}'
+              f'  pedals kept back {thru.filtered}/{pedals}  end to end p50 {percentile(ms, 50):.3f} ms '
+              f'p99 {percentile(ms, 99):.3f} ms  {added_label} p50 {percentile(added, 50):.3f} ms '
+              f'p99 {percentile(added, 99):.3f} ms  max {max(added):.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
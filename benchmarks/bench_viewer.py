@@ -0,0 +1,107 @@
+"""Turn-to-pixels time of the built-in score viewer, prefetched vs. rendered on demand.
+
+Pages through a large PDF with ``next`` turns handed to ScoreViewer.turn() like
+the dispatcher does, ``gap`` seconds apart (a musician does not turn every
+millisecond), and times each turn until the page is flipped to the screen:
+
+- ``prefetch N``: the next and previous N pages are rendered in the background
+  and a turn only blits a cached surface
+- ``on demand``: no prefetch and room for one page, every turn renders
+
+Without a PDF argument a score-like one is generated: staves and a few thousand
+vector note heads per page, which MuPDF takes a while to rasterize. Needs
+PyMuPDF and pygame; without DISPLAY SDL's dummy video driver is used.
+
+    python -m benchmarks.bench_viewer [score.pdf] [turns] [gap]
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from page_output import Turn
+from score_viewer import ScoreViewer
+
+PAGES = 400
+NOTES_PER_PAGE = 3000
+A4 = (595, 842)
+
+
+def make_score(path, pages=PAGES, notes=NOTES_PER_PAGE, seed=1):
+    import fitz
+    rnd = random.Random(seed)
+    doc = fitz.open()
+    width, height = A4
+    for n in range(pages):
+        page = doc.new_page(width=width, height=height)
+        shape = page.new_shape()
+        staves = [60 + i * 65 for i in range(11)]
+        for top in staves:
+            for line in range(5):
+                y = top + line * 6
+                shape.draw_line((40, y), (width - 40, y))
+        shape.finish(width=0.5)
+        for _ in range(notes):
+            top = rnd.choice(staves)
+            x = rnd.uniform(50, width - 50)
+            y = top + rnd.randrange(-4, 13) * 3
+            shape.draw_oval(fitz.Rect(x, y - 2.2, x + 6, y + 2.2))
+            shape.draw_line((x + 6, y), (x + 6, y - 18))
+        shape.finish(color=(0, 0, 0), fill=(0, 0, 0), width=0.6)
+        shape.insert_text((width / 2 - 10, height - 30), str(n + 1), fontsize=10)
+        shape.commit()
+    doc.save(path, deflate=True)
+    doc.close()
+
+
+def drive(viewer, turns, gap):
+    # wait for the first page, then turn like the dispatch thread would
+    viewer.prefetcher.wait_for(viewer.page, viewer.screen.get_size())
+    time.sleep(gap)
+    for _ in range(turns):
+        viewer.turn(Turn('next', None, None))
+        time.sleep(gap)
+    viewer.pygame.event.post(viewer.pygame.event.Event(viewer.pygame.QUIT))
+
+
+def run(path, name, turns, gap, **options):
+    viewer = ScoreViewer(path, **options)
+    driver = threading.Thread(target=drive, args=(viewer, turns, gap), daemon=True)
+    driver.start()
+    try:
+        viewer.run()
+    finally:
+        driver.join()
+        viewer.shutdown()
+    print(f'{name:12s} {viewer.format()}')
+
+
+def main():
+    args = sys.argv[1:]
+    path = args.pop(0) if args and not args[0].replace('.', '').isdigit() else None
+    turns = int(args[0]) if args else 100
+    gap = float(args[1]) if len(args) > 1 else 0.3
+    if not os.environ.get('DISPLAY'):
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    tmp = None
+    if path is None:
+        tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp.name, 'score.pdf')
+        t0 = time.perf_counter()
+        make_score(path)
+        print(f'generated {PAGES} pages in {time.perf_counter() - t0:.1f} s, '
+              f'{os.path.getsize(path) / 1e6:.1f} MB')
+    try:
+        print(f'{turns} turns, {gap} s apart')
+        run(path, 'prefetch 3', turns, gap, prefetch=3)
+        # budget below one page: only the page shown stays cached
+        run(path, 'on demand', turns, gap, prefetch=0, cache_mb=1)
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
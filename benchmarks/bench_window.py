@@ -0,0 +1,155 @@
+"""Per-key latency with the viewer window activated on every key vs. only when needed.
+
+Sends a harmless key (Shift) to a viewer window through:
+
+- ``always``: ``xdotool windowactivate --sync WINDOW key KEY`` for every key, the old path
+- ``subprocess``: SubprocessInjector, which activates the window only when the focus moved
+- ``xtest``: XTestInjector, the same without forking (python-xlib)
+
+once with the viewer keeping the focus, and once with another window taking
+the focus every ``steal_every`` keys.
+
+``windowactivate`` needs a window manager that supports _NET_ACTIVE_WINDOW.
+Without DISPLAY, Xvfb and the first window manager found of WINDOW_MANAGERS are
+started for the run.
+
+    python -m benchmarks.bench_window [count] [steal_every]
+"""
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from key_injector import SubprocessInjector, XTestInjector
+from telemetry import percentile
+from window_target import close_focus_tracker
+
+KEY = 'Shift_L'
+WINDOW_MANAGERS = ('openbox', 'fluxbox', 'icewm', 'xfwm4', 'metacity', 'marco')
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def stop(processes):
+    for p in reversed(processes):
+        p.terminate()
+        try:
+            p.wait(2)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+
+def start_xvfb():
+    """Start Xvfb and a window manager. Returns the processes to stop."""
+    xvfb = shutil.which('Xvfb')
+    if xvfb is None:
+        sys.exit('No DISPLAY and no Xvfb')
+    n = next(n for n in range(99, 200) if not os.path.exists(f'/tmp/.X11-unix/X{n}'))
+    processes = [subprocess.Popen([xvfb, f':{n}', '-screen', '0', '1024x768x24'],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)]
+    os.environ['DISPLAY'] = f':{n}'
+    if not wait_for(lambda: os.path.exists(f'/tmp/.X11-unix/X{n}')):
+        stop(processes)
+        sys.exit('Xvfb did not start')
+    wm = next((wm for wm in WINDOW_MANAGERS if shutil.which(wm)), None)
+    if wm is None:
+        stop(processes)
+        sys.exit(f'No window manager found, install one of {", ".join(WINDOW_MANAGERS)}')
+    processes.append(subprocess.Popen([wm], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    # let the window manager take over the root window
+    time.sleep(1)
+    print(f'started Xvfb :{n} with {wm}')
+    return processes
+
+
+def open_windows(titles):
+    """Map one window per title. Returns (window ids, close function)."""
+    try:
+        from Xlib import X, display
+    except ImportError:
+        processes = [subprocess.Popen(['xterm', '-title', title]) for title in titles]
+        ids = [int(subprocess.check_output(['xdotool', 'search', '--sync', '--name', title]).split()[0])
+               for title in titles]
+        return ids, lambda: stop(processes)
+    d = display.Display()
+    screen = d.screen()
+    ids = []
+    for title in titles:
+        window = screen.root.create_window(0, 0, 400, 300, 0, screen.root_depth,
+                                           X.InputOutput, X.CopyFromParent, event_mask=X.KeyPressMask)
+        window.set_wm_name(title)
+        window.set_wm_class(title, 'BenchViewer')
+        window.map()
+        ids.append(window.id)
+    d.sync()
+    time.sleep(0.5)
+    return ids, d.close
+
+
+def measure(send, count, steal=None, steal_every=0):
+    samples = []
+    send()
+    for i in range(count):
+        if steal_every and i % steal_every == 0:
+            steal()
+            # let the focus tracker see the change, outside of the timing
+            time.sleep(0.05)
+        t0 = time.perf_counter()
+        send()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def report(name, samples, target=None):
+    line = (f'{name:24s} mean {sum(samples) / len(samples):8.3f} ms  '
+            f'p50 {percentile(samples, 50):8.3f} ms  p99 {percentile(samples, 99):8.3f} ms')
+    if target is not None:
+        line += f'  activations {target.activations}  skipped {target.skipped}'
+    print(line)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    steal_every = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    processes = [] if os.environ.get('DISPLAY') else start_xvfb()
+    close_windows = None
+    try:
+        (viewer, other), close_windows = open_windows(['bench viewer', 'bench other'])
+
+        def steal():
+            subprocess.check_call(['xdotool', 'windowactivate', '--sync', str(other)])
+
+        def always():
+            subprocess.check_call(['xdotool', 'windowactivate', '--sync', str(viewer), 'key', KEY])
+
+        for steals in (0, steal_every):
+            suffix = f', steal every {steals}' if steals else ''
+            report(f'always{suffix}', measure(always, count, steal, steals))
+            for cls in (SubprocessInjector, XTestInjector):
+                try:
+                    injector = cls(hex(viewer))
+                except Exception as e:
+                    print(f'{cls.name:24s} skipped: {e!r}')
+                    continue
+                try:
+                    samples = measure(lambda: injector.send(KEY), count, steal, steals)
+                    report(f'{cls.name}{suffix}', samples, injector.target)
+                finally:
+                    injector.close()
+    finally:
+        if close_windows is not None:
+            close_windows()
+        close_focus_tracker()
+        stop(processes)
+
+
+if __name__ == '__main__':
+    main()
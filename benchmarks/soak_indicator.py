@@ -0,0 +1,67 @@
+"""Soak test of the turn indicators.
+
+Runs the Textual app headless, simulates thousands of pedal presses and checks
+that no timer is created per press and that the time to get each press on
+screen stays flat. Every press used to register a new interval timer, so both
+grew for the whole concert.
+
+Each press is timed until the app is idle again (``pilot.pause()``), i.e.
+until the style change has been processed and the screen refreshed. The timer
+check also runs as a test: ``python -m pytest tests/test_indicators.py``.
+
+    python -m benchmarks.soak_indicator [presses] [chunk]
+"""
+import asyncio
+import sys
+import time
+
+from telemetry import percentile
+
+
+def count_timers(app):
+    """List that gets one entry per timer the app creates from now on."""
+    created = []
+    for name in ('set_interval', 'set_timer'):
+        method = getattr(app, name)
+
+        def counted(*args, _method=method, **kwargs):
+            created.append(args)
+            return _method(*args, **kwargs)
+
+        setattr(app, name, counted)
+    return created
+
+
+async def soak(presses, chunk):
+    from ui import MidiPageTurnApp
+    app = MidiPageTurnApp()
+    rows = []
+    async with app.run_test() as pilot:
+        await pilot.pause()
+        created = count_timers(app)
+        for start in range(0, presses, chunk):
+            frames = []
+            for i in range(start, min(start + chunk, presses)):
+                t0 = time.perf_counter()
+                app.update_turn_status('next' if i % 3 else 'prev')
+                await pilot.pause()
+                frames.append((time.perf_counter() - t0) * 1000)
+            rows.append((start + chunk, len(created), percentile(frames, 50), percentile(frames, 99)))
+    return rows
+
+
+def main():
+    presses = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    chunk = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    rows = asyncio.run(soak(presses, chunk))
+    for done, timers, p50, p99 in rows:
+        print(f'{done:7d} presses  timers created {timers:4d}  press to refreshed p50 {p50:.3f} ms  p99 {p99:.3f} ms')
+
+    first, last = rows[0], rows[-1]
+    assert last[1] == 0, f'{last[1]} timers created by {last[0]} presses'
+    assert last[2] < first[2] * 2 + 0.05, f'refresh time grew from {first[2]:.3f} to {last[2]:.3f} ms'
+    print('OK: no timer per press and the refresh time stays flat')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""Input stress test: controller floods, small buffers and a stalling reader.
+
+A feeder thread pushes a mod wheel flood at ``rate`` messages per second plus
+pedal presses and releases (CC 67, 4 presses per second) into an input, while
+the reader runs PedalSession.poll() and stalls for ``stall`` ms every second
+(a GC pause, a busy UI). Reported per configuration: overflows, messages
+known lost, pedal presses that never became an edge, edge latency and the
+read size reached.
+
+By default the inputs are simulated in-process: the real PygameMidiInput and
+RtMidiInput code on top of a port that overflows the way PortMidi does (once
+full, everything is dropped until the reader has caught up with the overflow)
+and of the RtMidi callback. ``--virtual`` pushes through a virtual ALSA /
+CoreMIDI port instead (python-rtmidi, and pygame for the PortMidi backend).
+
+    python -m benchmarks.stress_input [--rate 20000] [--seconds 10] [--stall 200] [--virtual]
+"""
+import argparse
+import threading
+import time
+from collections import deque
+
+from dispatch import KeyDispatcher
+from midi_input import PygameMidiInput, RtMidiInput, MAX_READ
+from midi_page_turn2 import DEFAULT_RULES, LEFT_PEDAL
+from pedal_session import PedalSession
+from telemetry import percentile
+
+PRESSES_PER_SECOND = 4
+PORT_NAME = 'midi page turn stress'
+
+
+class SimulatedPortMidi:
+    """Stands in for pygame.midi.Input with PortMidi's overflow behaviour."""
+
+    OVERFLOW = object()
+
+    def __init__(self, buffer_size, clock):
+        self.buffer_size = buffer_size
+        self.clock = clock
+        self.queue = deque()
+        self.used = 0
+        self.overflowed = False
+        self.lock = threading.Lock()
+
+    def push(self, msg):
+        with self.lock:
+            if self.overflowed:
+                return
+            if self.used >= self.buffer_size:
+                self.overflowed = True
+                self.queue.append(self.OVERFLOW)
+                return
+            self.queue.append([msg + [0] * (4 - len(msg)), self.clock()])
+            self.used += 1
+
+    def poll(self):
+        return bool(self.queue)
+
+    def read(self, n):
+        out = []
+        with self.lock:
+            queue = self.queue
+            while queue and len(out) < n:
+                item = queue.popleft()
+                if item is self.OVERFLOW:
+                    self.overflowed = False
+                    self.used -= len(out)
+                    raise Exception("PortMidi: `Buffer overflow'")
+                out.append(item)
+            self.used -= len(out)
+        return out
+
+
+class SimulatedPygameInput(PygameMidiInput):
+
+    def open(self):
+        self._t0 = time.perf_counter()
+        self.midi_in = SimulatedPortMidi(self.buffer_size, self.time)
+
+    def push(self, msg):
+        self.midi_in.push(msg)
+
+    def time(self):
+        return int((time.perf_counter() - self._t0) * 1000)
+
+
+class SimulatedRtMidiInput(RtMidiInput):
+
+    def open(self):
+        pass
+
+    def push(self, msg):
+        self._on_message((msg, 0.0))
+
+    def close(self):
+        pass
+
+
+class VirtualPort:
+    """A virtual rtmidi output port and an input of ``backend`` opened on it."""
+
+    def __init__(self, backend, buffer_size):
+        import rtmidi
+        self.out = rtmidi.MidiOut()
+        self.out.open_virtual_port(PORT_NAME)
+        if backend == 'pygame':
+            import pygame.midi
+            pygame.midi.init()
+            ids = [i for i in range(pygame.midi.get_count())
+                   if PORT_NAME in pygame.midi.get_device_info(i)[1].decode('utf-8')
+                   and pygame.midi.get_device_info(i)[2]]
+            self.input = PygameMidiInput(ids[0], buffer_size=buffer_size)
+        else:
+            self.input = RtMidiInput(None, PORT_NAME, buffer_size)
+        self.input.push = self.out.send_message
+
+    def close(self):
+        self.input.close()
+        self.out.close_port()
+
+
+def feed(push, rate, seconds, stop, presses):
+    """Flood plus pedal presses, in bursts of one millisecond."""
+    start = time.perf_counter()
+    sent = 0
+    value = 0
+    next_pedal = 0.0
+    pressed = False
+    while not stop.is_set():
+        t = time.perf_counter() - start
+        if t >= seconds:
+            break
+        while sent < t * rate:
+            value = (value + 1) & 0x7F
+            push([0xB0, 1, value])
+            sent += 1
+        if t >= next_pedal:
+            push([0xB0, LEFT_PEDAL, 0 if pressed else 127])
+            if not pressed:
+                presses.append(t)
+            pressed = not pressed
+            next_pedal += 0.5 / PRESSES_PER_SECOND
+        time.sleep(0.001)
+    if pressed:
+        push([0xB0, LEFT_PEDAL, 0])
+    return sent
+
+
+def run(midi_in, rate, seconds, stall_ms, max_events=None, rearm=True, priority=True):
+    session = PedalSession(midi_in, DEFAULT_RULES).open()
+    # the behaviour before overflow handling, for comparison
+    if not rearm:
+        session.decoder.rearm = lambda: None
+    if not priority:
+        midi_in.priority = frozenset()
+    dispatcher = KeyDispatcher(lambda key, count: None, maxsize=1024).start()
+    stop = threading.Event()
+    presses = []
+    result = {}
+    feeder = threading.Thread(target=lambda: result.setdefault('sent', feed(midi_in.push, rate, seconds, stop,
+                                                                            presses)), daemon=True)
+    edges = 0
+    cpu = time.process_time()
+    feeder.start()
+    next_stall = time.monotonic() + 1
+    try:
+        while feeder.is_alive() or midi_in.wait(0):
+            if stall_ms and time.monotonic() >= next_stall:
+                time.sleep(stall_ms / 1000)
+                next_stall = time.monotonic() + 1
+            if midi_in.wait(0.05):
+                edges += len(session.poll(dispatcher, max_events))
+    finally:
+        stop.set()
+        feeder.join()
+        dispatcher.stop()
+    cpu = time.process_time() - cpu
+    health = midi_in.health
+    lat = session.stats.latencies
+    return {
+        'sent': result.get('sent', 0) + len(presses) * 2,
+        'read': session.stats.events,
+        'overflows': health.overflows,
+        'dropped': health.dropped,
+        'presses': len(presses),
+        'missed': len(presses) - edges,
+        'p50': percentile(lat, 50),
+        'p99': percentile(lat, 99),
+        'size': session.batch.size if max_events is None else max_events,
+        'full': session.batch.full,
+        'cpu': cpu / seconds * 100,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='MIDI input stress test')
+    parser.add_argument('--rate', type=int, default=20000, help='flood messages per second')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--stall', type=float, default=200, help='reader stall every second, ms')
+    parser.add_argument('--virtual', action='store_true', help='through a virtual MIDI port (python-rtmidi)')
+    args = parser.parse_args(argv)
+
+    configs = [
+        # backend, buffer, fixed read size or None for adaptive, re-arm after an overflow, pedal priority
+        ('pygame', 1024, 256, False, True),
+        ('pygame', 1024, 256, True, True),
+        ('pygame', 1024, None, True, True),
+        ('pygame', 4096, None, True, True),
+        ('rtmidi', 1024, None, True, False),
+        ('rtmidi', 1024, None, True, True),
+    ]
+    print(f'{args.rate} msg/s flood + {PRESSES_PER_SECOND} pedal presses/s for {args.seconds:g} s, '
+          f'reader stalls {args.stall:g} ms every second, {"virtual port" if args.virtual else "simulated"} input')
+    for backend, size, max_events, rearm, priority in configs:
+        if args.virtual:
+            port = VirtualPort(backend, size)
+            midi_in = port.input
+        else:
+            port = None
+            midi_in = (SimulatedPygameInput if backend == 'pygame' else SimulatedRtMidiInput)(None, 'stress', size)
+        try:
+            r = run(midi_in, args.rate, args.seconds, args.stall, max_events, rearm, priority)
+        finally:
+            if port is not None:
+                port.close()
+        read = 'adaptive' if max_events is None else f'fixed {max_events}'
+        print(f'  {backend:6s} buffer {size:5d}  read {read:9s}  re-arm {"yes" if rearm else "no":3s}  '
+              f'priority {"n/a" if backend == "pygame" else "yes" if priority else "no":3s}  overflows {r["overflows"]:3d}  '
+              f'lost {r["sent"] - r["read"]:6d}/{r["sent"]}  pedal presses missed {r["missed"]:2d}/{r["presses"]}  '
+              f'edge latency p50 {r["p50"]} ms p99 {r["p99"]} ms  read size {r["size"]:4d}/{MAX_READ}  '
+              f'full reads {r["full"]:4d}  cpu {r["cpu"]:.0f}%')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,537 @@
+"""Headless page turn daemon with a local control socket.
+
+The daemon owns the MIDI input, the decoder and the key injector for as long as
+it runs. UIs attach as thin clients over a UNIX socket instead of opening
+PortMidi themselves:
+
+    python daemon.py [--socket PATH] [--device ID_OR_NAME] [--backend rtmidi|pygame]
+    python ui.py --attach [PATH]
+
+Protocol: one JSON object per line in each direction. Every request has a
+``cmd`` and gets exactly one ``{"ok": true, ...}`` or ``{"ok": false, "error": ...}``
+reply, except ``subscribe`` which turns the connection into an event stream.
+
+    {"cmd": "ping"}
+    {"cmd": "devices"}
+    {"cmd": "select", "device": 3}              # PortMidi id, name, or null to close
+    {"cmd": "remap", "mapping": {"67": "next", "66": "prev"}}    # actions or key names
+    {"cmd": "stats"}
+    {"cmd": "subscribe"}                        # then {"event": "edge" | "tick" | "devices" | "mapping" | "overflow", ...}
+
+``--mapping FILE`` (or MIDI_PAGE_TURN_MAPPING) loads a mapping file, see
+mapping_config.py; it is reloaded when it changes, until a ``remap`` replaces it.
+The selected input is read by a PedalSession like in the CLI and the UI, so
+``--journal``, ``--thru``, ``--buffer-size``, ``--coalesce``, ``--metrics`` and
+the SIGUSR1 profiler work the same way.
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+from device_watcher import DeviceWatcher, DeviceInfo, ReconnectingInput, pygame_devices, rescan_pygame_devices
+from dispatch import KeyDispatcher, coalescing
+from midi_decoder import ActionTable, DEBOUNCE_MS, rule_label
+from mapping_config import MappingConfig, MappingWatcher, parse_rule
+from page_output import close_output, output_names
+from pedal_session import PedalSession, wait_any
+from telemetry import LoopStats, EventRateStore, PollTimings
+
+SOCKET_ENV = 'MIDI_PAGE_TURN_SOCKET'
+SUBSCRIBER_QUEUE_SIZE = 256
+TICK_INTERVAL = 1  # seconds
+
+
+def remap_rules(mapping):
+    """Rules for a ``{cc: action}`` remap, the action being a name of ACTIONS or a
+    key name like in a mapping file."""
+    from midi_page_turn2 import ACTIONS
+    return [parse_rule({'cc': cc, 'action': action}, ACTIONS) for cc, action in mapping.items()]
+
+
+def default_socket_path():
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'midi-page-turn.sock')
+    return os.path.join(tempfile.gettempdir(), f'midi-page-turn-{os.getuid()}.sock')
+
+
+class DaemonError(Exception):
+    pass
+
+
+class PageTurnDaemon:
+    """Receive thread + control server around one MIDI input.
+
+    PortMidi is only touched from the receive thread. Control requests that need
+    it (``devices``, ``select``) are queued with ``call()`` and run between two
+    waits of the receive loop.
+
+    ``journal`` is a file to journal to (event_journal.py), ``thru`` an output spec
+    of midi_thru.open_thru(), ``buffer_size`` the input buffer (midi_input.py),
+    ``coalesce`` a ``(policy, max_coalesce)`` pair of dispatch.coalescing();
+    ``timings`` gives the sessions a PollTimings for the metrics exporter.
+    """
+
+    def __init__(self, socket_path=None, mapping=None, backend=None, send=None, journal=None, thru=None,
+                 buffer_size=None, coalesce=None, timings=False):
+        if send is None:
+            from midi_page_turn2 import turn_page as send
+        if mapping is None:
+            from midi_page_turn2 import load_mapping_config
+            mapping = load_mapping_config()
+        elif isinstance(mapping, dict):
+            mapping = MappingConfig(remap_rules(mapping), DEBOUNCE_MS, None)
+        self.socket_path = socket_path or default_socket_path()
+        self.backend = backend
+        # MappingConfig
+        self.mapping = mapping
+        self.table = ActionTable(mapping.rules)
+        self.mapping_watcher = None
+        if journal is not None:
+            from event_journal import EventJournal
+            journal = EventJournal(journal)
+        self.journal = journal
+        self.thru_spec = thru
+        # the MidiThru, opened by the receive thread
+        self.thru = None
+        self.buffer_size = buffer_size
+        self.timings = timings
+        coalesce, max_coalesce = coalesce or coalescing()
+        self.dispatcher = KeyDispatcher(send, coalesce=coalesce, max_coalesce=max_coalesce, journal=journal)
+        # kept across selects, like the decoder state was
+        self.stats = LoopStats()
+        self.rates = EventRateStore()
+        # PedalSession of the selected input
+        self.session = None
+        self.devices = []
+        self.devices_changed = threading.Event()
+        self.watcher = DeviceWatcher(self.devices_changed.set)
+        self.subscribers = set()
+        self.subscriber_drops = 0
+        self._calls = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self.server = None
+
+    @property
+    def midi_in(self):
+        session = self.session
+        return session.midi_in if session is not None else None
+
+    # receive thread
+
+    def call(self, fn, *args, timeout=5):
+        """Run ``fn`` on the receive thread and return its result."""
+        future = Future()
+        self._calls.put((future, fn, args))
+        return future.result(timeout)
+
+    def _run_calls(self):
+        while True:
+            try:
+                future, fn, args = self._calls.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _receive(self):
+        import pygame.midi
+        pygame.midi.init()
+        self.devices = pygame_devices()
+        if self.thru_spec is not None:
+            from midi_thru import open_thru
+            try:
+                self.thru = open_thru(self.thru_spec)
+            except (ImportError, OSError) as e:
+                self.publish({'event': 'error', 'error': f'MIDI thru: {e}'})
+        next_tick = time.monotonic() + TICK_INTERVAL
+        dispatcher = self.dispatcher
+        try:
+            while not self._stop.is_set():
+                self._run_calls()
+
+                if self.devices_changed.is_set():
+                    self.devices_changed.clear()
+                    session = self.session
+                    if session is not None:
+                        self.devices = session.midi_in.rescan()
+                        if not session.midi_in.connected:
+                            session.decoder.reset()
+                    else:
+                        self.devices = rescan_pygame_devices()
+                    self.publish({'event': 'devices', 'devices': [d._asdict() for d in self.devices]})
+
+                now = time.monotonic()
+                if now >= next_tick:
+                    next_tick = now + TICK_INTERVAL
+                    self.publish({'event': 'tick', 'events': self.rates.total,
+                                  'connected': self.midi_in is not None and self.midi_in.connected})
+
+                session = self.session
+                if session is None:
+                    time.sleep(0.05)
+                    continue
+                if not wait_any([session], 0.1):
+                    continue
+
+                stats = session.stats
+                events = stats.events
+                overflows = session.overflows
+                edges = session.poll(dispatcher)
+                self.rates.add(stats.events - events)
+                for edge in edges:
+                    self.publish({'event': 'edge', 'channel': edge.channel, 'cc': edge.cc,
+                                  'key': edge.key, 'action': edge.action, 'timestamp': edge.timestamp})
+                if session.overflows != overflows:
+                    gap = session.midi_in.health.gaps[-1]
+                    self.publish({'event': 'overflow', 'start': gap.start, 'end': gap.end, 'dropped': gap.dropped})
+        finally:
+            self._close_session()
+            if self.thru is not None:
+                self.thru.close()
+            pygame.midi.quit()
+
+    def _close_session(self):
+        session = self.session
+        if session is not None:
+            self.session = None
+            session.close()
+
+    def _select(self, device):
+        self._close_session()
+        if device is None:
+            return None
+        matches = [d for d in self.devices if d.is_input and device in (d.id, d.name)]
+        if not matches:
+            raise DaemonError(f'No such input device: {device}')
+        midi_in = ReconnectingInput(matches[0].id, matches[0].name, backend=self.backend, buffer_size=self.buffer_size)
+        session = PedalSession(midi_in, self.table, journal=self.journal, thru=self.thru,
+                               debounce_ms=self.mapping.debounce_ms)
+        session.stats = self.stats
+        if self.timings:
+            session.timings = PollTimings()
+        self.stats.reset()
+        self.session = session.open()
+        return matches[0]
+
+    def remap(self, config):
+        """Switch to the MappingConfig ``config``, keeping the pedal state and the open port."""
+        self.table = ActionTable(config.rules)
+        self.mapping = config
+        session = self.session
+        if session is not None:
+            # the receive loop picks the new decoder up on its next batch
+            session.remap(self.table, debounce_ms=config.debounce_ms)
+        self.publish({'event': 'mapping', 'rules': self.rules()})
+
+    def rules(self):
+        return [{'label': rule_label(r), 'action': r.action, 'key': r.key} for r in self.mapping.rules]
+
+    def publish(self, event):
+        line = (json.dumps(event) + '\n').encode('utf-8')
+        for q in list(self.subscribers):
+            try:
+                q.put_nowait(line)
+            except queue.Full:
+                # a slow client loses events, the receive loop never waits for it
+                self.subscriber_drops += 1
+
+    # control commands
+
+    def handle(self, request):
+        cmd = request.get('cmd')
+        if cmd == 'ping':
+            return {}
+        if cmd == 'devices':
+            return {'devices': [d._asdict() for d in self.call(lambda: self.devices)]}
+        if cmd == 'select':
+            device = self.call(self._select, request.get('device'))
+            return {'device': device._asdict() if device is not None else None}
+        if cmd == 'remap':
+            mapping = {int(cc): action for cc, action in request['mapping'].items()}
+            config = MappingConfig(remap_rules(mapping), self.mapping.debounce_ms, None)
+            if self.mapping_watcher is not None:
+                # saving the file must not silently undo the remap
+                self.mapping_watcher.stop()
+                self.mapping_watcher = None
+            self.remap(config)
+            return {'mapping': {str(cc): action for cc, action in mapping.items()}}
+        if cmd == 'stats':
+            midi_in = self.midi_in
+            return {
+                'device': midi_in.device_name if midi_in is not None else None,
+                'connected': midi_in is not None and midi_in.connected,
+                'backend': midi_in.name if midi_in is not None else None,
+                'loop': self.stats.summary(),
+                'dispatch': self.dispatcher.counters(),
+                'suppressed': self.session.decoder.suppressed if self.session is not None else 0,
+                'overflows': midi_in.health.overflows if midi_in is not None else 0,
+                'rates': {'30s': self.rates.summary(30), '5min': self.rates.summary(300),
+                          'session': self.rates.summary()},
+                'subscribers': len(self.subscribers),
+                'subscriber_drops': self.subscriber_drops,
+                'rules': self.rules(),
+                'mapping_file': self.mapping.path,
+            }
+        raise DaemonError(f'Unknown command: {cmd}')
+
+    # lifecycle
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            # a stale socket from a daemon that did not shut down cleanly
+            client = DaemonClient(self.socket_path, timeout=0.5)
+            try:
+                client.request('ping')
+            except OSError:
+                os.unlink(self.socket_path)
+            else:
+                raise DaemonError(f'Daemon already running on {self.socket_path}')
+            finally:
+                client.close()
+        # created private: no window between bind() and a chmod() for others to connect
+        umask = os.umask(0o077)
+        try:
+            self.server = ControlServer(self.socket_path, self)
+        finally:
+            os.umask(umask)
+        self.dispatcher.start()
+        self._thread = threading.Thread(target=self._receive, name='midi-receive', daemon=True)
+        self._thread.start()
+        self.watcher.start()
+        if self.mapping.path is not None:
+            from midi_page_turn2 import ACTIONS
+            self.mapping_watcher = MappingWatcher(
+                self.mapping.path, ACTIONS, self.remap,
+                lambda e: self.publish({'event': 'error', 'error': str(e)})).start()
+        threading.Thread(target=self.server.serve_forever, name='control-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        self.watcher.stop()
+        if self.mapping_watcher is not None:
+            self.mapping_watcher.stop()
+            self.mapping_watcher = None
+        if self._thread is not None:
+            self._thread.join(2)
+            self._thread = None
+        self.dispatcher.stop()
+        close_output()
+        if self.journal is not None:
+            self.journal.close()
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        daemon = self.server.daemon
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request.get('cmd') == 'subscribe':
+                    self.stream(daemon)
+                    return
+                reply = {'ok': True}
+                reply.update(daemon.handle(request))
+            except Exception as e:
+                reply = {'ok': False, 'error': str(e)}
+            self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+    def stream(self, daemon):
+        q = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        daemon.subscribers.add(q)
+        try:
+            self.wfile.write(b'{"ok": true}\n')
+            while not daemon._stop.is_set():
+                try:
+                    line = q.get(timeout=1)
+                except queue.Empty:
+                    continue
+                self.wfile.write(line)
+        except OSError:
+            # client went away
+            pass
+        finally:
+            daemon.subscribers.discard(q)
+
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, daemon):
+        self.daemon = daemon
+        super().__init__(path, ControlHandler)
+
+
+class DaemonClient:
+    """Client side of the control socket."""
+
+    def __init__(self, path=None, timeout=5):
+        self.path = path or default_socket_path()
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        # one request/reply at a time on the shared connection
+        self._lock = threading.Lock()
+
+    def _connect(self, timeout):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(self.path)
+        return sock
+
+    def request(self, cmd, **args):
+        with self._lock:
+            return self._request(cmd, args)
+
+    def _request(self, cmd, args):
+        if self._sock is None:
+            self._sock = self._connect(self.timeout)
+            self._file = self._sock.makefile('rwb')
+        request = dict(args, cmd=cmd)
+        self._file.write((json.dumps(request) + '\n').encode('utf-8'))
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            self.close()
+            raise OSError('Daemon closed the connection')
+        reply = json.loads(line)
+        if not reply.pop('ok'):
+            raise DaemonError(reply['error'])
+        return reply
+
+    def devices(self):
+        return [DeviceInfo(**d) for d in self.request('devices')['devices']]
+
+    def events(self, poll_interval=0.2, stop=None):
+        """Yield events from a new subscription; yields None every ``poll_interval``
+        seconds without events so the caller can check for cancellation."""
+        sock = self._connect(self.timeout)
+        try:
+            sock.sendall(b'{"cmd": "subscribe"}\n')
+            sock.settimeout(poll_interval)
+            buffer = b''
+            acked = False
+            while stop is None or not stop.is_set():
+                try:
+                    chunk = sock.recv(65536)
+                except socket.timeout:
+                    yield None
+                    continue
+                if not chunk:
+                    return
+                buffer += chunk
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    if not acked:
+                        acked = True
+                        continue
+                    yield json.loads(line)
+        finally:
+            sock.close()
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = None
+            self._file = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless MIDI page turn daemon')
+    parser.add_argument('--socket', default=None, help=f'control socket path (default: {default_socket_path()})')
+    parser.add_argument('--device', default=None, help='input device to open at start, PortMidi id or name')
+    parser.add_argument('--backend', default=None, choices=['rtmidi', 'pygame'])
+    parser.add_argument('--mapping', default=None, metavar='FILE', help='pedal mapping file (TOML or YAML)')
+    parser.add_argument('--output', default=None, choices=output_names(), help='where page turns go (default: keys)')
+    parser.add_argument('--journal', default=None, metavar='FILE',
+                        help='write pedal edges and page turns to FILE, see event_journal.py')
+    parser.add_argument('--buffer-size', type=int, default=None, metavar='MESSAGES',
+                        help='MIDI messages buffered between two reads, default $MIDI_PAGE_TURN_BUFFER or 4096')
+    parser.add_argument('--coalesce', default=None, metavar='POLICY',
+                        help='how queued presses of one key are merged: none, adjacent or adjacent:MAX, '
+                             'default $MIDI_PAGE_TURN_COALESCE or adjacent:8')
+    parser.add_argument('--thru', nargs='?', const='', default=None, metavar='OUTPUT',
+                        help='forward what is played, pedals excepted, to a PortMidi output id or name, default '
+                             '$MIDI_PAGE_TURN_THRU or a virtual port')
+    parser.add_argument('--metrics', nargs='?', const='', default=None, metavar='PORT_OR_FILE',
+                        help='export OpenMetrics on localhost:PORT (default 9747) or to FILE, see metrics.py')
+    parser.add_argument('--profile-dir', default=None, metavar='DIR',
+                        help='where the sampling profiler (SIGUSR1) writes its stacks')
+    args = parser.parse_args(argv)
+
+    import midi_page_turn2
+    try:
+        mapping = midi_page_turn2.load_mapping_config(args.mapping)
+        coalesce = coalescing(args.coalesce)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    midi_page_turn2.OUTPUT = args.output
+    if midi_page_turn2.needs_window():
+        midi_page_turn2.select_target_window()
+
+    from metrics import SamplingProfiler, toggle_on_signal
+    daemon = PageTurnDaemon(args.socket, mapping=mapping, backend=args.backend, journal=args.journal, thru=args.thru,
+                            buffer_size=args.buffer_size, coalesce=coalesce, timings=args.metrics is not None).start()
+    print(f'Listening for control connections on {daemon.socket_path}')
+    profiler = SamplingProfiler(directory=args.profile_dir)
+    exporter = None
+    if args.metrics is not None:
+        from metrics import MetricsRegistry, start_exporter
+        registry = MetricsRegistry(lambda: [daemon.session], daemon.dispatcher, profiler, lambda: daemon.thru)
+        exporter = start_exporter(registry, args.metrics)
+        print(f'Metrics: {exporter.where}')
+    if toggle_on_signal(profiler, print):
+        print(f'Profiler: kill -USR1 {os.getpid()} to start and stop')
+    try:
+        if args.device is not None:
+            device = int(args.device) if args.device.isdigit() else args.device
+            print('Opened', daemon.call(daemon._select, device).name)
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print('Closing ... ', end='')
+        if profiler.running:
+            profiler.stop()
+        daemon.stop()
+        if exporter is not None:
+            exporter.stop()
+        print('Done')
+        print(daemon.stats.format())
+        print(daemon.dispatcher.format())
+        if daemon.journal is not None:
+            print(f'Journal: {daemon.journal.records} records in {daemon.journal.path}')
+        if profiler.path is not None:
+            print(f'Profile: {profiler.format()}')
+        if daemon.thru is not None:
+            thru = daemon.thru
+            print(f'MIDI thru: {thru.forwarded} messages forwarded, {thru.filtered} pedal messages kept back, '
+                  f'{thru.errors} failed writes')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
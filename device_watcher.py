@@ -0,0 +1,284 @@
+"""MIDI device hot-plug support.
+
+PortMidi reads the device list once, in ``pygame.midi.init()``. Seeing a device
+that was plugged in later needs ``pygame.midi.quit()`` + ``init()``, which also
+invalidates every open PortMidi stream. So the work is split in two:
+
+- ``DeviceWatcher`` polls a cheap snapshot of the system's MIDI ports (rtmidi port
+  names, or ``/proc/asound/seq/clients`` on Linux) and only says "something changed".
+- ``ReconnectingInput`` is owned by the receive loop. On a change it rescans
+  PortMidi (closing its own stream first when it is a PortMidi one) and reopens
+  the selected input by name, so the decoder, dispatcher and stats keep running.
+"""
+import re
+import threading
+import time
+from collections import namedtuple
+
+from midi_input import open_input, InputHealth
+
+ALSA_SEQ_CLIENTS = '/proc/asound/seq/clients'
+# the ALSA client of our own PortMidi, renumbered by every rescan
+PORTMIDI_CLIENT = 'PortMidi'
+_ALSA_CLIENT = re.compile(r'^Client\s+(\d+)\s*:\s*"(.*)"')
+_ALSA_PORT = re.compile(r'^\s+Port\s+(\d+)\s*:\s*"(.*)"')
+
+
+class DeviceInfo(namedtuple('DeviceInfo', 'id name is_input is_output opened')):
+    """One row of ``pygame.midi.get_device_info()`` with its PortMidi id."""
+
+    __slots__ = ()
+
+    @property
+    def type(self):
+        if self.is_input and self.is_output:
+            return "IN/OUT"
+        elif self.is_input:
+            return "IN"
+        elif self.is_output:
+            return "OUT"
+        return ''
+
+    @property
+    def key(self):
+        """Stable identity across rescans: PortMidi ids change, names do not."""
+        return f'{self.name}/{"in" if self.is_input else "out"}'
+
+
+def pygame_devices():
+    """The devices PortMidi knew about at its last init()."""
+    import pygame.midi
+    devices = []
+    for i in range(pygame.midi.get_count()):
+        interf, name, is_input, is_output, opened = pygame.midi.get_device_info(i)
+        devices.append(DeviceInfo(i, name.decode('utf-8'), bool(is_input), bool(is_output), bool(opened)))
+    return devices
+
+
+def rescan_pygame_devices():
+    """Re-initialise PortMidi and enumerate again. Closes every PortMidi stream."""
+    import pygame.midi
+    if pygame.midi.get_init():
+        pygame.midi.quit()
+    pygame.midi.init()
+    return pygame_devices()
+
+
+def diff_devices(old, new):
+    """(added, removed, changed) lists of DeviceInfo, matched by ``key``."""
+    old_by_key = {d.key: d for d in old}
+    new_by_key = {d.key: d for d in new}
+    added = [d for k, d in new_by_key.items() if k not in old_by_key]
+    removed = [d for k, d in old_by_key.items() if k not in new_by_key]
+    changed = [d for k, d in new_by_key.items() if k in old_by_key and old_by_key[k] != d]
+    return added, removed, changed
+
+
+def _rtmidi_snapshot():
+    import rtmidi
+    midi_in, midi_out = rtmidi.MidiIn(), rtmidi.MidiOut()
+    try:
+        return tuple(midi_in.get_ports()), tuple(midi_out.get_ports())
+    finally:
+        midi_in.delete()
+        midi_out.delete()
+
+
+def parse_alsa_clients(text):
+    """``frozenset`` of ``(client, client name, port, port name)`` in the text of
+    /proc/asound/seq/clients. Only the names: the pool counters of the file change
+    with every event, 'cur clients' with every program opening the sequencer."""
+    ports = set()
+    client = None
+    for line in text.splitlines():
+        m = _ALSA_CLIENT.match(line)
+        if m is not None:
+            client = None if m.group(2) == PORTMIDI_CLIENT else (int(m.group(1)), m.group(2))
+            if client is not None:
+                ports.add(client + (None, None))
+            continue
+        m = _ALSA_PORT.match(line)
+        if m is not None and client is not None:
+            ports.add(client + (int(m.group(1)), m.group(2)))
+    return frozenset(ports)
+
+
+def _alsa_snapshot():
+    with open(ALSA_SEQ_CLIENTS) as f:
+        return parse_alsa_clients(f.read())
+
+
+def snapshot_function():
+    """The cheapest way to notice port changes here, or None if there is none."""
+    for fn in (_rtmidi_snapshot, _alsa_snapshot):
+        try:
+            fn()
+            return fn
+        except (ImportError, OSError):
+            continue
+    return None
+
+
+class DeviceWatcher:
+    """Calls ``on_change()`` from a background thread when the MIDI ports change."""
+
+    def __init__(self, on_change, interval=0.25, snapshot=None):
+        self.on_change = on_change
+        self.interval = interval
+        self.snapshot = snapshot or snapshot_function()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def available(self):
+        return self.snapshot is not None
+
+    def start(self):
+        if not self.available or self._thread is not None:
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='device-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval * 4)
+            self._thread = None
+
+    def _run(self):
+        last = self.snapshot()
+        while not self._stop.wait(self.interval):
+            try:
+                current = self.snapshot()
+            except OSError:
+                continue
+            if current != last:
+                last = current
+                self.on_change()
+
+
+class ReconnectingInput:
+    """An input backend that survives the device being unplugged and plugged back.
+
+    Has the same ``wait``/``read``/``time``/``close`` interface as the backends in
+    midi_input.py. While the device is away ``wait()`` just sleeps.
+    """
+
+    def __init__(self, device_id, device_name=None, backend=None, buffer_size=None):
+        self.device_id = device_id
+        self.device_name = device_name
+        self.backend = backend
+        self.buffer_size = buffer_size
+        self.midi_in = None
+        self.reconnects = 0
+        # passed on to every backend opened, see MidiInputBackend
+        self.on_data = None
+        self.health = InputHealth()
+        self._priority = frozenset()
+
+    @property
+    def name(self):
+        return self.midi_in.name if self.midi_in is not None else (self.backend or 'none')
+
+    @property
+    def connected(self):
+        return self.midi_in is not None
+
+    @property
+    def can_notify(self):
+        return self.midi_in is not None and self.midi_in.can_notify
+
+    @property
+    def priority(self):
+        return self._priority
+
+    @priority.setter
+    def priority(self, indices):
+        self._priority = indices
+        if self.midi_in is not None:
+            self.midi_in.priority = indices
+
+    def _notify(self):
+        on_data = self.on_data
+        if on_data is not None:
+            on_data()
+
+    def open(self):
+        self.midi_in = open_input(self.device_id, self.device_name, backend=self.backend,
+                                  buffer_size=self.buffer_size)
+        self.midi_in.on_data = self._notify
+        self.midi_in.health = self.health
+        self.midi_in.priority = self._priority
+        self.device_name = self.midi_in.device_name
+        # reopen with the same backend after a reconnect
+        self.backend = self.midi_in.name
+        return self
+
+    def _lost(self):
+        if self.midi_in is not None:
+            try:
+                self.midi_in.close()
+            except Exception:
+                pass
+            self.midi_in = None
+
+    def rescan(self):
+        """Rescan PortMidi and reopen the input by name. Returns the new device list."""
+        return rescan_inputs([self])
+
+    def _reattach(self, devices, was_connected):
+        matches = [d for d in devices if d.is_input and d.name == self.device_name]
+        if not matches:
+            self._lost()
+        elif self.midi_in is None:
+            self.device_id = matches[0].id
+            try:
+                self.open()
+                if was_connected is False:
+                    self.reconnects += 1
+            except Exception:
+                self.midi_in = None
+
+    def wait(self, timeout=None) -> bool:
+        if self.midi_in is None:
+            time.sleep(timeout or 0)
+            return False
+        try:
+            return self.midi_in.wait(timeout)
+        except Exception:
+            self._lost()
+            return False
+
+    def read(self, max_events):
+        if self.midi_in is None:
+            return []
+        try:
+            return self.midi_in.read(max_events)
+        except Exception:
+            self._lost()
+            return []
+
+    def time(self) -> int:
+        return self.midi_in.time() if self.midi_in is not None else 0
+
+    def close(self):
+        self._lost()
+
+
+def rescan_inputs(inputs):
+    """Rescan PortMidi once for several ReconnectingInputs and reopen each by name.
+
+    A rescan closes every PortMidi stream of the process, so the inputs of one
+    process have to be rescanned together. Returns the new device list.
+    """
+    was_connected = [midi_in.connected for midi_in in inputs]
+    for midi_in in inputs:
+        if midi_in.midi_in is not None and midi_in.midi_in.name == 'pygame':
+            # PortMidi streams do not survive a rescan
+            midi_in._lost()
+    devices = rescan_pygame_devices()
+    for midi_in, connected in zip(inputs, was_connected):
+        midi_in._reattach(devices, connected)
+    return devices
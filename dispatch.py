@@ -0,0 +1,194 @@
+"""Asynchronous key dispatch between the MIDI decoder and the injector.
+
+The receive loop only enqueues keys; a worker thread sends them. A slow injector
+(``xdotool --sync`` waiting for the window manager, for example) then delays the
+page turn but never the reading of the following MIDI messages.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from telemetry import percentile, LatencyHistogram, FAST_BUCKETS_MS
+
+# coalescing policies
+COALESCE_NONE = 'none'          # one send() per press
+COALESCE_ADJACENT = 'adjacent'  # N queued presses of the same key become send(key, N)
+COALESCE_ENV = 'MIDI_PAGE_TURN_COALESCE'
+MAX_COALESCE = 8
+
+# where a page turn comes from, journalled with it
+SOURCE_PEDAL = 0
+SOURCE_FOLLOWER = 1
+
+
+def coalescing(spec=None):
+    """``(coalesce, max_coalesce)`` from ``spec`` or MIDI_PAGE_TURN_COALESCE:
+    ``none``, ``adjacent`` or ``adjacent:N`` (at most N presses per send)."""
+    spec = spec or os.environ.get(COALESCE_ENV) or COALESCE_ADJACENT
+    policy, _, limit = spec.partition(':')
+    if policy not in (COALESCE_NONE, COALESCE_ADJACENT):
+        raise ValueError(f'Unknown coalescing policy: {policy}')
+    if not limit:
+        return policy, MAX_COALESCE
+    if not limit.isdigit() or int(limit) < 1:
+        raise ValueError(f'Invalid coalescing limit: {limit}')
+    return policy, int(limit)
+
+
+class KeyDispatcher:
+    """Bounded dispatch queue with a dedicated worker thread.
+
+    ``send(key, count)`` is called from the worker thread. When the queue already
+    holds ``maxsize`` keys, new keys are dropped and counted rather than blocking
+    the receive loop.
+
+    When keys are queued with their device timestamp and ``clock`` returns the
+    current time on the same clock (``midi_in.time``), ``device_latency`` is a
+    histogram of device timestamp to injection done. Keys from several inputs
+    pass their own clock to ``put()``.
+
+    ``send_time`` is a histogram of the ``send()`` calls themselves. Sent, dropped
+    and failed keys go to ``journal`` (an EventJournal) if given, with the
+    ``source`` they were queued with; keys of different sources are never
+    coalesced together.
+    """
+
+    def __init__(self, send, maxsize=32, coalesce=COALESCE_ADJACENT, max_coalesce=MAX_COALESCE,
+                 max_samples=1024, clock=None, journal=None):
+        if coalesce not in (COALESCE_NONE, COALESCE_ADJACENT):
+            raise ValueError(f'Unknown coalescing policy: {coalesce}')
+        self.send = send
+        self.maxsize = maxsize
+        self.coalesce = coalesce
+        self.max_coalesce = max_coalesce
+        self.clock = clock
+        self.journal = journal
+
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+        self.enqueued = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.last_error = None
+        self.max_depth = 0
+        self.latencies = deque(maxlen=max_samples)
+        self.device_latency = LatencyHistogram()
+        self.send_time = LatencyHistogram(FAST_BUCKETS_MS)
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return self
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='key-dispatch', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2):
+        """Stop the worker after the keys already queued have been sent."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def put(self, key, timestamp=None, clock=None, source=SOURCE_PEDAL) -> bool:
+        """Queue ``key`` without blocking. Returns False if it was dropped.
+
+        ``timestamp`` is the device timestamp (ms) of the pedal edge and ``clock``
+        the clock it is on, ``self.clock`` by default. ``source`` is SOURCE_PEDAL
+        or SOURCE_FOLLOWER.
+        """
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                self.dropped += 1
+                if self.journal is not None:
+                    self.journal.dropped(key, timestamp, source)
+                return False
+            self._items.append((key, time.perf_counter(), timestamp, clock or self.clock, source))
+            self.enqueued += 1
+            depth = len(self._items)
+            if depth > self.max_depth:
+                self.max_depth = depth
+            self._cond.notify()
+        return True
+
+    @property
+    def depth(self):
+        return len(self._items)
+
+    def _next(self):
+        """Pop the next key, merged with the queued presses behind it if allowed."""
+        with self._cond:
+            while not self._items:
+                if not self._running:
+                    return None
+                self._cond.wait()
+            key, queued_at, timestamp, clock, source = self._items.popleft()
+            count = 1
+            if self.coalesce == COALESCE_ADJACENT:
+                items = self._items
+                while items and items[0][0] == key and items[0][4] == source and count < self.max_coalesce:
+                    items.popleft()
+                    count += 1
+            return key, count, queued_at, timestamp, clock, source
+
+    def _run(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            key, count, queued_at, timestamp, clock, source = item
+            sending = time.perf_counter()
+            try:
+                self.send(key, count)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = e
+                if self.journal is not None:
+                    self.journal.error(key, timestamp, source)
+                continue
+            sent = time.perf_counter()
+            self.send_time.record((sent - sending) * 1000)
+            dispatch_ms = (sent - queued_at) * 1000
+            self.latencies.append(dispatch_ms)
+            device_ms = None
+            if timestamp is not None and clock is not None:
+                device_ms = clock() - timestamp
+                self.device_latency.record(device_ms)
+            if self.journal is not None:
+                self.journal.dispatch(key, count, timestamp, dispatch_ms, device_ms, source)
+            self.dispatched += count
+            self.coalesced += count - 1
+
+    def counters(self):
+        lat = self.latencies
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'enqueued': self.enqueued,
+            'dispatched': self.dispatched,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'dispatch_p50_ms': percentile(lat, 50),
+            'dispatch_p99_ms': percentile(lat, 99),
+            'dispatch_max_ms': max(lat) if lat else 0,
+            'device_latency': self.device_latency.summary(),
+        }
+
+    def format(self):
+        c = self.counters()
+        d = c['device_latency']
+        return ('queue {depth}/{max_depth}  sent {dispatched}  dropped {dropped}  '
+                'coalesced {coalesced}  errors {errors}  dispatch p50 {dispatch_p50_ms:.2f} ms  '
+                'p99 {dispatch_p99_ms:.2f} ms  max {dispatch_max_ms:.2f} ms').format(**c) + (
+                '  device-to-key p50 <= {p50_ms} ms  p99 <= {p99_ms} ms  max {max_ms} ms'.format(**d)
+                if d['count'] else '')
@@ -0,0 +1,228 @@
+"""Append-only binary journal of a listening session.
+
+The receive and dispatch threads only append a tuple to a deque (one atomic
+call, no lock, no formatting); a background writer packs them and writes them
+to the file in batches every ``flush_interval`` seconds.
+
+File format (little endian)::
+
+    b'MPTJRN1\\n' <d start_unix_time>
+    per record: <B kind> <B action> <B channel> <B number> <B value> <I timestamp_ms> <I extra> <f ms>
+    NAME records are followed by ``number`` bytes: the UTF-8 name of action code ``action``
+
+Records:
+
+- ``edge``      pedal edge decoded, ``timestamp`` device time, ``ms`` device time to decoded
+- ``dispatch``  page turn sent, ``number`` presses coalesced, ``extra`` queue to sent in us,
+                ``ms`` device time to sent, ``channel`` its source: 0 a pedal edge,
+                1 the score follower (dispatch.SOURCE_*)
+- ``dropped``   page turn dropped, dispatch queue full, ``channel`` its source
+- ``error``     the output failed to send the page turn, ``channel`` its source
+- ``stats``     ``timestamp`` device clock, ``extra`` MIDI events so far, ``value`` input
+                connected, ``ms`` debounced presses so far
+- ``overflow``  the input buffer overflowed, messages were lost between ``timestamp`` and
+                ``extra`` (device time); ``ms`` messages lost, -1 if unknown
+
+    python event_journal.py info FILE      # turns, latency percentiles, missed edges
+    python event_journal.py dump FILE
+"""
+import argparse
+import struct
+import sys
+import threading
+import time
+from collections import deque, namedtuple, Counter
+
+from dispatch import SOURCE_PEDAL, SOURCE_FOLLOWER
+from telemetry import percentile
+
+MAGIC = b'MPTJRN1\n'
+HEADER = struct.Struct('<d')
+RECORD = struct.Struct('<5BIIf')
+
+NAME, EDGE, DISPATCH, DROPPED, ERROR, STATS, OVERFLOW = range(7)
+KIND_NAMES = ('name', 'edge', 'dispatch', 'dropped', 'error', 'stats', 'overflow')
+
+SOURCE_NAMES = ('pedal', 'follower')
+
+Record = namedtuple('Record', 'kind action channel number value timestamp extra ms')
+
+
+def _action(key):
+    # dispatcher keys are Turns, plain keys in the benchmarks
+    return getattr(key, 'action', None) or str(key)
+
+
+class EventJournal:
+    """Journal file written by a background thread.
+
+    The recording methods can be called from any thread. When the writer falls
+    ``max_pending`` records behind, new records are counted in ``lost`` instead.
+    """
+
+    def __init__(self, path, flush_interval=0.5, max_pending=65536):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.records = 0
+        self.lost = 0
+        self._pending = deque()
+        self._codes = {}
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC + HEADER.pack(time.time()))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='journal-writer', daemon=True)
+        self._thread.start()
+
+    def _append(self, record):
+        if len(self._pending) >= self.max_pending:
+            self.lost += 1
+            return
+        self._pending.append(record)
+
+    def edge(self, edge, latency_ms):
+        self._append((EDGE, edge.action, edge.channel, edge.cc, edge.value or 0, edge.timestamp, 0, latency_ms))
+
+    def dispatch(self, key, count, timestamp, dispatch_ms, device_ms, source=SOURCE_PEDAL):
+        self._append((DISPATCH, _action(key), source, count, 0, timestamp or 0, int(dispatch_ms * 1000),
+                      device_ms if device_ms is not None else -1))
+
+    def dropped(self, key, timestamp, source=SOURCE_PEDAL):
+        self._append((DROPPED, _action(key), source, 0, 0, timestamp or 0, 0, 0))
+
+    def error(self, key, timestamp, source=SOURCE_PEDAL):
+        self._append((ERROR, _action(key), source, 0, 0, timestamp or 0, 0, 0))
+
+    def stats(self, now, events, suppressed=0, connected=True):
+        self._append((STATS, None, 0, 0, int(connected), now, events, suppressed))
+
+    def overflow(self, gap):
+        self._append((OVERFLOW, None, 0, 0, 0, gap.start, gap.end, -1 if gap.dropped is None else gap.dropped))
+
+    def _code(self, name, out):
+        code = self._codes.get(name)
+        if code is None:
+            code = self._codes[name] = len(self._codes) + 1
+            raw = name.encode('utf-8')[:255]
+            out += RECORD.pack(NAME, code, 0, len(raw), 0, 0, 0, 0) + raw
+        return code
+
+    def flush(self):
+        """Write the pending records. Called by the writer thread."""
+        pending = self._pending
+        out = bytearray()
+        n = 0
+        while pending:
+            kind, action, channel, number, value, timestamp, extra, ms = pending.popleft()
+            code = 0 if action is None else self._code(action, out)
+            out += RECORD.pack(kind, code, channel, number, value, timestamp & 0xFFFFFFFF,
+                               extra & 0xFFFFFFFF, ms)
+            n += 1
+        if out:
+            self.file.write(out)
+            self.file.flush()
+            self.records += n
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(2)
+        self.flush()
+        self.file.close()
+
+
+def read_journal(path):
+    """``(start_unix_time, [Record])`` with the action codes resolved to names."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f'{path}: not a journal')
+    pos = len(MAGIC)
+    (start,) = HEADER.unpack_from(data, pos)
+    pos += HEADER.size
+    names = {0: None}
+    records = []
+    # a journal cut by a crash ends with a partial record
+    while pos + RECORD.size <= len(data):
+        fields = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        if fields[0] == NAME:
+            names[fields[1]] = data[pos:pos + fields[3]].decode('utf-8', 'replace')
+            pos += fields[3]
+            continue
+        records.append(Record(fields[0], names.get(fields[1]), *fields[2:]))
+    return start, records
+
+
+def summarize(records):
+    edges = [r for r in records if r.kind == EDGE]
+    sent = [r for r in records if r.kind == DISPATCH]
+    stats = [r for r in records if r.kind == STATS]
+    # the follower's turns have no edge, they must not hide the missed ones
+    turns = sum(r.number for r in sent if r.channel == SOURCE_PEDAL)
+    auto_turns = sum(r.number for r in sent if r.channel == SOURCE_FOLLOWER)
+    device = [r.ms for r in sent if r.ms >= 0]
+    dispatch = [r.extra / 1000 for r in sent]
+    decode = [r.ms for r in edges]
+    return {
+        'edges': len(edges),
+        'turns': turns,
+        'auto_turns': auto_turns,
+        'actions': dict(Counter(r.action for r in edges)),
+        'dropped': sum(r.kind == DROPPED for r in records),
+        'errors': sum(r.kind == ERROR for r in records),
+        # edges that never became a page turn, whatever the reason
+        'missed': max(0, len(edges) - turns),
+        'events': stats[-1].extra if stats else None,
+        'debounced': int(stats[-1].ms) if stats else None,
+        'disconnected': sum(not r.value for r in stats),
+        'overflows': sum(r.kind == OVERFLOW for r in records),
+        'decode_p50_ms': percentile(decode, 50),
+        'decode_p99_ms': percentile(decode, 99),
+        'dispatch_p50_ms': percentile(dispatch, 50),
+        'dispatch_p99_ms': percentile(dispatch, 99),
+        'device_p50_ms': percentile(device, 50),
+        'device_p99_ms': percentile(device, 99),
+        'device_max_ms': max(device) if device else 0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Listening session journals')
+    sub = parser.add_subparsers(dest='command', required=True)
+    info = sub.add_parser('info', help='summarise a session')
+    info.add_argument('file')
+    dump = sub.add_parser('dump', help='print every record')
+    dump.add_argument('file')
+    args = parser.parse_args(argv)
+
+    try:
+        start, records = read_journal(args.file)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if args.command == 'dump':
+        for r in records:
+            where = (f'{SOURCE_NAMES[r.channel]:8s}' if r.kind in (DISPATCH, DROPPED, ERROR)
+                     else f'ch {r.channel + 1:2d}   ')
+            print(f'{KIND_NAMES[r.kind]:8s} {r.action or "-":6s} {where} #{r.number:<3d} '
+                  f'val {r.value:3d}  t {r.timestamp:10d}  extra {r.extra:8d}  {r.ms:8.2f} ms')
+        return
+    s = summarize(records)
+    print(f'{args.file}: session of {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start))}, {len(records)} records')
+    print(f'  {s["turns"]} page turns from {s["edges"]} pedal edges  '
+          + '  '.join(f'{action} {n}' for action, n in sorted(s['actions'].items()))
+          + (f'  {s["auto_turns"]} automatic page turns' if s['auto_turns'] else ''))
+    print(f'  missed {s["missed"]}  (dropped {s["dropped"]}, errors {s["errors"]})  '
+          f'debounced {s["debounced"]}  MIDI events {s["events"]}  disconnected ticks {s["disconnected"]}  '
+          f'overflows {s["overflows"]}')
+    print(f'  device to decoded   p50 {s["decode_p50_ms"]:.2f} ms  p99 {s["decode_p99_ms"]:.2f} ms')
+    print(f'  queued to sent      p50 {s["dispatch_p50_ms"]:.2f} ms  p99 {s["dispatch_p99_ms"]:.2f} ms')
+    print(f'  device to sent      p50 {s["device_p50_ms"]:.2f} ms  p99 {s["device_p99_ms"]:.2f} ms  '
+          f'max {s["device_max_ms"]:.2f} ms')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
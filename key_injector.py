@@ -0,0 +1,278 @@
+"""Key injectors used by ``sendkey()``.
+
+Spawning ``xdotool`` or ``powershell .\\Send-KeyPress.ps1`` for every page turn costs
+tens to hundreds of milliseconds (PowerShell compiles the C# helper on every call).
+An injector is created once and kept open for the whole session:
+
+- ``xtest``: talks to the X server directly through python-xlib and the XTEST extension.
+- ``uinput``: writes to a virtual keyboard through python-evdev (Wayland, console).
+  The key goes to whatever window has the focus.
+- ``helper``: one persistent ``Send-KeyPress.ps1 -Serve`` process fed over a pipe (Windows).
+- ``subprocess``: the old one-process-per-key path, kept as a fallback and for benchmarks.
+- ``null``: sends nothing, for replays and benchmarks.
+"""
+import os
+import platform
+import subprocess
+import time
+
+from window_target import window_target, close_focus_tracker
+
+INJECTOR_ENV = 'MIDI_PAGE_TURN_INJECTOR'
+
+
+class KeyInjector:
+    """Base class of the injectors. ``key`` is an X keysym name or a Windows VK code."""
+
+    name = 'base'
+
+    def __init__(self, window=None):
+        self.window = window
+
+    def send(self, key, count=1):
+        """Press and release ``key`` ``count`` times."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SubprocessInjector(KeyInjector):
+    """One xdotool / PowerShell process per key press.
+
+    ``windowactivate --sync`` only runs when the viewer does not have the focus,
+    see window_target.py.
+    """
+
+    name = 'subprocess'
+
+    def __init__(self, window=None):
+        super().__init__(window)
+        self.target = None if platform.system() == 'Windows' else window_target(window)
+
+    def send(self, key, count=1):
+        if platform.system() == 'Windows':
+            for _ in range(count):
+                subprocess.check_call(['powershell', '.\\Send-KeyPress.ps1', '-KeyCode', key])
+            return
+        keys = ['key', '--repeat', str(count), key]
+        if self.target is not None and self.target.ensure_active(
+                lambda window_id: subprocess.check_call(['xdotool', 'windowactivate', '--sync', str(window_id)] + keys)):
+            return
+        subprocess.check_call(['xdotool'] + keys)
+
+
+class XTestInjector(KeyInjector):
+    """Direct XTEST key events over a long-lived X connection."""
+
+    name = 'xtest'
+
+    # how long to wait for the window manager to move the focus
+    ACTIVATE_TIMEOUT = 0.2
+
+    def __init__(self, window=None):
+        super().__init__(window)
+        from Xlib import X, XK, display
+        from Xlib.ext import xtest
+        self._X = X
+        self._XK = XK
+        self._xtest = xtest
+        self.display = display.Display()
+        if not self.display.has_extension('XTEST'):
+            self.display.close()
+            raise IOError('X server has no XTEST extension')
+        self.root = self.display.screen().root
+        self._net_active_window = self.display.intern_atom('_NET_ACTIVE_WINDOW')
+        self._keycodes = {}
+        self.target = window_target(window)
+
+    def keycode(self, key):
+        code = self._keycodes.get(key)
+        if code is None:
+            keysym = self._XK.string_to_keysym(key)
+            if keysym == self._X.NoSymbol:
+                raise ValueError(f'Unknown key: {key}')
+            code = self.display.keysym_to_keycode(keysym)
+            self._keycodes[key] = code
+        return code
+
+    def active_window(self):
+        prop = self.root.get_full_property(self._net_active_window, self._X.AnyPropertyType)
+        return prop.value[0] if prop is not None and len(prop.value) else None
+
+    def activate(self, window_id):
+        """Same as ``xdotool windowactivate --sync`` without the fork.
+
+        Raises OSError, like xdotool failing, for a window that is gone (a
+        restarted viewer), so WindowTarget looks for it again.
+        """
+        from Xlib.protocol import event
+        from Xlib.error import XError
+        try:
+            if self.active_window() == window_id:
+                return
+            window = self.display.create_resource_object('window', window_id)
+            # BadWindow if it was closed; the ClientMessage alone would be ignored silently
+            window.get_attributes()
+            # source indication 2: request from a pager, honoured by most window managers
+            ev = event.ClientMessage(window=window, client_type=self._net_active_window,
+                                     data=(32, [2, self._X.CurrentTime, 0, 0, 0]))
+            mask = self._X.SubstructureRedirectMask | self._X.SubstructureNotifyMask
+            self.root.send_event(ev, event_mask=mask)
+            self.display.flush()
+        except XError as e:
+            raise OSError(f'Cannot activate window {window_id:#x}: {e}') from e
+        deadline = time.monotonic() + self.ACTIVATE_TIMEOUT
+        while self.active_window() != window_id and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    def send(self, key, count=1):
+        X = self._X
+        code = self.keycode(key)
+        if self.target is not None:
+            self.target.ensure_active(self.activate)
+        for _ in range(count):
+            self._xtest.fake_input(self.display, X.KeyPress, code)
+            self._xtest.fake_input(self.display, X.KeyRelease, code)
+        self.display.sync()
+
+    def close(self):
+        self.display.close()
+
+
+class UInputInjector(KeyInjector):
+    """Virtual keyboard through /dev/uinput. Needs write access to /dev/uinput."""
+
+    name = 'uinput'
+
+    KEYS = {
+        'Page_Up': 'KEY_PAGEUP',
+        'Page_Down': 'KEY_PAGEDOWN',
+        'Left': 'KEY_LEFT',
+        'Right': 'KEY_RIGHT',
+        'Up': 'KEY_UP',
+        'Down': 'KEY_DOWN',
+        'space': 'KEY_SPACE',
+        'Home': 'KEY_HOME',
+        'End': 'KEY_END',
+        'Shift_L': 'KEY_LEFTSHIFT',
+    }
+
+    def __init__(self, window=None):
+        super().__init__(window)
+        from evdev import UInput, ecodes
+        self._ecodes = ecodes
+        self._codes = {key: getattr(ecodes, name) for key, name in self.KEYS.items()}
+        self.device = UInput({ecodes.EV_KEY: list(self._codes.values())}, name='midi-page-turn')
+
+    def send(self, key, count=1):
+        code = self._codes.get(key)
+        if code is None:
+            raise ValueError(f'Unknown key: {key}')
+        ecodes = self._ecodes
+        for _ in range(count):
+            self.device.write(ecodes.EV_KEY, code, 1)
+            self.device.syn()
+            self.device.write(ecodes.EV_KEY, code, 0)
+            self.device.syn()
+
+    def close(self):
+        self.device.close()
+
+
+class HelperProcessInjector(KeyInjector):
+    """A single long-lived helper process that reads one key per line from stdin."""
+
+    name = 'helper'
+
+    def __init__(self, window=None, command=None):
+        super().__init__(window)
+        if command is None:
+            script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Send-KeyPress.ps1')
+            command = ['powershell', '-NoProfile', '-NoLogo', '-ExecutionPolicy', 'Bypass',
+                       '-File', script, '-Serve']
+        self.command = command
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        text=True, bufsize=1)
+
+    def send(self, key, count=1):
+        self.process.stdin.write(f'{key}\n' * count)
+        self.process.stdin.flush()
+        # wait for the acks so a dead helper is noticed on this key, not the next one
+        for _ in range(count):
+            if self.process.stdout.readline().strip() != 'ok':
+                raise IOError(f'Key helper exited with {self.process.poll()}')
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            try:
+                self.process.wait(2)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class NullInjector(KeyInjector):
+    """Sends nothing. For replays and benchmarks on headless machines."""
+
+    name = 'null'
+
+    def __init__(self, window=None):
+        super().__init__(window)
+        self.sent = 0
+
+    def send(self, key, count=1):
+        self.sent += count
+
+
+INJECTORS = {
+    XTestInjector.name: XTestInjector,
+    UInputInjector.name: UInputInjector,
+    HelperProcessInjector.name: HelperProcessInjector,
+    SubprocessInjector.name: SubprocessInjector,
+    NullInjector.name: NullInjector,
+}
+
+
+def default_injectors():
+    if platform.system() == 'Windows':
+        return [HelperProcessInjector.name, SubprocessInjector.name]
+    if os.environ.get('DISPLAY'):
+        # uinput cannot activate the viewer window, xdotool can
+        return [XTestInjector.name, SubprocessInjector.name]
+    return [UInputInjector.name, SubprocessInjector.name]
+
+
+def create_injector(window=None, kind=None):
+    """Create the first injector that works here.
+
+    ``kind`` (or the MIDI_PAGE_TURN_INJECTOR environment variable) forces one of
+    the names in ``INJECTORS``.
+    """
+    kind = kind or os.environ.get(INJECTOR_ENV)
+    names = [kind] if kind else default_injectors()
+    for name in names[:-1]:
+        try:
+            return INJECTORS[name](window)
+        except Exception:
+            # not installed, no X display, no access to /dev/uinput, ...
+            continue
+    return INJECTORS[names[-1]](window)
+
+
+_injectors = {}
+
+
+def get_injector(window=None):
+    """The process-wide injector of ``window``, created on first use."""
+    injector = _injectors.get(window)
+    if injector is None:
+        injector = _injectors[window] = create_injector(window)
+    return injector
+
+
+def close_injector():
+    while _injectors:
+        _window, injector = _injectors.popitem()
+        injector.close()
+    close_focus_tracker()
@@ -0,0 +1,154 @@
+"""Pedal mapping config files.
+
+A mapping file lists the MIDI messages that turn pages and what they do. TOML
+(``tomllib``, or ``tomli`` before Python 3.11) and YAML (PyYAML, when installed)
+are read::
+
+    debounce_ms = 100           # optional
+    window = "0x3a00007"        # optional default target window of every rule
+
+    [[rule]]
+    cc = 67                     # or note = 60, or program = 5
+    action = "next"             # next / prev / left / right, or a key name
+    channel = 1                 # 1-16, every channel when omitted
+    threshold = 64              # press threshold (CC value or note velocity)
+    release = 32                # back to <= release before the next press
+    window = "0x3a00007"        # optional target window of this rule
+
+The rules are compiled once into the flat ``ActionTable`` of midi_decoder.py, so
+the decoder's cost per message does not depend on how many rules there are.
+``MappingWatcher`` reloads the file when it changes; the receive loops swap the
+decoder and keep the port open.
+"""
+import os
+import threading
+from collections import namedtuple
+
+from midi_decoder import Rule, ActionTable, PRESS_THRESHOLD, RELEASE_THRESHOLD, DEBOUNCE_MS
+
+MAPPING_ENV = 'MIDI_PAGE_TURN_MAPPING'
+
+MappingConfig = namedtuple('MappingConfig', 'rules debounce_ms path')
+
+
+class MappingError(ValueError):
+    pass
+
+
+def _parse(path, data):
+    if path.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise MappingError(f'{path}: reading YAML needs PyYAML (pip install pyyaml)')
+        return yaml.safe_load(data) or {}
+    try:
+        import tomllib
+    except ImportError:
+        import tomli as tomllib
+    return tomllib.loads(data.decode('utf-8'))
+
+
+def parse_rule(entry, actions, default_window=None):
+    """``Rule`` for one ``[[rule]]`` entry. ``actions`` maps action names to keys."""
+    kinds = [kind for kind in ('cc', 'note', 'program') if kind in entry]
+    if len(kinds) != 1:
+        raise MappingError('a rule needs exactly one of cc, note or program')
+    kind = kinds[0]
+    number = int(entry[kind])
+    channel = entry.get('channel')
+    if channel is not None:
+        channel = int(channel)
+        if not 1 <= channel <= 16:
+            raise MappingError(f'channel {channel} is not in 1-16')
+        channel -= 1
+    action = str(entry.get('action', ''))
+    if not action:
+        raise MappingError('a rule needs an action')
+    # action names from the app, anything else is sent as a key name
+    key = entry.get('key', actions.get(action, action))
+    window = entry.get('window', default_window)
+    return Rule(kind, channel, number, action, key,
+                int(entry.get('threshold', PRESS_THRESHOLD)),
+                int(entry.get('release', RELEASE_THRESHOLD)),
+                str(window) if window is not None else None)
+
+
+def load_mapping(path, actions):
+    """Read and validate a mapping file. Raises MappingError."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        doc = _parse(path, data)
+    except MappingError:
+        raise
+    except Exception as e:
+        raise MappingError(f'{path}: {e}')
+    entries = doc.get('rule', doc.get('rules', []))
+    if not entries:
+        raise MappingError(f'{path}: no rules')
+    rules = []
+    for i, entry in enumerate(entries):
+        try:
+            rules.append(parse_rule(entry, actions, doc.get('window')))
+        except (MappingError, TypeError, ValueError) as e:
+            raise MappingError(f'{path}: rule {i + 1}: {e}')
+    config = MappingConfig(rules, int(doc.get('debounce_ms', DEBOUNCE_MS)), path)
+    # compile once here so a bad threshold is reported at load time
+    try:
+        ActionTable(config.rules)
+    except ValueError as e:
+        raise MappingError(f'{path}: {e}')
+    return config
+
+
+class MappingWatcher:
+    """Reloads a mapping file when it changes and calls ``on_change(config)`` from
+    a background thread. A file that fails to load is reported to ``on_error(e)``
+    and the previous mapping stays in use."""
+
+    def __init__(self, path, actions, on_change, on_error=None, interval=1.0):
+        self.path = path
+        self.actions = actions
+        self.on_change = on_change
+        self.on_error = on_error
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='mapping-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval * 4)
+            self._thread = None
+
+    def _run(self):
+        last = self._stamp()
+        while not self._stop.wait(self.interval):
+            current = self._stamp()
+            # editors replace the file, so a missing file is not a change yet
+            if current is None or current == last:
+                continue
+            last = current
+            try:
+                config = load_mapping(self.path, self.actions)
+            except (OSError, MappingError) as e:
+                if self.on_error is not None:
+                    self.on_error(e)
+                continue
+            self.on_change(config)
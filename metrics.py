@@ -0,0 +1,415 @@
+"""Metrics exporter and sampling profiler for diagnosing a show.
+
+A ``MetricsRegistry`` reads the counters and histograms the pipeline already
+keeps (LoopStats, PollTimings, the decoder's debounce counter, KeyDispatcher)
+when it is scraped; nothing is added to the hot path but the three clock reads
+of PollTimings. The text is OpenMetrics (Prometheus can scrape it):
+
+- ``midi_page_turn_input_*``: events, polls, edges, debounced presses, connection
+  state, buffer overflows, read size, read()/decode time and device-to-decode
+  latency, per input;
+- ``midi_page_turn_dispatch_*``: queued, sent, dropped, coalesced and failed
+  page turns, queue depth, send() time and device-to-turn latency;
+- ``midi_page_turn_thru_*``: messages forwarded and filtered by the MIDI thru;
+- process CPU time, uptime, threads and the profiler state.
+
+It is served on localhost or written to a file every few seconds (atomically,
+for node_exporter's textfile collector or a plain ``watch cat``):
+
+    python midi_page_turn2.py --metrics [PORT | HOST:PORT | FILE]
+    curl -s localhost:9747/metrics
+
+``SamplingProfiler`` records the stacks of every thread at a fixed interval
+while it runs, in the folded format of flamegraph.pl and speedscope. Toggle it
+with 'p' in the UI or SIGUSR1 in the CLI; each run is written to
+``profile-YYYYmmdd-HHMMSS.folded``. Threads waiting (for MIDI, for a key to
+send) show up in their wait call.
+"""
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+
+DEFAULT_PORT = 9747
+FILE_INTERVAL = 5  # seconds between writes of a metrics file
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+PREFIX = 'midi_page_turn_'
+
+# samples are (suffix, labels, value)
+Metric = namedtuple('Metric', 'name kind help samples')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(int(value))
+
+
+def render(metrics):
+    """OpenMetrics text of ``metrics``, the samples of one name together."""
+    lines = []
+    for m in metrics:
+        lines.append(f'# TYPE {m.name} {m.kind}')
+        lines.append(f'# HELP {m.name} {m.help}')
+        for suffix, labels, value in m.samples:
+            lines.append(f'{m.name}{suffix}{_labels(labels)} {_number(value)}')
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def histogram_samples(hist, labels=None):
+    """Cumulative ``_bucket``, ``_count`` and ``_sum`` samples of a LatencyHistogram,
+    converted from ms to seconds."""
+    labels = labels or {}
+    # the receive thread may record while we read: count from the same snapshot
+    counts = list(hist.counts)
+    samples = []
+    seen = 0
+    for bound, n in zip(hist.bounds, counts):
+        seen += n
+        samples.append(('_bucket', dict(labels, le=repr(bound / 1000)), seen))
+    seen += counts[-1]
+    samples.append(('_bucket', dict(labels, le='+Inf'), seen))
+    samples.append(('_count', labels, seen))
+    samples.append(('_sum', labels, hist.sum / 1000))
+    return samples
+
+
+class _Families:
+    """Samples added by name, in the order the names first appear."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, name, kind, help, samples):
+        name = PREFIX + name
+        if name not in self.metrics:
+            self.metrics[name] = Metric(name, kind, help, [])
+        self.metrics[name].samples.extend(samples)
+
+    def counter(self, name, help, value, labels=None):
+        self.add(name, 'counter', help, [('_total', labels or {}, value)])
+
+    def gauge(self, name, help, value, labels=None):
+        self.add(name, 'gauge', help, [('', labels or {}, value)])
+
+    def histogram(self, name, help, hist, labels=None):
+        self.add(name, 'histogram', help, histogram_samples(hist, labels))
+
+    def __iter__(self):
+        return iter(self.metrics.values())
+
+
+def session_metrics(families, sessions):
+    """Counters of PedalSessions, labelled with their input."""
+    for session in sessions:
+        labels = {'input': session.label or session.midi_in.name}
+        midi_in = session.midi_in
+        families.counter('input_events', 'MIDI messages read', session.stats.events, labels)
+        families.counter('input_debounced', 'pedal presses suppressed by the debounce',
+                         session.decoder.suppressed, labels)
+        families.gauge('input_connected', '1 while the input device is connected',
+                       int(getattr(midi_in, 'connected', True)), labels)
+        if hasattr(midi_in, 'reconnects'):
+            families.counter('input_reconnects', 'times the input was reopened after an unplug',
+                             midi_in.reconnects, labels)
+        health = getattr(midi_in, 'health', None)
+        if health is not None:
+            families.counter('input_overflows', 'times the input buffer overflowed and messages were lost',
+                             health.overflows, labels)
+            families.counter('input_dropped', 'messages known lost to a full buffer (rtmidi)', health.dropped, labels)
+        families.gauge('input_read_size', 'events asked for by the next read()', session.batch.size, labels)
+        families.counter('input_full_reads', 'reads that came back full', session.batch.full, labels)
+        timings = session.timings
+        if timings is None:
+            continue
+        families.counter('input_polls', 'batches read and decoded', timings.polls, labels)
+        families.counter('input_edges', 'pedal edges decoded', timings.edges, labels)
+        families.histogram('input_read_seconds', 'time in the input read()', timings.read, labels)
+        families.histogram('input_decode_seconds', 'time decoding one batch', timings.decode, labels)
+        families.histogram('input_edge_latency_seconds', 'device timestamp of a pedal edge to its decoding',
+                           timings.latency, labels)
+
+
+def dispatcher_metrics(families, dispatcher):
+    families.counter('dispatch_enqueued', 'page turns queued', dispatcher.enqueued)
+    families.counter('dispatch_sent', 'page turns sent, coalesced ones included', dispatcher.dispatched)
+    families.counter('dispatch_dropped', 'page turns dropped on a full queue', dispatcher.dropped)
+    families.counter('dispatch_coalesced', 'page turns merged into a previous send', dispatcher.coalesced)
+    families.counter('dispatch_errors', 'page turns whose send failed', dispatcher.errors)
+    families.gauge('dispatch_queue_depth', 'page turns waiting', dispatcher.depth)
+    families.gauge('dispatch_queue_max_depth', 'deepest the queue has been', dispatcher.max_depth)
+    families.histogram('dispatch_send_seconds', 'time in the output send (sendkey, D-Bus, relay)',
+                       dispatcher.send_time)
+    families.histogram('dispatch_device_latency_seconds', 'device timestamp of a pedal edge to the page turn sent',
+                       dispatcher.device_latency)
+
+
+class MetricsRegistry:
+    """What a scrape reports.
+
+    ``sessions``, ``dispatcher`` and ``thru`` are read on every scrape and may be
+    functions returning them, for pipelines that come and go (the UI's).
+    """
+
+    def __init__(self, sessions=(), dispatcher=None, profiler=None, thru=None):
+        self.sessions = sessions
+        self.dispatcher = dispatcher
+        self.profiler = profiler
+        self.thru = thru
+        self.started = time.monotonic()
+        self.scrapes = 0
+
+    def collect(self):
+        families = _Families()
+        sessions = self.sessions() if callable(self.sessions) else self.sessions
+        session_metrics(families, [s for s in sessions if s is not None])
+        dispatcher = self.dispatcher() if callable(self.dispatcher) else self.dispatcher
+        if dispatcher is not None:
+            dispatcher_metrics(families, dispatcher)
+        thru = self.thru() if callable(self.thru) else self.thru
+        if thru is not None:
+            families.counter('thru_forwarded', 'messages forwarded by the MIDI thru', thru.forwarded)
+            families.counter('thru_filtered', 'pedal messages kept from the MIDI thru', thru.filtered)
+            families.counter('thru_errors', 'batches the MIDI thru failed to write', thru.errors)
+        families.counter('process_cpu_seconds', 'CPU time of the process', time.process_time())
+        families.gauge('uptime_seconds', 'seconds since the exporter started', time.monotonic() - self.started)
+        families.gauge('threads', 'live threads', threading.active_count())
+        profiler = self.profiler
+        if profiler is not None:
+            families.gauge('profiler_running', '1 while the sampling profiler runs', int(profiler.running))
+            families.counter('profiler_samples', 'stack samples taken', profiler.total)
+        families.counter('scrapes', 'times these metrics were rendered', self.scrapes)
+        return list(families)
+
+    def render(self):
+        self.scrapes += 1
+        return render(self.collect())
+
+
+class MetricsServer:
+    """``GET /metrics`` on a background thread. Binds to localhost unless told otherwise."""
+
+    def __init__(self, registry, host='127.0.0.1', port=DEFAULT_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server = None
+        self._thread = None
+
+    @property
+    def where(self):
+        host, port = self.server.server_address[:2] if self.server is not None else (self.host, self.port)
+        return f'http://{host}:{port}/metrics'
+
+    def start(self):
+        # http.server is not worth importing without --metrics
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?')[0] not in ('/', '/metrics'):
+                    handler.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                handler.send_response(200)
+                handler.send_header('Content-Type', CONTENT_TYPE)
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                # not on the terminal of the spinner or the UI
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+
+
+class MetricsFile:
+    """Rewrites ``path`` every ``interval`` seconds and once more on ``stop()``."""
+
+    def __init__(self, registry, path, interval=FILE_INTERVAL):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def where(self):
+        return self.path
+
+    def write(self):
+        # readers never see half a file
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.registry.render())
+        os.replace(tmp, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                pass
+
+    def start(self):
+        self.write()
+        self._thread = threading.Thread(target=self._run, name='metrics-file', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2)
+        try:
+            self.write()
+        except OSError:
+            pass
+
+
+def start_exporter(registry, spec):
+    """A started MetricsServer for ``PORT`` or ``HOST:PORT``, a MetricsFile otherwise."""
+    spec = str(spec or DEFAULT_PORT)
+    host, _, port = spec.rpartition(':')
+    if port.isdigit() and os.sep not in spec:
+        return MetricsServer(registry, host or '127.0.0.1', int(port)).start()
+    return MetricsFile(registry, spec).start()
+
+
+class SamplingProfiler:
+    """Samples the Python stacks of the other threads every ``interval`` seconds.
+
+    ``stacks`` counts ``thread;outermost;...;innermost`` lines. A sample holds the
+    GIL for a few tens of microseconds per thread, about 1% of a core at the
+    default 200 Hz.
+    """
+
+    def __init__(self, interval=0.005, directory=None, max_depth=64):
+        self.interval = interval
+        self.directory = directory or '.'
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        # samples of every run, for the metrics
+        self.total = 0
+        self.started = None
+        self.path = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def sample(self):
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        max_depth = self.max_depth
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None and len(stack) < max_depth:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+        self.total += 1
+
+    def _run(self):
+        interval = self.interval
+        while not self._stop.wait(interval):
+            self.sample()
+
+    def start(self):
+        if self.running:
+            return self
+        self.stacks.clear()
+        self.samples = 0
+        self.started = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling and write the folded stacks. Returns the file written."""
+        if not self.running:
+            return None
+        self._stop.set()
+        self._thread.join(2)
+        self._thread = None
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started))
+        self.path = os.path.join(self.directory, f'profile-{stamp}.folded')
+        self.write(self.path)
+        return self.path
+
+    def toggle(self):
+        """Start, or stop and return the file written."""
+        if self.running:
+            return self.stop()
+        self.start()
+        return None
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f'{stack} {n}\n')
+
+    def top(self, n=5):
+        """``[(function, share)]`` of the innermost frames seen most often."""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [(name, count / total) for name, count in leaves.most_common(n)]
+
+    def format(self, n=5):
+        top = ', '.join(f'{name} {share:.0%}' for name, share in self.top(n))
+        return f'{self.samples} samples in {self.path}' + (f': {top}' if top else '')
+
+
+def toggle_on_signal(profiler, report=print, signum=getattr(signal, 'SIGUSR1', None)):
+    """Toggle ``profiler`` with ``kill -USR1 <pid>``. Only from the main thread and
+    where the signal exists; returns False otherwise."""
+    if signum is None or threading.current_thread() is not threading.main_thread():
+        return False
+
+    def handler(_signum, _frame):
+        if profiler.toggle() is None:
+            report(f'Profiling, kill -USR1 {os.getpid()} again to stop')
+        else:
+            report(profiler.format())
+
+    signal.signal(signum, handler)
+    return True
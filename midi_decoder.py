@@ -0,0 +1,201 @@
+"""Table-driven decoder for batches returned by ``midi_in.read()``.
+
+The mapping rules are compiled into one flat table indexed by
+``(status & 0x7F) << 7 | data1``, i.e. by message type, channel and
+controller / note / program number. Every channel voice message costs one
+lookup whatever the number of rules, and unmapped messages are skipped (the old
+loop stopped at the first unmapped CC and lost the rest of the batch).
+
+Each mapped pedal is a small state machine driven by the device timestamps:
+
+- hysteresis: a press needs a value >= ``press`` and the pedal has to come back
+  to <= ``release`` before it can turn another page, so a half pedal hovering
+  around one value does not chatter;
+- debounce: a press less than ``debounce_ms`` after the previous page turn of
+  the same pedal is ignored (and counted in ``suppressed``).
+
+Notes are released by their note off (or a note on with velocity 0), a program
+change is a press that releases itself.
+"""
+from array import array
+from collections import namedtuple
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+CONTROL_CHANGE = 0xB0
+PROGRAM_CHANGE = 0xC0
+
+PRESS_THRESHOLD = 64    # MIDI switch controllers are "on" from 64
+RELEASE_THRESHOLD = 32
+DEBOUNCE_MS = 100
+
+KINDS = {'cc': CONTROL_CHANGE, 'note': NOTE_ON, 'program': PROGRAM_CHANGE}
+
+# ``channel`` is 0-15 or None for every channel, ``number`` the controller, note
+# or program. ``action`` names what the rule does ('next', 'prev' or the key
+# itself), ``key`` is the key sent and ``window`` an optional target window.
+Rule = namedtuple('Rule', 'kind channel number action key press release window',
+                  defaults=(PRESS_THRESHOLD, RELEASE_THRESHOLD, None))
+
+# ``cc`` is the controller, note or program number
+PedalEdge = namedtuple('PedalEdge', 'channel cc key timestamp action window value', defaults=(None,))
+
+
+def rules_from_mapping(mapping, channels=None, press_threshold=PRESS_THRESHOLD,
+                       release_threshold=RELEASE_THRESHOLD):
+    """Rules for a plain ``{cc: key}`` mapping, on ``channels`` or on every channel."""
+    return [Rule('cc', ch, cc, key, key, press_threshold, release_threshold)
+            for cc, key in mapping.items() for ch in (channels or (None,))]
+
+
+def rule_label(rule):
+    """Short description of what triggers ``rule``, e.g. 'CC 67' or 'Note 60 ch 10'."""
+    label = {'cc': 'CC', 'note': 'Note', 'program': 'Program'}[rule.kind]
+    label = f'{label} {rule.number}'
+    if rule.channel is not None:
+        label += f' ch {rule.channel + 1}'
+    return label
+
+
+class ActionTable:
+    """Rules compiled into flat lookup arrays.
+
+    ``table[index]`` is a slot number (0 = unmapped) and the per-slot lists hold
+    what the decoder needs. Note offs get their own slot that only releases the
+    state of the matching note on. Later rules win over earlier ones.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        # a plain list indexes faster than array('H') in CPython
+        self.table = [0] * (128 * 128)
+        self.state = [0]
+        self.press = [0]
+        self.release = [0]
+        self.keys = [None]
+        self.actions = [None]
+        self.windows = [None]
+        for rule in self.rules:
+            if rule.kind not in KINDS:
+                raise ValueError(f'Unknown rule kind: {rule.kind}')
+            if not 0 <= rule.number < 128:
+                raise ValueError(f'{rule_label(rule)}: number out of range')
+            if rule.kind == 'program':
+                # fires on every program change and is released right away
+                press, release = 0, 127
+            else:
+                press, release = rule.press, rule.release
+                if release >= press:
+                    raise ValueError(f'{rule_label(rule)}: release threshold must be below the press threshold')
+            channels = range(16) if rule.channel is None else (rule.channel,)
+            for ch in channels:
+                index = self._index(KINDS[rule.kind] | ch, rule.number)
+                self._add(index, index, press, release, rule)
+                if rule.kind == 'note':
+                    # never presses, always releases
+                    self._add(self._index(NOTE_OFF | ch, rule.number), index, 128, 127, rule)
+
+    @staticmethod
+    def _index(status, number):
+        return ((status & 0x7F) << 7) | number
+
+    def _add(self, index, state, press, release, rule):
+        slot = self.table[index]
+        if not slot:
+            slot = len(self.keys)
+            self.table[index] = slot
+            for values in (self.state, self.press, self.release, self.keys, self.actions, self.windows):
+                values.append(None)
+        self.state[slot] = state
+        self.press[slot] = press
+        self.release[slot] = release
+        self.keys[slot] = rule.key
+        self.actions[slot] = rule.action
+        self.windows[slot] = rule.window
+
+    def __len__(self):
+        return len(self.keys) - 1
+
+    def indices(self):
+        """Table indices of every mapped message, for the inputs' ``priority``."""
+        return frozenset(i for i, slot in enumerate(self.table) if slot)
+
+
+class PedalDecoder:
+    """Turns raw MIDI batches into pedal edges.
+
+    ``mapping`` is a ``{cc: key}`` dict, a list of ``Rule`` or an ``ActionTable``.
+    For a dict, ``channels`` limits which MIDI channels (0-15) are listened to,
+    all of them by default.
+    """
+
+    def __init__(self, mapping, channels=None, press_threshold=PRESS_THRESHOLD,
+                 release_threshold=RELEASE_THRESHOLD, debounce_ms=DEBOUNCE_MS):
+        if isinstance(mapping, dict):
+            if release_threshold >= press_threshold:
+                raise ValueError('release_threshold must be below press_threshold')
+            mapping = rules_from_mapping(mapping, channels, press_threshold, release_threshold)
+        if not isinstance(mapping, ActionTable):
+            mapping = ActionTable(mapping)
+        self.actions = mapping
+        self.debounce_ms = debounce_ms
+        self.suppressed = 0
+        self.reset()
+
+    @property
+    def rules(self):
+        return self.actions.rules
+
+    def is_mapped(self, channel, cc):
+        return self.actions.table[ActionTable._index(CONTROL_CHANGE | channel, cc)] != 0
+
+    def reset(self):
+        """Release every pedal, e.g. after reopening the port."""
+        # 1 = the pedal is released and the next press turns a page
+        self._armed = bytearray(b'\x01' * (128 * 128))
+        # device timestamp of the last page turn of each pedal
+        self._last_edge = array('q', [-(1 << 62)]) * (128 * 128)
+
+    def rearm(self):
+        """Arm every pedal again, keeping the debounce history: after messages were
+        lost a release may be missing, and the pedal would never turn a page again."""
+        self._armed = bytearray(b'\x01' * (128 * 128))
+
+    def adopt(self, other):
+        """Take over the pedal state of ``other``, e.g. when the mapping is reloaded
+        while a pedal is held down."""
+        self._armed = bytearray(other._armed)
+        self._last_edge = array('q', other._last_edge)
+        self.suppressed = other.suppressed
+
+    def decode(self, batch):
+        """Return the list of ``PedalEdge`` found in a ``read()`` batch."""
+        actions = self.actions
+        table = actions.table
+        states = actions.state
+        press = actions.press
+        release = actions.release
+        armed = self._armed
+        last_edge = self._last_edge
+        debounce = self.debounce_ms
+        edges = []
+        for msg, timestamp in batch:
+            st = msg[0]
+            if st < 0x80:
+                continue
+            slot = table[((st & 0x7F) << 7) | msg[1]]
+            if not slot:
+                continue
+            val = msg[2]
+            state = states[slot]
+            if armed[state] and val >= press[slot]:
+                armed[state] = 0
+                if timestamp - last_edge[state] < debounce:
+                    self.suppressed += 1
+                else:
+                    last_edge[state] = timestamp
+                    edges.append(PedalEdge(st & 0x0F, msg[1], actions.keys[slot], timestamp,
+                                           actions.actions[slot], actions.windows[slot], val))
+            if val <= release[slot]:
+                armed[state] = 1
+        return edges
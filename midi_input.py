@@ -0,0 +1,383 @@
+"""MIDI input backends.
+
+The receive loops used to spin on ``midi_in.poll()`` with ``sleep(0)``, which
+keeps one CPU core busy for as long as the app is listening. A backend hides how
+we wait for data: ``wait(timeout)`` sleeps until bytes arrive (or the timeout
+expires) and ``read(n)`` returns events in the pygame.midi layout
+
+    [[status, data1, data2, data3], timestamp_ms]
+
+so the decoding code does not care which backend produced them.
+
+Backends that learn about new events on their own thread (``can_notify``) also
+call ``on_data()`` from that thread, which lets an event loop sleep until then
+(pedal_stream.py).
+
+Backends:
+
+- ``rtmidi``: python-rtmidi callback. RtMidi blocks on the ALSA sequencer / CoreMIDI /
+  WinMM handle in its own thread and we wake up through a ``threading.Event``.
+- ``pygame``: ``pygame.midi`` (PortMidi). PortMidi has no blocking read, so this is
+  a fallback that polls with a short backoff sleep instead of ``sleep(0)``.
+
+Both buffer what arrives between two reads, ``buffer_size`` messages
+(MIDI_PAGE_TURN_BUFFER, 4096 by default, the PortMidi default of pygame). When a
+controller flood fills it, messages are lost:
+
+- PortMidi drops what does not fit and reports it once, as an exception from
+  read() or poll(). That used to look like an unplugged device.
+- rtmidi keeps ``buffer_size`` messages and drops the rest itself, except the
+  ``priority`` messages (the mapped pedals, set by PedalSession), which are
+  always queued.
+
+Every loss is counted in the input's ``health`` with the device time window it
+happened in. Active sensing, clock and sysex never reach the buffer.
+"""
+import importlib.util
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+# Suppress the pygame support prompt.
+# This must be set before importing pygame.
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "1"
+
+BACKEND_ENV = 'MIDI_PAGE_TURN_BACKEND'
+BUFFER_ENV = 'MIDI_PAGE_TURN_BUFFER'
+BUFFER_SIZE = 4096
+# pygame.midi refuses to read more at once
+MAX_READ = 1024
+
+# device time window (ms) in which messages were lost; ``dropped`` is None when
+# the backend cannot tell how many (PortMidi)
+Gap = namedtuple('Gap', 'start end dropped')
+
+
+def input_buffer_size(size=None):
+    """``size``, MIDI_PAGE_TURN_BUFFER or BUFFER_SIZE."""
+    return int(size or os.environ.get(BUFFER_ENV) or BUFFER_SIZE)
+
+
+def is_overflow(error):
+    """Whether a PortMidi exception is a buffer overflow (``PortMidi: Buffer overflow``)."""
+    return 'overflow' in str(error).lower()
+
+
+class InputHealth:
+    """Messages an input lost to a full buffer.
+
+    Shared by the backends a ReconnectingInput opens, so the counts cover the
+    whole session. ``overflows`` counts the losses, ``dropped`` the messages known
+    to be lost and ``gaps`` keeps the last ``max_gaps`` loss windows.
+    """
+
+    def __init__(self, max_gaps=64):
+        self.overflows = 0
+        self.dropped = 0
+        self.gaps = deque(maxlen=max_gaps)
+
+    def lost(self, start, end, dropped=None):
+        self.overflows += 1
+        if dropped:
+            self.dropped += dropped
+        self.gaps.append(Gap(start, end, dropped))
+
+
+class ReadBatch:
+    """Number of events to ask ``read()`` for, following the arrival rate.
+
+    A read that comes back full doubles the size at once: a flood is building up
+    in the buffer and has to be drained before it overflows. Otherwise the size
+    follows twice the running average of the batches read, halving at most once
+    per read, so an idle input does not allocate a large buffer on every read.
+    """
+
+    def __init__(self, min_size=32, max_size=MAX_READ):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = min_size
+        self.average = 0.0
+        self.full = 0
+
+    def update(self, n):
+        if n >= self.size:
+            self.full += 1
+            self.average = n
+            self.size = min(self.size * 2, self.max_size)
+            return
+        self.average += (n - self.average) * 0.125
+        if 4 * self.average < self.size and self.size > self.min_size:
+            self.size //= 2
+
+
+def pygame_device_name(device_id):
+    import pygame.midi
+    return pygame.midi.get_device_info(device_id)[1].decode('utf-8')
+
+
+class MidiInputBackend:
+    """Base class of the input backends."""
+
+    name = 'base'
+    # whether on_data() is called when events arrive
+    can_notify = False
+
+    def __init__(self, device_id, device_name=None, buffer_size=None):
+        self.device_id = device_id
+        self.device_name = device_name
+        self.buffer_size = buffer_size or BUFFER_SIZE
+        self.on_data = None
+        self.health = InputHealth()
+        # (status & 0x7F) << 7 | data1 of the messages never to drop, see ActionTable
+        self.priority = frozenset()
+
+    def open(self):
+        raise NotImplementedError
+
+    def wait(self, timeout=None) -> bool:
+        """Block until events are available. Returns False on timeout."""
+        raise NotImplementedError
+
+    def read(self, max_events):
+        raise NotImplementedError
+
+    def time(self) -> int:
+        """Current time in ms on the same clock as the event timestamps."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PygameMidiInput(MidiInputBackend):
+    """pygame.midi fallback.
+
+    Polls with an exponential backoff from ``min_sleep`` to ``max_sleep`` seconds
+    while the port is idle, and goes back to ``min_sleep`` as soon as data arrives.
+    With the default 2 ms cap the worst-case added latency is 2 ms while idle CPU
+    drops from a full core to almost nothing.
+    """
+
+    name = 'pygame'
+
+    def __init__(self, device_id, device_name=None, buffer_size=None, min_sleep=0.0002, max_sleep=0.002):
+        super().__init__(device_id, device_name, buffer_size)
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+        self.midi_in = None
+        # device time of the last event read, where a loss window starts
+        self._last = 0
+        self._overflowed = False
+
+    def open(self):
+        import pygame.midi
+        if not pygame.midi.get_init():
+            pygame.midi.init()
+        if self.device_name is None:
+            self.device_name = pygame_device_name(self.device_id)
+        self.midi_in = pygame.midi.Input(self.device_id, self.buffer_size)
+        self._filter()
+
+    def _filter(self):
+        # like ignore_types() of the rtmidi backend: a keyboard sending active
+        # sensing or a sequencer sending clock would fill the buffer for nothing
+        try:
+            import pygame.pypm as pypm
+            self.midi_in._input.SetFilter(pypm.FILT_ACTIVE | pypm.FILT_CLOCK | pypm.FILT_SYSEX)
+        except Exception:
+            # pygame without the pypm module or the filter constants
+            pass
+
+    def _poll(self):
+        try:
+            return self.midi_in.poll()
+        except Exception as e:
+            if not is_overflow(e):
+                raise
+            # the next read() reports it again or returns what came after
+            self._overflowed = True
+            return True
+
+    def wait(self, timeout=None) -> bool:
+        poll = self._poll
+        if poll():
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = self.min_sleep
+        while True:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                delay = min(delay, remaining)
+            time.sleep(delay)
+            if poll():
+                return True
+            delay = min(delay * 2, self.max_sleep)
+
+    def read(self, max_events):
+        max_events = min(max_events, MAX_READ)
+        try:
+            data = self.midi_in.read(max_events)
+        except Exception as e:
+            if not is_overflow(e):
+                raise
+            # PortMidi reports the overflow once, dropping what this read had
+            # dequeued; reading again returns what arrived after it
+            self._overflowed = True
+            data = self.midi_in.read(max_events)
+        if self._overflowed:
+            self._overflowed = False
+            self.health.lost(self._last, data[0][1] if data else self.time())
+        if data:
+            self._last = data[-1][1]
+        return data
+
+    def time(self) -> int:
+        import pygame.midi
+        return pygame.midi.time()
+
+    def close(self):
+        if self.midi_in is not None:
+            self.midi_in.close()
+            self.midi_in = None
+
+
+class RtMidiInput(MidiInputBackend):
+    """python-rtmidi backend, event driven through the RtMidi callback thread.
+
+    The callback queues at most ``buffer_size`` messages; the ones arriving while
+    the queue is full are dropped, unless their index is in ``priority``.
+    """
+
+    name = 'rtmidi'
+    can_notify = True
+
+    def __init__(self, device_id, device_name=None, buffer_size=None):
+        super().__init__(device_id, device_name, buffer_size)
+        self.midi_in = None
+        self._pending = deque()
+        self._ready = threading.Event()
+        self._t0 = time.monotonic()
+        # [first timestamp, dropped] while the queue is full
+        self._overrun = None
+
+    def open(self):
+        import rtmidi
+        if self.device_name is None:
+            self.device_name = pygame_device_name(self.device_id)
+        self.midi_in = rtmidi.MidiIn()
+        ports = self.midi_in.get_ports()
+        index = find_port(ports, self.device_name)
+        if index is None:
+            self.midi_in.delete()
+            self.midi_in = None
+            raise IOError(f'MIDI input not found by rtmidi: {self.device_name}')
+        self.midi_in.open_port(index)
+        self.midi_in.ignore_types(sysex=True, timing=True, active_sense=True)
+        self.midi_in.set_callback(self._on_message)
+
+    def _on_message(self, event, data=None):
+        message, _delta = event
+        # pad to the 4 byte pygame layout
+        msg = (list(message) + [0, 0, 0, 0])[:4]
+        now = self.time()
+        pending = self._pending
+        if len(pending) >= self.buffer_size:
+            if ((msg[0] & 0x7F) << 7 | msg[1]) not in self.priority:
+                if self._overrun is None:
+                    self._overrun = [now, 0]
+                self._overrun[1] += 1
+                return
+        elif self._overrun is not None:
+            start, dropped = self._overrun
+            self._overrun = None
+            self.health.lost(start, now, dropped)
+        pending.append([msg, now])
+        self._ready.set()
+        on_data = self.on_data
+        if on_data is not None:
+            on_data()
+
+    def wait(self, timeout=None) -> bool:
+        if self._pending:
+            return True
+        self._ready.clear()
+        # the callback may have run between the check above and clear()
+        if self._pending:
+            return True
+        return self._ready.wait(timeout)
+
+    def read(self, max_events):
+        pending = self._pending
+        out = []
+        while pending and len(out) < max_events:
+            out.append(pending.popleft())
+        return out
+
+    def time(self) -> int:
+        return int((time.monotonic() - self._t0) * 1000)
+
+    def close(self):
+        if self.midi_in is not None:
+            self.midi_in.cancel_callback()
+            self.midi_in.close_port()
+            self.midi_in.delete()
+            self.midi_in = None
+
+
+def find_port(ports, device_name):
+    """Index of the rtmidi port matching a PortMidi device name, or None."""
+    if device_name is None:
+        return None
+    for i, port in enumerate(ports):
+        if port == device_name:
+            return i
+    # rtmidi appends client:port numbers on ALSA, e.g. 'Digital Piano:Digital Piano MIDI 1 20:0'
+    for i, port in enumerate(ports):
+        if device_name in port:
+            return i
+    return None
+
+
+BACKENDS = {
+    RtMidiInput.name: RtMidiInput,
+    PygameMidiInput.name: PygameMidiInput,
+}
+
+
+def available_backends():
+    # found without importing it, RtMidiInput.open() does when a port is opened
+    names = [RtMidiInput.name] if importlib.util.find_spec('rtmidi') is not None else []
+    names.append(PygameMidiInput.name)
+    return names
+
+
+def open_input(device_id, device_name=None, backend=None, buffer_size=None):
+    """Open ``device_id`` with the best available backend.
+
+    ``backend`` (or the MIDI_PAGE_TURN_BACKEND environment variable) forces one of
+    'rtmidi' or 'pygame'. Without it rtmidi is tried first and pygame.midi is used
+    when rtmidi is not installed or cannot find the device. ``buffer_size`` is
+    the number of messages buffered between two reads, see input_buffer_size().
+    """
+    backend = backend or os.environ.get(BACKEND_ENV)
+    names = [backend] if backend else available_backends()
+    buffer_size = input_buffer_size(buffer_size)
+    error = None
+    for name in names:
+        midi_in = BACKENDS[name](device_id, device_name, buffer_size)
+        try:
+            midi_in.open()
+            return midi_in
+        except (ImportError, IOError) as e:
+            error = e
+    raise error
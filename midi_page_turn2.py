@@ -1,13 +1,21 @@
-import pygame
-import pygame.midi
-from time import sleep
+import os
 import subprocess
-import time
 import sys
-from yaspin import yaspin
-from yaspin.spinners import Spinners
 import platform
-from packaging import version
+import threading
+import argparse
+from device_watcher import DeviceWatcher, ReconnectingInput, rescan_inputs
+from key_injector import get_injector
+from page_output import OUTPUT_ENV, Turn, get_output, close_output, output_name, output_names
+from dispatch import KeyDispatcher, coalescing, COALESCE_ENV, MAX_COALESCE
+from pedal_session import PedalSession, wait_any
+from midi_decoder import Rule, ActionTable, rule_label, DEBOUNCE_MS
+from mapping_config import MappingConfig, MappingWatcher, load_mapping, MAPPING_ENV
+from midi_record import RecordingInput, ReplayInput, replay_speed
+from midi_input import BUFFER_ENV
+from telemetry import PollTimings
+# metrics, score_follower, net_relay, event_journal and midi_thru are imported
+# when their option is given, they are not needed to listen
 
 def is_windows():
     return platform.system() == 'Windows'
@@ -20,25 +28,96 @@ VK_RIGHT = '0x27' if is_windows() else 'Right'
 VK_UP = '0x26' if is_windows() else 'Page_Up'
 VK_DOWN = '0x28' if is_windows() else 'Page_Down'
 
-# control code : sendkey at that time, keytype
+# action names of the mapping rules, see mapping_config.py
+ACTIONS = {'next': VK_DOWN, 'prev': VK_UP, 'left': VK_LEFT, 'right': VK_RIGHT}
+
+# used without a mapping file
 # LEFT-MOST Pedal is more comfortable for NEXT page.
-CCDATA = {LEFT_PEDAL: [True, VK_DOWN], MID_PEDAL: [True, VK_UP]}
+DEFAULT_RULES = (
+    Rule('cc', None, LEFT_PEDAL, 'next', VK_DOWN),
+    Rule('cc', None, MID_PEDAL, 'prev', VK_UP),
+)
 
+# music sheet viewer: an X window id, class:NAME or name:TITLE, see select_target_window()
+# and window_target.py
+WINDOW_ENV = 'MIDI_PAGE_TURN_WINDOW'
+WINDOW = None
 
+# output backend of the page turns (page_output.py), None for MIDI_PAGE_TURN_OUTPUT or keys
+OUTPUT = None
 
-def sendkey(vkcode):
-    if is_windows():
-        subprocess.check_call(['powershell', '.\\Send-KeyPress.ps1', '-KeyCode', vkcode])
-    else:
-        subprocess.check_call(['xdotool', 'windowactivate', '--sync', WINDOW, 'key', vkcode])
+
+def init_midi():
+    # only the MIDI subsystem; pygame.init() would start video, audio, joystick, ...
+    import pygame.midi
+    if not pygame.midi.get_init():
+        pygame.midi.init()
+
+
+def select_target_window():
+    """Pick the viewer window once: MIDI_PAGE_TURN_WINDOW or an interactive xdotool pick.
+
+    The injectors cache its id and find it again by class if the viewer restarts.
+    """
+    global WINDOW
+    if is_windows() or WINDOW is not None:
+        return WINDOW
+    WINDOW = os.environ.get(WINDOW_ENV)
+    if not WINDOW:
+        print("Please select musicsheet viewer window")
+        output = subprocess.check_output(['xdotool', 'selectwindow'])
+        WINDOW = output.decode('utf-8').strip()
+    return WINDOW
+
+
+def sendkey(vkcode, count=1):
+    # the injector is created on the first key and kept open, see key_injector.py
+    get_injector(select_target_window()).send(vkcode, count)
+
+
+def turn_page(turn, count=1):
+    """Dispatcher callback: hand ``turn`` (a page_output.Turn) to the output backend."""
+    get_output(OUTPUT, select_target_window).turn(turn, count)
+
+
+def needs_window():
+    """Only key presses need the viewer window."""
+    return output_name(OUTPUT) == 'keys'
+
+
+def load_mapping_config(path=None):
+    """The mapping file ``path`` or MIDI_PAGE_TURN_MAPPING, the default pedals without one."""
+    path = path or os.environ.get(MAPPING_ENV)
+    if not path:
+        return MappingConfig(DEFAULT_RULES, DEBOUNCE_MS, None)
+    return load_mapping(path, ACTIONS)
+
+
+def load_follower(path, page_breaks=None, lead=None):
+    """ScoreFollower for the reference ``path``; ``page_breaks`` (beats, e.g. '32,64')
+    replace the ones of the reference."""
+    from score_follower import ScoreFollower, load_reference, parse_beats, LEAD_BEATS
+    if lead is None:
+        lead = LEAD_BEATS
+    onsets, breaks = load_reference(path)
+    if page_breaks:
+        breaks = parse_beats(page_breaks)
+    if not breaks:
+        raise ValueError(f'{path}: no page breaks, give them with --page-breaks')
+    return ScoreFollower(onsets, breaks, Turn('next', ACTIONS['next'], None), lead=lead)
+
+
+def format_mapping(config):
+    return ', '.join(f'{rule_label(r)} -> {r.action}' for r in config.rules)
 
 
 def get_port_from_user():
+    import pygame.midi
+
     inputdevice = {}
     outputdevice = {}
 
-    pygame.init()
-    pygame.midi.init()
+    init_midi()
 
     print('')
     print('{0:3s}   {1:7s} {2:10s} {3:^50s}'.format('ID', 'TYPE', 'STATUS', 'NAME'))
@@ -81,22 +160,29 @@ def get_port_from_user():
         sys.exit(1)
     elif ninput == 1:
         print('Using the first opened device : {}\n'.format(opened_inputdev[0][2].decode('utf-8')))
-        inport = opened_inputdev[0][0]
+        inports = [opened_inputdev[0][0]]
     else:
         while True:
             idlist = []
             for dev in opened_inputdev:
                 idlist.append(dev[0])
                 print(f'[{dev[0]}] {dev[2]}')
-            ret = input('Select input devices : ').strip()
-            if int(ret) in idlist:
-                inport = int(ret)
+            # several inputs (e.g. a keyboard and a foot controller) are listened to together
+            ret = input('Select input devices (e.g. 1 or 1,3) : ').strip()
+            try:
+                inports = [int(x) for x in ret.replace(',', ' ').split()]
+            except ValueError:
+                inports = []
+            if inports and all(x in idlist for x in inports):
+                inports = list(dict.fromkeys(inports))
                 break
             else:
-                print('Invalid input: {ret}. Please retry')
+                print(f'Invalid input: {ret}. Please retry')
 
     print('Waiting for MIDI control messages ... \n')
 
+    return inports
+
     # print('[{0:d}] : {1}'.format(i, ret))
 
     # print(inputdevice)
@@ -105,63 +191,131 @@ def get_port_from_user():
     # inport=1
 
 
-def midi_page_turn(inport):
-
+def midi_page_turn(inports, backend=None, midi_in=None, record=None, mapping=None, stop=None, journal=None,
+                   follower=None, metrics=None, profile_dir=None, buffer_size=None, thru=None,
+                   coalesce=None):
+    """Listen on the ``inports`` (or on ``midi_in``, an input that is not open yet,
+    e.g. a ReplayInput) and turn pages until interrupted. ``record`` is a file to
+    record batches to, with a single input only. ``mapping`` is a MappingConfig,
+    reloaded when its file changes. ``stop`` is an Event ending the loop, for
+    callers running it on a thread. ``journal`` is a file to write the session's
+    edges and page turns to (event_journal.py). ``follower`` is a ScoreFollower
+    turning pages from the notes played. ``metrics`` is a port, host:port or file
+    to export the metrics to (metrics.py); SIGUSR1 toggles the sampling profiler,
+    whose stacks go to ``profile_dir``. ``buffer_size`` is the number of messages
+    the inputs buffer between two reads (midi_input.py). ``thru`` is an output
+    (a spec of open_thru()) to forward what is played to, see midi_thru.py.
+    ``coalesce`` is the ``(policy, max_coalesce)`` of dispatch.coalescing()."""
+    from yaspin import yaspin
+    # light without the exporter's http.server, needed for SIGUSR1
+    from metrics import SamplingProfiler, toggle_on_signal
+
+    if mapping is None:
+        mapping = load_mapping_config()
+    # compiled once and shared by every session
+    table = ActionTable(mapping.rules)
+
+    # keys are sent from a worker thread so a slow injector never stalls reading
+    if journal is not None:
+        from event_journal import EventJournal
+        journal = EventJournal(journal)
+    coalesce, max_coalesce = coalesce or coalescing()
+    dispatcher = KeyDispatcher(turn_page, coalesce=coalesce, max_coalesce=max_coalesce, journal=journal).start()
+    inputs = []
+    sessions = []
+    devices_changed = threading.Event()
+    watcher = DeviceWatcher(devices_changed.set)
+    mapping_watcher = None
+    exporter = None
+    thru_output = None
+    profiler = SamplingProfiler(directory=profile_dir)
     try:
         # spinner=yaspin(Spinners.bouncingBall, color="blue", on_color="on_yellow",)
         spinner = yaspin(text='  🎹 Receiving MIDI data')
 
-        midi_in = pygame.midi.Input(inport)
-
-        while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    # 'finally' is executed
-                    sys.exit()
-
-            sleep(0)
-
-            if not midi_in.poll():
+        if thru is not None:
+            from midi_thru import open_thru
+            thru_output = open_thru(thru)
+        if midi_in is None:
+            # reopened by name when the device is unplugged and plugged back
+            inputs = [ReconnectingInput(inport, backend=backend, buffer_size=buffer_size) for inport in inports]
+            sessions = [PedalSession(i, table, journal=journal, follower=follower, thru=thru_output,
+                                     debounce_ms=mapping.debounce_ms).open() for i in inputs]
+            watcher.start()
+        else:
+            sessions = [PedalSession(midi_in, table, journal=journal, follower=follower, thru=thru_output,
+                                     debounce_ms=mapping.debounce_ms).open()]
+        for session in sessions:
+            print(f'Using {session.midi_in.name} input backend for {session.label}')
+        if metrics is not None:
+            from metrics import MetricsRegistry, start_exporter
+            for session in sessions:
+                session.timings = PollTimings()
+            exporter = start_exporter(MetricsRegistry(sessions, dispatcher, profiler, thru_output), metrics)
+            print(f'Metrics: {exporter.where}')
+        if toggle_on_signal(profiler, lambda text: spinner.write(f'  🔬 {text}')):
+            print(f'Profiler: kill -USR1 {os.getpid()} to start and stop')
+        print(f'Mapping: {format_mapping(mapping)}')
+        if thru_output is not None:
+            print(f'MIDI thru to {thru_output.port}')
+        if follower is not None:
+            print('Following the score, page breaks at beats ' + ', '.join(f'{b:g}' for b in follower.breaks))
+        auto_turns = 0
+        if mapping.path is not None:
+            def reload_mapping(config):
+                table = ActionTable(config.rules)
+                for session in sessions:
+                    session.remap(table, debounce_ms=config.debounce_ms)
+                spinner.write(f'  🔁 Reloaded {config.path}: {format_mapping(config)}')
+
+            def mapping_error(e):
+                spinner.write(f'  ⚠️  {e}, keeping the previous mapping')
+
+            mapping_watcher = MappingWatcher(mapping.path, ACTIONS, reload_mapping, mapping_error).start()
+        if record is not None:
+            session = sessions[0]
+            session.midi_in = RecordingInput(session.midi_in, record)
+            print(f'Recording {session.label} to {record}')
+
+        while stop is None or not stop.is_set():
+            if devices_changed.is_set():
+                devices_changed.clear()
+                # one PortMidi rescan for all the inputs, it closes every stream
+                reconnects = [i.reconnects for i in inputs]
+                rescan_inputs(inputs)
+                for session, i, n in zip(sessions, inputs, reconnects):
+                    if i.reconnects != n:
+                        spinner.write(f'  🔌 Reconnected {i.device_name}')
+                    elif not i.connected:
+                        session.decoder.reset()
+                        spinner.write(f'  🔌 Lost {i.device_name}, waiting for it to come back')
+
+            # sleeps until data arrives instead of spinning on poll()
+            ready = wait_any(sessions, 0.5)
+            if not ready:
                 spinner.stop()
                 continue
 
             spinner.start()
 
-            # status, controller, value, ?, ?
-            # [[176, 67, 127, 0], 41834]
-            data = midi_in.read(100)
-
-            for d in data:
-                st = d[0][0]
-                cc = d[0][1]
-                val = d[0][2]
-
-                # control message
-                # 0b1011CCCC : 1011 : control, CCCC: channel
-                # print('{:b}'.format(st & 0b10110000))
-                if st >> 4 != 0b1011:
-                    continue
-
-                if cc not in CCDATA.keys():
-                    break
-
-                # print(d)
-
-                # print(f'ControlCode : {cc}, Value: {val}')
-                if val > 0:
-                    if CCDATA[cc][0]:
-                        sendkey(CCDATA[cc][1])
-                        CCDATA[cc][0] = False
-                        # print('-'*20)
-                        # print('')
-                        # spinner.stop()
-                        spinner.write(
-                            '  🎼 {0} {1:d}'.format(('NEXT' if cc == LEFT_PEDAL else "PREV"), int(time.time())))
-                    # spinner.start()
-                    # spinner.ok('✔')
-                    # print('-'*20)
-                else:  # val is zero (means end of control message)
-                    CCDATA[cc][0] = True
+            for session in ready:
+                overflows = session.overflows
+                for edge in session.poll(dispatcher):
+                    spinner.write(
+                        '  🎼 {0} {1:d} ms{2}'.format(edge.action.upper(), edge.timestamp,
+                                                     f'  ({session.label})' if len(sessions) > 1 else ''))
+                if session.overflows != overflows:
+                    gap = session.midi_in.health.gaps[-1]
+                    lost = 'messages' if gap.dropped is None else f'{gap.dropped} messages'
+                    spinner.write(f'  ⚠️  {session.label}: input buffer overflow, {lost} lost between '
+                                  f'{gap.start} and {gap.end} ms, pedals re-armed')
+            if follower is not None and len(follower.turns) > auto_turns:
+                for timestamp, beat, page_break in follower.turns[auto_turns:]:
+                    spinner.write(f'  🤖 NEXT {timestamp:d} ms at beat {beat:g}, page break at {page_break:g}')
+                auto_turns = len(follower.turns)
+    except EOFError:
+        # end of a replay
+        spinner.stop()
     finally:
         print("\nClosing ... ", end='')
         # sleep(1)
@@ -172,17 +326,107 @@ def midi_page_turn(inport):
         # if version.parse(pygame.__version__) >= version.parse('1.9.5'):
         #     initialized = pygame.midi.get_init()
 
-        midi_in.close()
-        pygame.midi.quit()
+        watcher.stop()
+        if mapping_watcher is not None:
+            mapping_watcher.stop()
+        if profiler.running:
+            profiler.stop()
+        for session in sessions:
+            session.close()
+        if thru_output is not None:
+            thru_output.close()
+        if 'pygame.midi' in sys.modules:
+            sys.modules['pygame.midi'].quit()
+        dispatcher.stop()
+        close_output()
+        if journal is not None:
+            journal.close()
+        if exporter is not None:
+            exporter.stop()
         print("Done")
-
-
-if not is_windows():
-    print("Please select musicsheet viewer window")
-    output = subprocess.check_output(['xdotool', 'selectwindow'])
-    WINDOW = output.decode('utf-8').strip()
+        for session in sessions:
+            if len(sessions) > 1:
+                print(f'{session.label}:')
+            print(session.stats.format())
+            if session.decoder.suppressed:
+                print(f'{session.decoder.suppressed} pedal presses suppressed by the {session.decoder.debounce_ms} ms debounce')
+            if session.overflows:
+                health = session.midi_in.health
+                print(f'{health.overflows} input buffer overflows, {health.dropped} messages known lost, '
+                      f'reads up to {session.batch.size} events')
+        print(dispatcher.format())
+        if dispatcher.device_latency.count:
+            print('Device timestamp to key injection:')
+            print(dispatcher.device_latency.format())
+        if journal is not None:
+            print(f'Journal: {journal.records} records in {journal.path}')
+        if follower is not None:
+            print(f'Score follower: {follower.notes} notes, {len(follower.turns)} automatic page turns')
+        if profiler.path is not None:
+            print(f'Profile: {profiler.format()}')
+        if thru_output is not None:
+            print(f'MIDI thru: {thru_output.forwarded} messages forwarded, {thru_output.filtered} pedal messages kept back, '
+                  f'{thru_output.errors} failed writes')
 
 
 if __name__ == "__main__":
-    inport = get_port_from_user()
-    midi_page_turn(inport)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Turn music sheet pages with MIDI pedals')
+    parser.add_argument('--backend', default=None, choices=['rtmidi', 'pygame'])
+    parser.add_argument('--record', default=None, metavar='FILE', help='record the raw MIDI batches to FILE')
+    parser.add_argument('--replay', default=None, metavar='FILE', help='replay a recording instead of reading a device')
+    parser.add_argument('--speed', type=replay_speed, default=1.0, help='replay speed')
+    parser.add_argument('--mapping', default=None, metavar='FILE',
+                        help=f'pedal mapping file (TOML or YAML), default ${MAPPING_ENV}')
+    parser.add_argument('--output', default=None, choices=output_names(),
+                        help=f'where page turns go, default ${OUTPUT_ENV} or keys')
+    parser.add_argument('--relay', nargs='?', const='', default=None, metavar='GROUP_OR_HOSTS',
+                        help='send the page turns to the stands running net_relay.py, default $MIDI_PAGE_TURN_RELAY '
+                             'or the multicast group')
+    parser.add_argument('--follow', default=None, metavar='SCORE',
+                        help='turn pages from the notes played, SCORE is a MIDI or MusicXML file of the piece')
+    parser.add_argument('--page-breaks', default=None, metavar='BEATS',
+                        help='beats where the pages start, e.g. 32,64,96 (MusicXML has its own)')
+    parser.add_argument('--lead-beats', type=float, default=None,
+                        help='turn this many beats before the page break, default 2')
+    parser.add_argument('--journal', default=None, metavar='FILE',
+                        help='write pedal edges and page turns to FILE, see event_journal.py')
+    parser.add_argument('--buffer-size', type=int, default=None, metavar='MESSAGES',
+                        help=f'MIDI messages buffered between two reads, default ${BUFFER_ENV} or 4096')
+    parser.add_argument('--coalesce', default=None, metavar='POLICY',
+                        help=f'how queued presses of one key are merged: none, adjacent or adjacent:MAX, '
+                             f'default ${COALESCE_ENV} or adjacent:{MAX_COALESCE}')
+    parser.add_argument('--thru', nargs='?', const='', default=None, metavar='OUTPUT',
+                        help='forward what is played, pedals excepted, to a PortMidi output id or name, default '
+                             '$MIDI_PAGE_TURN_THRU or a virtual port')
+    parser.add_argument('--metrics', nargs='?', const='', default=None, metavar='PORT_OR_FILE',
+                        help='export OpenMetrics on localhost:PORT (default 9747) or to FILE, see metrics.py')
+    parser.add_argument('--profile-dir', default=None, metavar='DIR',
+                        help='where the sampling profiler (SIGUSR1) writes its stacks')
+    args = parser.parse_args()
+    OUTPUT = args.output
+    if args.relay is not None:
+        from net_relay import RELAY_ENV, RelayOutput
+        if args.relay:
+            os.environ[RELAY_ENV] = args.relay
+        OUTPUT = RelayOutput.name
+
+    try:
+        mapping = load_mapping_config(args.mapping)
+        follower = load_follower(args.follow, args.page_breaks, args.lead_beats) if args.follow else None
+        coalesce = coalescing(args.coalesce)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    if needs_window():
+        select_target_window()
+    if args.replay is not None:
+        midi_page_turn(None, midi_in=ReplayInput(args.replay, speed=args.speed), record=args.record, mapping=mapping,
+                       journal=args.journal, follower=follower, metrics=args.metrics, profile_dir=args.profile_dir,
+                       thru=args.thru, coalesce=coalesce)
+    else:
+        inports = get_port_from_user()
+        if args.record is not None and len(inports) > 1:
+            parser.error('--record works with a single input')
+        midi_page_turn(inports, backend=args.backend, record=args.record, mapping=mapping, journal=args.journal,
+                       follower=follower, metrics=args.metrics, profile_dir=args.profile_dir,
+                       buffer_size=args.buffer_size, thru=args.thru, coalesce=coalesce)
\ No newline at end of file
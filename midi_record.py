@@ -0,0 +1,227 @@
+"""Record raw ``midi_in.read()`` batches and replay them without an instrument.
+
+File format (little endian)::
+
+    b'MPTREC1\\n'
+    per batch:  <d host_seconds> <I count>
+    per event:  <B status> <B data1> <B data2> <B data3> <i timestamp_ms>
+
+``host_seconds`` is ``time.monotonic()`` when the batch was read, the event
+timestamps are the device (PortMidi) timestamps.
+
+    python midi_record.py info FILE
+    python midi_record.py play FILE [--port NAME] [--speed X]   # to a virtual rtmidi port
+"""
+import argparse
+import struct
+import sys
+import time
+
+from midi_input import MidiInputBackend
+
+MAGIC = b'MPTREC1\n'
+BATCH = struct.Struct('<dI')
+EVENT = struct.Struct('<4Bi')
+
+
+class MidiRecorder:
+    """Appends batches to a recording file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.batches = 0
+        self.events = 0
+
+    def write(self, batch, now=None):
+        if not batch:
+            return
+        out = bytearray(BATCH.pack(time.monotonic() if now is None else now, len(batch)))
+        for msg, timestamp in batch:
+            out += EVENT.pack(msg[0], msg[1], msg[2], msg[3] if len(msg) > 3 else 0, timestamp)
+        self.file.write(out)
+        self.batches += 1
+        self.events += len(batch)
+
+    def close(self):
+        self.file.close()
+
+
+def read_recording(path):
+    """List of ``(host_seconds, batch)`` with batches in the pygame.midi layout."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f'Not a MIDI recording: {path}')
+    batches = []
+    offset = len(MAGIC)
+    while offset < len(data):
+        host, count = BATCH.unpack_from(data, offset)
+        offset += BATCH.size
+        batch = []
+        for st, d1, d2, d3, timestamp in EVENT.iter_unpack(data[offset:offset + count * EVENT.size]):
+            batch.append([[st, d1, d2, d3], timestamp])
+        offset += count * EVENT.size
+        batches.append((host, batch))
+    return batches
+
+
+class RecordingInput:
+    """Wraps an input backend and records every batch it reads."""
+
+    def __init__(self, midi_in, path):
+        self.midi_in = midi_in
+        self.recorder = MidiRecorder(path)
+
+    def read(self, max_events):
+        data = self.midi_in.read(max_events)
+        self.recorder.write(data)
+        return data
+
+    def close(self):
+        self.recorder.close()
+        self.midi_in.close()
+
+    @property
+    def priority(self):
+        return self.midi_in.priority
+
+    @priority.setter
+    def priority(self, indices):
+        self.midi_in.priority = indices
+
+    def __getattr__(self, name):
+        return getattr(self.midi_in, name)
+
+
+class ReplayInput(MidiInputBackend):
+    """In-process stand-in for ``pygame.midi.Input`` that plays a recording.
+
+    Batches become readable at their recorded times divided by ``speed``
+    (``speed=None`` replays as fast as they can be read). Timestamps are moved
+    onto the replay clock so ``time() - timestamp`` is the latency seen by the
+    caller. With ``speed=None`` the recorded spacing is kept instead, so the
+    debounce still sees the pedal timing. ``wait()`` raises EOFError once
+    everything has been read.
+    """
+
+    name = 'replay'
+
+    def __init__(self, batches, speed=1.0, device_name='replay'):
+        super().__init__(None, device_name)
+        if isinstance(batches, str):
+            batches = read_recording(batches)
+        self.batches = batches
+        self.speed = speed
+        self.connected = True
+        self.reconnects = 0
+        self._index = 0
+        self._pending = []
+        self._t0 = None
+
+    def open(self):
+        self._t0 = time.perf_counter()
+        self._index = 0
+        self._pending = []
+        return self
+
+    def _due(self, i):
+        """Replay time in seconds at which batch ``i`` becomes readable."""
+        if self.speed is None:
+            return 0
+        return (self.batches[i][0] - self.batches[0][0]) / self.speed
+
+    def _release(self, now):
+        while self._index < len(self.batches) and self._due(self._index) <= now:
+            _host, batch = self.batches[self._index]
+            due_ms = int(self._due(self._index) * 1000)
+            self._index += 1
+            if self.speed is None:
+                origin = self.batches[0][1][0][1]
+                self._pending.extend([msg, ts - origin] for msg, ts in batch)
+                continue
+            base = batch[-1][1]
+            # keep the spacing inside the batch; its last event arrived just before the read
+            self._pending.extend([msg, due_ms + int((ts - base) / self.speed)] for msg, ts in batch)
+
+    def wait(self, timeout=None) -> bool:
+        now = time.perf_counter() - self._t0
+        self._release(now)
+        if self._pending:
+            return True
+        if self._index >= len(self.batches):
+            raise EOFError('end of recording')
+        delay = self._due(self._index) - now
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            return False
+        time.sleep(max(0, delay))
+        self._release(time.perf_counter() - self._t0)
+        return bool(self._pending)
+
+    def read(self, max_events):
+        out = self._pending[:max_events]
+        del self._pending[:max_events]
+        return out
+
+    def time(self) -> int:
+        return int((time.perf_counter() - self._t0) * 1000)
+
+    def rescan(self):
+        return []
+
+
+def replay_speed(text):
+    """argparse type of ``--speed``: recorded times are divided by it."""
+    speed = float(text)
+    if not speed > 0:
+        raise argparse.ArgumentTypeError(f'speed must be greater than 0: {text}')
+    return speed
+
+
+def play_to_virtual_port(batches, port_name='MIDI page turn replay', speed=1.0):
+    """Send a recording to a virtual rtmidi (ALSA / CoreMIDI) output port, so the
+    unmodified app can open it like a real instrument."""
+    import rtmidi
+    from midi_thru import LENGTHS
+    midi_out = rtmidi.MidiOut()
+    midi_out.open_virtual_port(port_name)
+    try:
+        # give the receiving side time to connect
+        time.sleep(1)
+        t0 = time.perf_counter()
+        host0 = batches[0][0] if batches else 0
+        for host, batch in batches:
+            delay = (host - host0) / speed - (time.perf_counter() - t0)
+            if delay > 0:
+                time.sleep(delay)
+            for msg, _ts in batch:
+                midi_out.send_message(msg[:LENGTHS[msg[0]]])
+    finally:
+        midi_out.close_port()
+        midi_out.delete()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='MIDI recordings')
+    sub = parser.add_subparsers(dest='command', required=True)
+    info = sub.add_parser('info', help='summarise a recording')
+    info.add_argument('file')
+    play = sub.add_parser('play', help='play a recording to a virtual MIDI port')
+    play.add_argument('file')
+    play.add_argument('--port', default='MIDI page turn replay')
+    play.add_argument('--speed', type=replay_speed, default=1.0)
+    args = parser.parse_args(argv)
+
+    batches = read_recording(args.file)
+    if args.command == 'info':
+        events = sum(len(b) for _h, b in batches)
+        duration = batches[-1][0] - batches[0][0] if batches else 0
+        print(f'{len(batches)} batches, {events} events, {duration:.1f} s')
+    elif args.command == 'play':
+        play_to_virtual_port(batches, args.port, args.speed)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
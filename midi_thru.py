@@ -0,0 +1,199 @@
+"""MIDI thru: the keyboard drives a soft synth and turns the pages.
+
+The page turner opens the input on its own, and not every backend lets a synth
+open it too. With ``--thru`` every batch read is forwarded to an output port
+right after the read, before it is decoded, minus the messages the pedal
+mapping consumes (a soft pedal turning pages should not also soften the synth):
+
+    python midi_page_turn2.py --thru                 # virtual port 'MIDI page turn thru' (python-rtmidi)
+    python midi_page_turn2.py --thru 'FLUID Synth'   # an output by PortMidi id or name
+
+Outputs:
+
+- ``pygame``: ``pygame.midi.Output`` with no latency. A batch goes out in one
+  ``write()`` call, in the layout it was read in, so forwarding creates no
+  Python object per message. The output is reopened when a device rescan
+  closed it.
+- ``rtmidi``: a virtual port (or an rtmidi output port), one ``send_message()``
+  per message, sliced to the length of its status.
+
+A batch without consumed messages is forwarded as it is; the others are
+filtered through the same table indices as ActionTable.
+"""
+import os
+
+THRU_ENV = 'MIDI_PAGE_TURN_THRU'
+VIRTUAL = 'virtual'
+VIRTUAL_PORT = 'MIDI page turn thru'
+# pygame.midi writes at most this many events at once
+MAX_WRITE = 1024
+
+# bytes of a message by status byte; sysex never comes through the inputs
+LENGTHS = bytes([0] * 0x80 + [3] * 0x40 + [2] * 0x20 + [3] * 0x10
+                + [1, 2, 3, 2, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1])
+
+
+class MidiThru:
+    """Forwards batches minus the consumed messages. ``write(batch)`` sends them."""
+
+    name = 'base'
+
+    def __init__(self, consumed=()):
+        self.forwarded = 0
+        self.filtered = 0
+        self.errors = 0
+        self.consume(consumed)
+
+    def consume(self, indices):
+        """Table indices (``(status & 0x7F) << 7 | data1``) of the messages not to forward,
+        ``ActionTable.indices()``."""
+        table = bytearray(128 * 128)
+        for i in indices:
+            table[i] = 1
+        self._consumed = table
+
+    def forward(self, batch):
+        consumed = self._consumed
+        for msg, _timestamp in batch:
+            if consumed[((msg[0] & 0x7F) << 7) | msg[1]]:
+                kept = [e for e in batch if not consumed[((e[0][0] & 0x7F) << 7) | e[0][1]]]
+                self.filtered += len(batch) - len(kept)
+                batch = kept
+                break
+        if batch:
+            try:
+                self.write(batch)
+            except Exception:
+                self.errors += 1
+                return
+            self.forwarded += len(batch)
+
+    def write(self, batch):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PygameThru(MidiThru):
+    """A PortMidi output, found again by name if a rescan closed it."""
+
+    name = 'pygame'
+
+    def __init__(self, device_id, consumed=(), buffer_size=4096):
+        super().__init__(consumed)
+        self.device_id = device_id
+        self.device_name = None
+        self.buffer_size = buffer_size
+        self.out = None
+
+    @property
+    def port(self):
+        return self.device_name
+
+    def open(self):
+        import pygame.midi
+        if not pygame.midi.get_init():
+            pygame.midi.init()
+        if self.device_name is None:
+            self.device_name = pygame.midi.get_device_info(self.device_id)[1].decode('utf-8')
+        # latency 0: PortMidi ignores the timestamps and sends right away
+        self.out = pygame.midi.Output(self.device_id, 0, self.buffer_size)
+        return self
+
+    def _reopen(self):
+        import pygame.midi
+        for i in range(pygame.midi.get_count()):
+            _interf, name, _is_input, is_output, _opened = pygame.midi.get_device_info(i)
+            if is_output and name.decode('utf-8') == self.device_name:
+                self.device_id = i
+                return self.open()
+        raise IOError(f'MIDI output not found: {self.device_name}')
+
+    def write(self, batch):
+        try:
+            self._write(batch)
+        except Exception:
+            # PortMidi ids and streams do not survive a rescan of the inputs
+            self.out = None
+            self._reopen()
+            self._write(batch)
+
+    def _write(self, batch):
+        write = self.out.write
+        if len(batch) <= MAX_WRITE:
+            write(batch)
+            return
+        for i in range(0, len(batch), MAX_WRITE):
+            write(batch[i:i + MAX_WRITE])
+
+    def close(self):
+        if self.out is not None:
+            try:
+                self.out.close()
+            except Exception:
+                pass
+            self.out = None
+
+
+class RtMidiThru(MidiThru):
+    """A virtual output port, or the rtmidi output port ``port_name``."""
+
+    name = 'rtmidi'
+
+    def __init__(self, port_name=None, consumed=()):
+        super().__init__(consumed)
+        self.port_name = port_name
+        self.out = None
+
+    @property
+    def port(self):
+        return self.port_name or VIRTUAL_PORT
+
+    def open(self):
+        import rtmidi
+        from midi_input import find_port
+        self.out = rtmidi.MidiOut()
+        if self.port_name is None:
+            self.out.open_virtual_port(VIRTUAL_PORT)
+            return self
+        index = find_port(self.out.get_ports(), self.port_name)
+        if index is None:
+            self.out.delete()
+            self.out = None
+            raise IOError(f'MIDI output not found by rtmidi: {self.port_name}')
+        self.out.open_port(index)
+        return self
+
+    def write(self, batch):
+        send = self.out.send_message
+        lengths = LENGTHS
+        for msg, _timestamp in batch:
+            send(msg[:lengths[msg[0]]])
+
+    def close(self):
+        if self.out is not None:
+            self.out.close_port()
+            self.out.delete()
+            self.out = None
+
+
+def open_thru(spec=None, consumed=()):
+    """Open the thru output ``spec``: 'virtual' (the default, or MIDI_PAGE_TURN_THRU),
+    a PortMidi output id, or an output name, looked up in PortMidi then rtmidi."""
+    spec = spec or os.environ.get(THRU_ENV) or VIRTUAL
+    if spec == VIRTUAL:
+        return RtMidiThru(None, consumed).open()
+    if spec.isdigit():
+        return PygameThru(int(spec), consumed).open()
+    try:
+        from device_watcher import pygame_devices
+        import pygame.midi
+        if not pygame.midi.get_init():
+            pygame.midi.init()
+        for device in pygame_devices():
+            if device.is_output and device.name == spec:
+                return PygameThru(device.id, consumed).open()
+    except ImportError:
+        pass
+    return RtMidiThru(spec, consumed).open()
@@ -0,0 +1,287 @@
+"""Page turns over the network: one pedal, many music stands.
+
+The leader's machine runs the usual pipeline with the ``relay`` output: every
+page turn leaving the dispatcher is sent as one UDP datagram to a multicast
+group (the default) or to a list of hosts. Each stand runs a receiver, which
+turns its own viewer through its local output (keys, okular, ...).
+
+    python midi_page_turn2.py --relay [GROUP_OR_HOSTS]         # leader
+    python net_relay.py listen [--group GROUP] [--port PORT]   # every stand
+
+Datagram (little endian)::
+
+    b'MPTR' <B count> <B action_length> <I sender> <I seq> <Q sent_unix_ns> action
+
+``sender`` is random per leader session. Every datagram is sent ``repeat``
+times back to back; receivers keep a sliding window of the sequence numbers
+seen per sender, drop the copies and count the gaps as lost. One-way latency
+is the receiver's clock minus ``sent_unix_ns``, which only means something
+when the clocks are synchronized (NTP/PTP, or the same host).
+
+MIDI_PAGE_TURN_RELAY sets the destination: a multicast group, or comma
+separated ``host[:port]`` for unicast. Multicast datagrams get a TTL of 1, they
+stay on the local network.
+"""
+import argparse
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+from page_output import OUTPUTS, PageOutput, Turn
+from telemetry import percentile, LatencyHistogram
+
+RELAY_ENV = 'MIDI_PAGE_TURN_RELAY'
+DEFAULT_GROUP = '239.255.77.77'
+DEFAULT_PORT = 47474
+REPEAT = 3
+MAGIC = b'MPTR'
+HEADER = struct.Struct('<4sBBIIQ')
+# sequence numbers are the header's 32 bit field
+SEQ_MASK = 0xFFFFFFFF
+# DSCP EF, expedited forwarding on networks that honour it
+TOS_EF = 0xB8
+RELAY_BUCKETS_MS = (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+
+def parse_targets(spec=None):
+    """``[(host, port)]`` from a group or ``host[:port],...`` spec, MIDI_PAGE_TURN_RELAY by default."""
+    spec = spec or os.environ.get(RELAY_ENV) or DEFAULT_GROUP
+    targets = []
+    for item in spec.split(','):
+        host, _, port = item.strip().rpartition(':')
+        if not host:
+            host, port = port, ''
+        targets.append((host, int(port) if port else DEFAULT_PORT))
+    return targets
+
+
+def encode(sender, seq, action, count=1, sent_ns=None):
+    raw = action.encode('utf-8')[:255]
+    return HEADER.pack(MAGIC, min(count, 255), len(raw), sender, seq,
+                       time.time_ns() if sent_ns is None else sent_ns) + raw
+
+
+def decode(data):
+    """``(sender, seq, action, count, sent_ns)`` or None for a foreign datagram."""
+    if len(data) < HEADER.size:
+        return None
+    magic, count, length, sender, seq, sent_ns = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        return None
+    action = data[HEADER.size:HEADER.size + length].decode('utf-8', 'replace')
+    return sender, seq, action, count, sent_ns
+
+
+class RelayOutput(PageOutput):
+    """Sends the page turns to the stands instead of turning a local viewer."""
+
+    name = 'relay'
+
+    def __init__(self, fallback=None, targets=None, repeat=REPEAT):
+        self.targets = parse_targets(targets) if not isinstance(targets, list) else targets
+        self.repeat = repeat
+        self.sender = random.getrandbits(32)
+        self.seq = 0
+        self.sent = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        # stands on the leader's machine get the datagrams too
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        try:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_TOS, TOS_EF)
+        except OSError:
+            pass
+
+    def turn(self, turn, count=1):
+        self.seq = (self.seq + 1) & SEQ_MASK
+        packet = encode(self.sender, self.seq, turn.action, count)
+        sendto = self.sock.sendto
+        for _ in range(self.repeat):
+            for target in self.targets:
+                sendto(packet, target)
+        self.sent += 1
+
+    def close(self):
+        self.sock.close()
+
+
+OUTPUTS[RelayOutput.name] = RelayOutput
+
+
+class SeqWindow:
+    """Sequence numbers seen from one sender, the last ``SIZE`` as a bit mask."""
+
+    SIZE = 64
+
+    def __init__(self):
+        self.last = None
+        self.mask = 0
+        self.lost = 0
+
+    def accept(self, seq):
+        """True the first time ``seq`` is seen; copies and very late datagrams are False.
+
+        Sequence numbers wrap at 32 bits: ``seq`` is ahead of the last one when it
+        is less than half the range after it.
+        """
+        if self.last is None:
+            self.last, self.mask = seq, 1
+            return True
+        shift = (seq - self.last) & SEQ_MASK
+        if 0 < shift <= SEQ_MASK >> 1:
+            # counted lost until they show up late
+            self.lost += shift - 1
+            self.mask = ((self.mask << shift) | 1) & ((1 << self.SIZE) - 1) if shift < self.SIZE else 1
+            self.last = seq
+            return True
+        behind = (self.last - seq) & SEQ_MASK
+        bit = 1 << behind if behind < self.SIZE else 0
+        if not bit or self.mask & bit:
+            return False
+        self.mask |= bit
+        self.lost -= 1
+        return True
+
+
+class RelayReceiver:
+    """Receives the page turns of a group or port on a background thread.
+
+    ``on_turn(action, count, seq, latency_ms)`` is called once per page turn,
+    whatever the number of copies received.
+    """
+
+    def __init__(self, on_turn, group=None, port=DEFAULT_PORT, max_samples=4096):
+        self.on_turn = on_turn
+        self.group = group
+        self.port = port
+        self.received = 0
+        self.duplicates = 0
+        self.foreign = 0
+        self.errors = 0
+        self.windows = {}
+        self.latency = LatencyHistogram(RELAY_BUCKETS_MS)
+        self.latencies = deque(maxlen=max_samples)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # several receivers of one group on one host
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if group is not None and hasattr(socket, 'SO_REUSEPORT'):
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.bind(('', port))
+        if group is not None:
+            membership = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton('0.0.0.0'))
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        self.sock.settimeout(0.25)
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def lost(self):
+        return sum(w.lost for w in self.windows.values())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='relay-receiver', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2)
+        self.sock.close()
+
+    def handle(self, data, now_ns=None):
+        message = decode(data)
+        if message is None:
+            self.foreign += 1
+            return
+        sender, seq, action, count, sent_ns = message
+        window = self.windows.get(sender)
+        if window is None:
+            window = self.windows[sender] = SeqWindow()
+        if not window.accept(seq):
+            self.duplicates += 1
+            return
+        latency_ms = ((time.time_ns() if now_ns is None else now_ns) - sent_ns) / 1e6
+        self.received += 1
+        self.latency.record(latency_ms)
+        self.latencies.append(latency_ms)
+        try:
+            self.on_turn(action, count, seq, latency_ms)
+        except Exception:
+            self.errors += 1
+
+    def _run(self):
+        recv = self.sock.recv
+        while not self._stop.is_set():
+            try:
+                data = recv(512)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.handle(data)
+
+    def summary(self):
+        lat = self.latencies
+        return {
+            'received': self.received,
+            'duplicates': self.duplicates,
+            'lost': self.lost,
+            'errors': self.errors,
+            'senders': len(self.windows),
+            'p50_ms': percentile(lat, 50),
+            'p99_ms': percentile(lat, 99),
+            'max_ms': max(lat) if lat else 0,
+        }
+
+    def format(self):
+        return ('received {received}  duplicates {duplicates}  lost {lost}  errors {errors}  '
+                'one-way p50 {p50_ms:.3f} ms  p99 {p99_ms:.3f} ms  max {max_ms:.3f} ms').format(**self.summary())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Network page turn relay')
+    sub = parser.add_subparsers(dest='command', required=True)
+    listen = sub.add_parser('listen', help='turn the local viewer on the turns of the leader')
+    listen.add_argument('--group', default=DEFAULT_GROUP,
+                        help=f'multicast group, "none" for unicast only (default {DEFAULT_GROUP})')
+    listen.add_argument('--port', type=int, default=DEFAULT_PORT)
+    listen.add_argument('--output', default=None, help='local output backend, see page_output.py')
+    args = parser.parse_args(argv)
+
+    import midi_page_turn2
+    midi_page_turn2.OUTPUT = args.output
+    if midi_page_turn2.needs_window():
+        midi_page_turn2.select_target_window()
+
+    def on_turn(action, count, seq, latency_ms):
+        # an action of the app, anything else is a key name like in mapping files
+        key = midi_page_turn2.ACTIONS.get(action, action)
+        if not key:
+            print(f'  skipped turn without an action  seq {seq}')
+            return
+        print(f'  🎼 {action.upper()} x{count}  seq {seq}  one-way {latency_ms:.2f} ms')
+        midi_page_turn2.turn_page(Turn(action, key, None), count)
+
+    group = None if args.group == 'none' else args.group
+    receiver = RelayReceiver(on_turn, group, args.port).start()
+    print(f'Listening for page turns on {group or "*"}:{args.port}')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.stop()
+        from page_output import close_output
+        close_output()
+        print(receiver.format())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
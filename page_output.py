@@ -0,0 +1,304 @@
+"""Where page turns go.
+
+The dispatcher hands every page turn (a ``Turn``: the rule's action, key and
+target window) to one output backend:
+
+- ``keys``: synthetic key presses through key_injector.py, the default. Depends on
+  the focus and on the viewer's key bindings.
+- ``okular``: ``slotNextPage`` / ``slotPreviousPage`` over D-Bus.
+- ``zathura``: ``GotoPage`` over zathura's D-Bus interface.
+- ``mock``: records the turns and keeps a page number, for tests and benchmarks.
+- ``relay``: UDP datagrams to other machines, registered by net_relay.py when it
+  is first asked for (``OUTPUT_MODULES``).
+
+The IPC backends turn the page with one message on the session bus, without
+touching the focus. Actions they cannot do (anything but 'next' and 'prev') go
+to the ``keys`` backend. D-Bus goes through jeepney when it is installed
+(``pip install jeepney``, one connection for the whole session) and through one
+``dbus-send`` process per call otherwise.
+
+Evince has no page navigation on D-Bus and mupdf no command channel at all, so
+they are driven with keys.
+
+More backends can be added to ``OUTPUTS``; set MIDI_PAGE_TURN_OUTPUT (or
+``--output``) to pick one. score_viewer.py installs its own window as the
+output with ``use_output()``.
+"""
+import os
+import re
+import subprocess
+import threading
+from collections import namedtuple
+
+from key_injector import get_injector, close_injector
+
+OUTPUT_ENV = 'MIDI_PAGE_TURN_OUTPUT'
+
+Turn = namedtuple('Turn', 'action key window')
+
+
+class DBusError(IOError):
+    pass
+
+
+class DBusSession:
+    """Method calls on the session bus."""
+
+    DBUS = 'org.freedesktop.DBus'
+    PROPERTIES = 'org.freedesktop.DBus.Properties'
+    # dbus-send argument types
+    TYPES = {'s': 'string', 'u': 'uint32', 'i': 'int32', 'b': 'boolean'}
+    _VALUE = re.compile(r'\b(string|u?int(?:16|32|64)|byte|boolean|double) ("(?:[^"\\]|\\.)*"|\S+)')
+
+    def __init__(self):
+        try:
+            from jeepney.io.blocking import open_dbus_connection
+        except ImportError:
+            self.connection = None
+        else:
+            self.connection = open_dbus_connection(bus='SESSION')
+        self._lock = threading.Lock()
+
+    @property
+    def transport(self):
+        return 'jeepney' if self.connection is not None else 'dbus-send'
+
+    def call(self, service, path, interface, method, signature='', *args):
+        """Call a method and return the values of the reply as a list."""
+        if self.connection is not None:
+            from jeepney import DBusAddress, new_method_call
+            from jeepney.wrappers import unwrap_msg, DBusErrorResponse
+            msg = new_method_call(DBusAddress(path, bus_name=service, interface=interface),
+                                  method, signature or None, args)
+            try:
+                with self._lock:
+                    return list(unwrap_msg(self.connection.send_and_get_reply(msg, timeout=2)))
+            except (DBusErrorResponse, TimeoutError) as e:
+                raise DBusError(f'{service} {method}: {e}')
+        argv = ['dbus-send', '--session', '--print-reply', f'--dest={service}', path, f'{interface}.{method}']
+        argv += [f'{self.TYPES[t]}:{a}' for t, a in zip(signature, args)]
+        try:
+            out = subprocess.check_output(argv, stderr=subprocess.PIPE, timeout=2).decode('utf-8')
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            raise DBusError(f'{service} {method}: {e}')
+        values = []
+        # skip the 'method return ...' header line
+        for kind, value in self._VALUE.findall(out.split('\n', 1)[-1]):
+            if kind == 'string':
+                values.append(value[1:-1])
+            elif kind == 'boolean':
+                values.append(value == 'true')
+            elif kind == 'double':
+                values.append(float(value))
+            else:
+                values.append(int(value))
+        return values
+
+    def list_names(self):
+        values = self.call(self.DBUS, '/org/freedesktop/DBus', self.DBUS, 'ListNames')
+        # jeepney returns the array as one value
+        return values[0] if self.connection is not None else values
+
+    def get_property(self, service, path, interface, name):
+        values = self.call(service, path, self.PROPERTIES, 'Get', 'ss', interface, name)
+        # jeepney returns the variant as (signature, value)
+        return values[0][1] if self.connection is not None else values[0]
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class PageOutput:
+    """Base class of the output backends. ``turn()`` is called from the dispatch thread."""
+
+    name = 'base'
+
+    def turn(self, turn, count=1):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class KeystrokeOutput(PageOutput):
+    """Key presses to the turn's window or to ``window``, a window spec or a
+    function returning one (called on the first turn)."""
+
+    name = 'keys'
+
+    def __init__(self, fallback=None, window=None):
+        self.window = window
+
+    def turn(self, turn, count=1):
+        window = turn.window
+        if window is None:
+            if callable(self.window):
+                self.window = self.window()
+            window = self.window
+        get_injector(window).send(turn.key, count)
+
+
+class DBusViewerOutput(PageOutput):
+    """A viewer on the session bus, found by the prefix of its service name.
+
+    The service (it carries the viewer's pid) is looked up on the first turn and
+    again when a call fails, e.g. after the viewer was restarted.
+    """
+
+    prefix = None
+    path = None
+    interface = None
+
+    def __init__(self, fallback=None, service=None):
+        self.fallback = fallback
+        self.bus = DBusSession()
+        self.fixed_service = service
+        self.service = service
+        self.turns = 0
+
+    def find(self):
+        if self.fixed_service is not None:
+            return self.fixed_service
+        names = sorted(n for n in self.bus.list_names() if n.startswith(self.prefix))
+        if not names:
+            raise DBusError(f'No {self.name} on the session bus')
+        return names[0]
+
+    def go(self, service, action, count):
+        raise NotImplementedError
+
+    def turn(self, turn, count=1):
+        if turn.action not in ('next', 'prev'):
+            if self.fallback is None:
+                raise ValueError(f'{self.name} output cannot do {turn.action!r}')
+            return self.fallback.turn(turn, count)
+        if self.service is None:
+            self.service = self.find()
+        try:
+            self.go(self.service, turn.action, count)
+        except DBusError:
+            # the viewer may have been restarted under a new pid
+            self.service = self.find()
+            self.go(self.service, turn.action, count)
+        self.turns += count
+
+    def close(self):
+        self.bus.close()
+        if self.fallback is not None:
+            self.fallback.close()
+
+
+class OkularOutput(DBusViewerOutput):
+
+    name = 'okular'
+    prefix = 'org.kde.okular-'
+    path = '/okular'
+    interface = 'org.kde.okular'
+
+    def go(self, service, action, count):
+        method = 'slotNextPage' if action == 'next' else 'slotPreviousPage'
+        for _ in range(count):
+            self.bus.call(service, self.path, self.interface, method)
+
+
+class ZathuraOutput(DBusViewerOutput):
+
+    name = 'zathura'
+    prefix = 'org.pwmt.zathura.PID-'
+    path = '/org/pwmt/zathura'
+    interface = 'org.pwmt.zathura'
+
+    def go(self, service, action, count):
+        # zero based; read every time, the page may also be turned from the keyboard
+        page = self.bus.get_property(service, self.path, self.interface, 'pagenumber')
+        pages = self.bus.get_property(service, self.path, self.interface, 'numberofpages')
+        page += count if action == 'next' else -count
+        self.bus.call(service, self.path, self.interface, 'GotoPage', 'u', max(0, min(pages - 1, page)))
+
+
+class MockOutput(PageOutput):
+    """Records the turns and follows the page number, nothing leaves the process."""
+
+    name = 'mock'
+
+    def __init__(self, fallback=None, page=1, pages=None):
+        self.page = page
+        self.pages = pages
+        self.turns = []
+
+    def turn(self, turn, count=1):
+        self.turns.append((turn, count))
+        if turn.action == 'next':
+            self.page += count
+            if self.pages is not None:
+                self.page = min(self.page, self.pages)
+        elif turn.action == 'prev':
+            self.page = max(1, self.page - count)
+
+
+OUTPUTS = {
+    KeystrokeOutput.name: KeystrokeOutput,
+    OkularOutput.name: OkularOutput,
+    ZathuraOutput.name: ZathuraOutput,
+    MockOutput.name: MockOutput,
+}
+
+# outputs registered in OUTPUTS by their own module, imported when first asked for
+OUTPUT_MODULES = {
+    'relay': 'net_relay',
+}
+
+
+def output_names():
+    """Every output kind, for --output, without importing the modules of the others."""
+    return list(OUTPUTS) + [kind for kind in OUTPUT_MODULES if kind not in OUTPUTS]
+
+
+def output_name(kind=None):
+    """``kind``, MIDI_PAGE_TURN_OUTPUT or 'keys'."""
+    return kind or os.environ.get(OUTPUT_ENV) or KeystrokeOutput.name
+
+
+def create_output(kind=None, window=None):
+    """Create the output backend ``kind``. ``window`` is the window of the key presses,
+    used by ``keys`` and as the fallback of the others."""
+    kind = output_name(kind)
+    if kind not in OUTPUTS and kind in OUTPUT_MODULES:
+        import importlib
+        importlib.import_module(OUTPUT_MODULES[kind])
+    if kind not in OUTPUTS:
+        raise ValueError(f'Unknown output: {kind}')
+    keys = KeystrokeOutput(window=window)
+    if kind == KeystrokeOutput.name:
+        return keys
+    return OUTPUTS[kind](fallback=keys)
+
+
+_output = None
+
+
+def get_output(kind=None, window=None):
+    """The process-wide output backend, created on first use."""
+    global _output
+    if _output is None:
+        _output = create_output(kind, window)
+    return _output
+
+
+def use_output(output):
+    """Make ``output`` the process-wide backend, for outputs that need more than a
+    kind to be created (the built-in viewer of score_viewer.py)."""
+    global _output
+    if _output is not None and _output is not output:
+        _output.close()
+    _output = output
+
+
+def close_output():
+    global _output
+    if _output is not None:
+        _output.close()
+        _output = None
+    close_injector()
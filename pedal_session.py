@@ -0,0 +1,173 @@
+"""Per-input pedal sessions.
+
+A session owns one MIDI input together with its pedal mapping, its pedal state
+(the tables of its PedalDecoder) and its loop statistics. Sessions share nothing
+but the key dispatcher, which is thread safe, so one process can listen to a
+keyboard and a separate USB foot controller at the same time.
+
+A session can write its edges to an EventJournal (event_journal.py) and feed
+its notes to a ScoreFollower (score_follower.py), whose page turns go to the
+same dispatcher. With a PollTimings in ``timings`` it times its reads and
+decodes for the metrics exporter (metrics.py).
+
+A MidiThru (midi_thru.py) in ``thru`` gets every batch right after it is read,
+minus the messages the mapping consumes.
+
+The number of events read at once follows the arrival rate (ReadBatch), the
+mapped pedals are the input's ``priority`` messages, and after the input lost
+messages to a full buffer the pedals are armed again, so a lost release
+cannot silence a pedal for the rest of the show.
+"""
+import time
+from time import perf_counter
+
+from midi_decoder import PedalDecoder
+from midi_input import ReadBatch
+from dispatch import SOURCE_FOLLOWER
+from page_output import Turn
+from telemetry import LoopStats
+
+
+class PedalSession:
+    """One MIDI input and the pedals decoded from it.
+
+    ``midi_in`` is an input that is not open yet (usually a ReconnectingInput),
+    ``mapping`` is anything PedalDecoder takes: ``{cc: key}``, rules or an
+    ActionTable. Extra keyword arguments go to PedalDecoder.
+    """
+
+    __slots__ = ('midi_in', 'decoder', 'stats', 'label', 'journal', 'follower', 'timings', 'batch', 'overflows',
+                 'thru')
+
+    def __init__(self, midi_in, mapping, label=None, journal=None, follower=None, thru=None, **decoder_options):
+        self.midi_in = midi_in
+        self.decoder = PedalDecoder(mapping, **decoder_options)
+        self.stats = LoopStats()
+        self.label = label
+        self.journal = journal
+        self.follower = follower
+        self.thru = thru
+        # PollTimings, see telemetry.py
+        self.timings = None
+        self.batch = ReadBatch()
+        # input overflows already handled
+        self.overflows = 0
+
+    def open(self):
+        self.midi_in.open()
+        self._consume()
+        if self.label is None:
+            self.label = self.midi_in.device_name
+        return self
+
+    def remap(self, mapping, **decoder_options):
+        """Switch to a new mapping without closing the input. Can be called from
+        another thread: the receive loop picks the new decoder up on its next batch."""
+        decoder = PedalDecoder(mapping, **decoder_options)
+        # a pedal held down during the reload must not turn a page again
+        decoder.adopt(self.decoder)
+        self.decoder = decoder
+        self._consume()
+
+    def _consume(self):
+        # the mapped messages: never dropped by the input, never forwarded
+        indices = self.decoder.actions.indices()
+        self.midi_in.priority = indices
+        if self.thru is not None:
+            self.thru.consume(indices)
+
+    def poll(self, dispatcher, max_events=None):
+        """Read one batch, decode it and queue its page turns. Returns the edges.
+
+        ``max_events`` fixes the size of the read, adaptive by default.
+        This is the hot path shared by the CLI, the UI, replays and the benchmarks.
+        """
+        midi_in = self.midi_in
+        timings = self.timings
+        if timings is not None:
+            start = perf_counter()
+        # status, controller, value, ?, timestamp
+        # [[176, 67, 127, 0], 41834]
+        if max_events is None:
+            batch = self.batch
+            data = midi_in.read(batch.size)
+            batch.update(len(data))
+        else:
+            data = midi_in.read(max_events)
+        thru = self.thru
+        if thru is not None and data:
+            thru.forward(data)
+        stats = self.stats
+        stats.count_events(len(data))
+        if timings is not None:
+            read_done = perf_counter()
+        health = getattr(midi_in, 'health', None)
+        if health is not None and health.overflows != self.overflows:
+            self._overflowed(health)
+
+        edges = self.decoder.decode(data)
+        if timings is not None:
+            timings.record(start, read_done, perf_counter(), len(edges))
+        if edges:
+            clock = midi_in.time
+            now = clock()
+            journal = self.journal
+            for edge in edges:
+                latency = now - edge.timestamp
+                stats.record_latency(latency)
+                if timings is not None:
+                    timings.latency.record(latency)
+                if journal is not None:
+                    journal.edge(edge, latency)
+                # each input has its own clock
+                dispatcher.put(Turn(edge.action, edge.key, edge.window), edge.timestamp, clock)
+        follower = self.follower
+        if follower is not None and data:
+            for edge in edges:
+                follower.manual_turn(edge.action)
+            for turn, timestamp in follower.feed(data):
+                dispatcher.put(turn, timestamp, midi_in.time, SOURCE_FOLLOWER)
+        return edges
+
+    def _overflowed(self, health):
+        gaps = list(health.gaps)[-(health.overflows - self.overflows):]
+        self.overflows = health.overflows
+        self.decoder.rearm()
+        if self.journal is not None:
+            for gap in gaps:
+                self.journal.overflow(gap)
+
+    def log_stats(self):
+        """Write the event and debounce counters to the journal, if any."""
+        if self.journal is not None:
+            midi_in = self.midi_in
+            self.journal.stats(midi_in.time(), self.stats.events, self.decoder.suppressed,
+                               getattr(midi_in, 'connected', True))
+
+    def close(self):
+        self.log_stats()
+        self.midi_in.close()
+
+
+def wait_any(sessions, timeout=None, min_sleep=0.0002, max_sleep=0.002):
+    """Wait until one of ``sessions`` has data. Returns the ready sessions.
+
+    A single session blocks in its input's ``wait()``. Several inputs cannot be
+    waited on together (PortMidi has no handle to select on), so they are polled
+    with a backoff capped at ``max_sleep``, like the pygame backend does.
+    """
+    if len(sessions) == 1:
+        return sessions if sessions[0].midi_in.wait(timeout) else []
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = min_sleep
+    while True:
+        ready = [s for s in sessions if s.midi_in.wait(0)]
+        if ready:
+            return ready
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            delay = min(delay, remaining)
+        time.sleep(delay)
+        delay = min(delay * 2, max_sleep)
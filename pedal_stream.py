@@ -0,0 +1,157 @@
+"""Pedal edges of a PedalSession as an asyncio stream.
+
+The UI used to receive in a thread worker: it slept in ``midi_in.wait(0.1)``,
+checked for cancellation on every turn of the loop and handed every edge to
+Textual with ``call_from_thread``. A ``PedalStream`` runs on the event loop
+instead:
+
+- an rtmidi input calls ``on_data`` from the RtMidi thread, which wakes the loop
+  with one ``call_soon_threadsafe`` per idle-to-busy transition, not per message;
+- PortMidi has nothing to register with the loop, so it is polled on a thread
+  (PygameMidiInput.wait()) that wakes the loop the same way. The thread only
+  polls while the loop waits for it, the loop only reads while the thread is
+  parked, so a stream is never used by two threads at once;
+- device rescans (``pygame.midi.quit()/init()`` and the reopen) run in
+  ``asyncio.to_thread``, the loop keeps rendering;
+- edges come out on the loop thread, so widgets can be updated directly;
+- cancelling the consuming task stops the stream at once; there is no timeout
+  to run out and no flag to poll.
+
+Key sending stays on the KeyDispatcher thread: injectors block.
+
+    async for edges in PedalStream(session, dispatcher):
+        ...
+"""
+import asyncio
+import threading
+
+# longest the poller thread stays in PortMidi before looking for a rescan or a stop
+POLL_SLICE = 0.05
+
+
+class PedalStream:
+    """Async iterator of the edge lists of the batches read from ``session``.
+
+    Every batch the input delivers is decoded and its page turns queued on
+    ``dispatcher``, as ``PedalSession.poll()`` does; batches without pedal edges
+    yield an empty list, so the consumer sees the traffic. ``on_rescan(devices,
+    reconnected)`` is called after a device rescan asked for with ``rescan()``.
+    """
+
+    def __init__(self, session, dispatcher, on_rescan=None, max_events=None):
+        self.session = session
+        self.dispatcher = dispatcher
+        self.on_rescan = on_rescan
+        self.max_events = max_events
+        self.wakeups = 0
+        self._loop = None
+        self._ready = None
+        self._sleeping = False
+        self._rescan = False
+        # PortMidi poller: armed by the loop, idle while parked
+        self._poller = None
+        self._armed = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._stop = threading.Event()
+        self._waiter = None
+
+    def _wake(self):
+        # RtMidi callback thread; only the first message after a sleep crosses over
+        if self._sleeping:
+            self._sleeping = False
+            self._loop.call_soon_threadsafe(self._ready.set)
+
+    def rescan(self):
+        """Rescan the MIDI devices and reopen the input by name, from the loop.
+        Can be called from any thread, e.g. a DeviceWatcher."""
+        self._rescan = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._ready.set)
+
+    def _rescan_devices(self):
+        # worker thread of asyncio.to_thread, with the poller parked
+        self._idle.wait()
+        midi_in = self.session.midi_in
+        reconnects = midi_in.reconnects
+        devices = midi_in.rescan()
+        if not midi_in.connected:
+            self.session.decoder.reset()
+        return devices, midi_in.reconnects != reconnects
+
+    async def _do_rescan(self):
+        self._rescan = False
+        devices, reconnected = await asyncio.to_thread(self._rescan_devices)
+        if self.on_rescan is not None:
+            self.on_rescan(devices, reconnected)
+
+    def _poll(self, loop):
+        midi_in = self.session.midi_in
+        while True:
+            self._armed.wait()
+            self._armed.clear()
+            if self._stop.is_set():
+                return
+            self._idle.clear()
+            try:
+                while not (self._stop.is_set() or self._rescan or midi_in.wait(POLL_SLICE)):
+                    pass
+            finally:
+                self._idle.set()
+            if self._stop.is_set():
+                return
+            loop.call_soon_threadsafe(self._resolve, self._waiter)
+
+    @staticmethod
+    def _resolve(waiter):
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def _stop_poller(self):
+        if self._poller is None:
+            return
+        self._stop.set()
+        self._armed.set()
+        # at most one slice: the session closes the input after the stream
+        self._poller.join(POLL_SLICE * 4)
+        self._poller = None
+
+    async def _wait(self):
+        midi_in = self.session.midi_in
+        if midi_in.wait(0):
+            return
+        if getattr(midi_in, 'can_notify', False):
+            self._ready.clear()
+            self._sleeping = True
+            # the callback may have run before _sleeping was set
+            if not (midi_in.wait(0) or self._rescan):
+                await self._ready.wait()
+            self._sleeping = False
+            return
+        if self._rescan:
+            return
+        if self._poller is None:
+            self._poller = threading.Thread(target=self._poll, args=(self._loop,), name='portmidi-poll', daemon=True)
+            self._poller.start()
+        self._waiter = self._loop.create_future()
+        self._armed.set()
+        await self._waiter
+
+    async def __aiter__(self):
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        session = self.session
+        session.midi_in.on_data = self._wake
+        try:
+            while True:
+                if self._rescan:
+                    await self._do_rescan()
+                await self._wait()
+                if self._rescan:
+                    continue
+                self.wakeups += 1
+                yield session.poll(self.dispatcher, self.max_events)
+        finally:
+            session.midi_in.on_data = None
+            self._stop_poller()
+            self._loop = None
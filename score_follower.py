@@ -0,0 +1,310 @@
+"""Automatic page turns from the notes being played.
+
+The pedal decoder ignores every note. A ``ScoreFollower`` reads the note-ons of
+the same batches, aligns them with a reference of the piece and queues a 'next'
+page turn ``lead`` beats before each page break, so the page is turned while
+the last bar of the page is still being played.
+
+Alignment is an online DTW restricted to a band of ``band`` onsets around the
+current position (Dixon's online time warping, without the tempo model): each
+note updates one column of cumulative costs over the band and the position is
+the cheapest cell. The cost per note is fixed by the band width, whatever the
+length of the piece. Played chords may be spread, wrong or missing notes cost a
+little; a jump of more than the band (a repeat, a skipped page) loses the
+position, the pedals still work.
+
+References:
+
+- MIDI files (``.mid``): note-ons of every channel but 10; page breaks have to be
+  given as beats (quarter notes from the start).
+- MusicXML (``.musicxml``, ``.xml``, compressed ``.mxl``), partwise: the page
+  breaks of the engraving (``<print new-page="yes">``) are used unless given.
+
+    python midi_page_turn2.py --follow piece.musicxml [--lead-beats 2] [--page-breaks 32,64,96]
+    python score_follower.py info piece.mid
+"""
+import argparse
+import struct
+import sys
+import zipfile
+
+LEAD_BEATS = 2.0
+BAND = 32
+# onsets behind the current position kept in the band
+BACK = 4
+
+# local costs of a played pitch against a reference onset
+MATCH = 0.0
+OCTAVE = 0.4
+MISS = 1.0
+# moves: another note on the same onset, an onset the player skipped
+STAY = 0.15
+SKIP = 0.6
+# notes this close are one (rolled) chord: moving on to the next onset costs more
+CHORD_MS = 35
+CHORD_ADVANCE = 0.5
+# a pedal 'next' this many beats before a break stands for its automatic turn
+MANUAL_WINDOW = 8
+INF = float('inf')
+
+STEPS = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+DRUM_CHANNEL = 9
+
+
+def _vlq(data, pos):
+    value = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        value = (value << 7) | (b & 0x7F)
+        if not b & 0x80:
+            return value, pos
+
+
+def read_midi(path):
+    """``[(beat, pitch)]`` of the note-ons of a standard MIDI file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'MThd':
+        raise ValueError(f'{path}: not a MIDI file')
+    (hlen,) = struct.unpack_from('>I', data, 4)
+    _format, tracks, division = struct.unpack_from('>HHH', data, 8)
+    if division & 0x8000:
+        raise ValueError(f'{path}: SMPTE time division is not supported')
+    pos = 8 + hlen
+    notes = []
+    for _ in range(tracks):
+        if data[pos:pos + 4] != b'MTrk':
+            raise ValueError(f'{path}: bad track chunk at {pos}')
+        (length,) = struct.unpack_from('>I', data, pos + 4)
+        pos += 8
+        end = pos + length
+        tick = 0
+        running = 0
+        while pos < end:
+            delta, pos = _vlq(data, pos)
+            tick += delta
+            b = data[pos]
+            if b == 0xFF:
+                length, pos = _vlq(data, pos + 2)
+                pos += length
+                continue
+            if b in (0xF0, 0xF7):
+                length, pos = _vlq(data, pos + 1)
+                pos += length
+                continue
+            if b & 0x80:
+                running = b
+                pos += 1
+            kind = running & 0xF0
+            if kind in (0xC0, 0xD0):
+                pos += 1
+                continue
+            d1, d2 = data[pos], data[pos + 1]
+            pos += 2
+            if kind == 0x90 and d2 and running & 0x0F != DRUM_CHANNEL:
+                notes.append((tick / division, d1))
+        pos = end
+    return notes
+
+
+def _musicxml_root(path):
+    import xml.etree.ElementTree as ET
+    if path.lower().endswith('.mxl'):
+        with zipfile.ZipFile(path) as z:
+            container = ET.fromstring(z.read('META-INF/container.xml'))
+            rootfile = next(e for e in container.iter() if e.tag.endswith('rootfile'))
+            return ET.fromstring(z.read(rootfile.get('full-path')))
+    return ET.parse(path).getroot()
+
+
+def read_musicxml(path):
+    """``([(beat, pitch)], page_break_beats)`` of a partwise MusicXML score."""
+    root = _musicxml_root(path)
+    if root.tag != 'score-partwise':
+        raise ValueError(f'{path}: only partwise MusicXML is supported')
+    notes = []
+    breaks = set()
+    for index, part in enumerate(root.findall('part')):
+        divisions = 1.0
+        pos = 0.0
+        onset = 0.0
+        for measure in part.findall('measure'):
+            start = pos
+            for el in measure:
+                tag = el.tag
+                if tag == 'attributes':
+                    value = el.findtext('divisions')
+                    if value:
+                        divisions = float(value)
+                elif tag == 'print':
+                    if index == 0 and el.get('new-page') == 'yes':
+                        breaks.add(start)
+                elif tag == 'backup':
+                    pos -= float(el.findtext('duration', '0')) / divisions
+                elif tag == 'forward':
+                    pos += float(el.findtext('duration', '0')) / divisions
+                elif tag == 'note':
+                    if el.find('grace') is not None or el.find('cue') is not None:
+                        continue
+                    if el.find('chord') is None:
+                        onset = pos
+                        pos += float(el.findtext('duration', '0')) / divisions
+                    pitch = el.find('pitch')
+                    # the second half of a tied note is not played again
+                    tied = any(t.get('type') == 'stop' for t in el.findall('tie'))
+                    if pitch is not None and not tied:
+                        notes.append((onset, (int(pitch.findtext('octave')) + 1) * 12
+                                      + STEPS[pitch.findtext('step')] + round(float(pitch.findtext('alter') or 0))))
+    return notes, sorted(breaks)
+
+
+def group_onsets(notes):
+    """``[(beat, frozenset(pitches))]``, one entry per onset time."""
+    onsets = {}
+    for beat, pitch in notes:
+        onsets.setdefault(round(beat, 4), set()).add(pitch)
+    return [(beat, frozenset(pitches)) for beat, pitches in sorted(onsets.items())]
+
+
+def load_reference(path):
+    """``(onsets, page_breaks)``; page_breaks is empty for MIDI files."""
+    lower = path.lower()
+    if lower.endswith(('.mid', '.midi', '.smf')):
+        notes, breaks = read_midi(path), []
+    elif lower.endswith(('.xml', '.musicxml', '.mxl')):
+        notes, breaks = read_musicxml(path)
+    else:
+        raise ValueError(f'{path}: expected a MIDI or MusicXML file')
+    if not notes:
+        raise ValueError(f'{path}: no notes')
+    return group_onsets(notes), breaks
+
+
+def parse_beats(spec):
+    """'32, 64.5' -> [32.0, 64.5]"""
+    return [float(b) for b in spec.replace(' ', '').split(',') if b]
+
+
+class ScoreFollower:
+    """Follows a performance through ``onsets`` and turns the page before each break.
+
+    ``turn`` is what is queued on the dispatcher for a page turn, usually
+    ``Turn('next', key, None)``. ``feed()`` takes ``read()`` batches and returns
+    ``[(turn, timestamp)]``.
+    """
+
+    def __init__(self, onsets, page_breaks, turn, lead=LEAD_BEATS, band=BAND, channels=None):
+        self.beats = [beat for beat, _ in onsets]
+        self.pitches = [pitches for _, pitches in onsets]
+        self.classes = [frozenset(p % 12 for p in pitches) for _, pitches in onsets]
+        # the first page needs no turn
+        self.breaks = sorted(b for b in page_breaks if b > self.beats[0])
+        self.turn = turn
+        self.lead = lead
+        self.band = band
+        self.channels = None if channels is None else frozenset(channels)
+        self.reset()
+
+    def reset(self):
+        self.position = 0
+        self.notes = 0
+        self.next_break = 0
+        # (timestamp, beat, break) of every turn fired
+        self.turns = []
+        # the column before the first note: a virtual onset -1 at no cost
+        self._lo = -1
+        self._cost = [0.0]
+        self._last_note = None
+
+    @property
+    def beat(self):
+        return self.beats[self.position]
+
+    def step(self, pitch, chord=False):
+        """Align one played pitch, ``chord`` if it came with the previous one.
+        Returns the new position (onset index)."""
+        beats = self.beats
+        lo = max(0, self.position - BACK)
+        hi = min(len(beats), lo + self.band)
+        prev = self._cost
+        off = self._lo
+        n_prev = len(prev)
+        pitches = self.pitches
+        classes = self.classes
+        pc = pitch % 12
+        extra = CHORD_ADVANCE if chord else 0.0
+        column = []
+        left = INF
+        best = INF
+        best_j = lo
+        for j in range(lo, hi):
+            i = j - off
+            stay = prev[i] + STAY if 0 <= i < n_prev else INF
+            advance = prev[i - 1] + extra if 0 <= i - 1 < n_prev else INF
+            cost = min(stay, advance, left + SKIP)
+            if pitch in pitches[j]:
+                cost += MATCH
+            elif pc in classes[j]:
+                cost += OCTAVE
+            else:
+                cost += MISS
+            column.append(cost)
+            left = cost
+            if cost < best:
+                best = cost
+                best_j = j
+        # keep the numbers small, only differences matter
+        self._cost = [c - best for c in column]
+        self._lo = lo
+        self.position = best_j
+        return best_j
+
+    def feed(self, batch):
+        fired = []
+        channels = self.channels
+        breaks = self.breaks
+        for msg, timestamp in batch:
+            st = msg[0]
+            if st & 0xF0 != 0x90 or not msg[2]:
+                continue
+            if channels is not None and st & 0x0F not in channels:
+                continue
+            self.notes += 1
+            last = self._last_note
+            self._last_note = timestamp
+            beat = self.beats[self.step(msg[1], last is not None and timestamp - last < CHORD_MS)]
+            while self.next_break < len(breaks) and beat >= breaks[self.next_break] - self.lead:
+                self.turns.append((timestamp, beat, breaks[self.next_break]))
+                self.next_break += 1
+                fired.append((self.turn, timestamp))
+        return fired
+
+    def manual_turn(self, action):
+        """A page turned with the pedal: the break it was for needs no automatic turn."""
+        if action == 'next' and self.next_break < len(self.breaks) \
+                and self.beat >= self.breaks[self.next_break] - self.lead - MANUAL_WINDOW:
+            self.next_break += 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score follower references')
+    sub = parser.add_subparsers(dest='command', required=True)
+    info = sub.add_parser('info', help='onsets and page breaks of a reference')
+    info.add_argument('file')
+    args = parser.parse_args(argv)
+
+    try:
+        onsets, breaks = load_reference(args.file)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    notes = sum(len(p) for _, p in onsets)
+    print(f'{args.file}: {notes} notes in {len(onsets)} onsets, {onsets[-1][0]:g} beats')
+    if breaks:
+        print('page breaks (beats): ' + ', '.join(f'{b:g}' for b in breaks))
+    else:
+        print('no page breaks, give them with --page-breaks')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
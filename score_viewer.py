@@ -0,0 +1,371 @@
+"""Built-in score viewer: renders the PDF itself and turns its pages from the pedals.
+
+With an external viewer a page turn is a key press, then the viewer decodes and
+draws the page, which takes a while for heavy scanned scores. Here a background
+thread rasterizes the current page and the next and previous ``prefetch`` pages
+ahead of time into an LRU cache bounded by a memory budget, so a page turn is a
+blit of a surface that is already in the display format.
+
+    python score_viewer.py SCORE.pdf [--prefetch N] [--cache-mb MB] [--backend rtmidi|pygame]
+                                     [--mapping FILE] [--replay FILE]
+
+Needs PyMuPDF (``pip install pymupdf``) and pygame. The viewer is an output
+backend (page_output.py) fed by the same receive loop as midi_page_turn(); the
+arrow and page keys of the window turn pages too.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from page_output import PageOutput, use_output
+from telemetry import LatencyHistogram
+
+PREFETCH = 3
+CACHE_MB = 256
+WINDOW_SIZE = (1024, 768)
+BACKGROUND = (255, 255, 255)
+ERROR_BACKGROUND = (255, 235, 235)
+# longest a page turn waits for its page before showing a placeholder
+RENDER_TIMEOUT = 2.0
+
+
+class PageCache:
+    """LRU of rendered pages bounded by the bytes they hold."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._pages
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size, keep=()):
+        """Add a page, evicting the least recently used ones but not the ``keep`` keys."""
+        with self._lock:
+            old = self._pages.pop(key, None)
+            if old is not None:
+                self.used -= old[1]
+            self._pages[key] = (value, size)
+            self.used += size
+            for k in list(self._pages):
+                if self.used <= self.budget:
+                    break
+                if k == key or k in keep:
+                    continue
+                self.used -= self._pages.pop(k)[1]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self.used = 0
+
+
+class PdfRenderer:
+    """Rasterizes the pages of a PDF to RGB, scaled to fit a size."""
+
+    def __init__(self, path):
+        import fitz  # PyMuPDF
+        self._fitz = fitz
+        self.doc = fitz.open(path)
+        self.pages = self.doc.page_count
+
+    def render(self, index, size):
+        """``((width, height), rgb_bytes)`` of page ``index`` fitted into ``size``."""
+        page = self.doc[index]
+        zoom = min(size[0] / page.rect.width, size[1] / page.rect.height)
+        pix = page.get_pixmap(matrix=self._fitz.Matrix(zoom, zoom), alpha=False)
+        return (pix.width, pix.height), pix.samples
+
+    def close(self):
+        self.doc.close()
+
+
+class Prefetcher:
+    """Renders pages into the cache from one background thread.
+
+    The wanted page comes first, then the next and previous ``depth`` pages,
+    nearest first. MuPDF documents are not thread safe, so every render happens
+    on this thread. ``make_surface(rgb_bytes, (w, h))`` returns ``(surface, nbytes)``.
+    A page that fails to render is not tried again; its error is in ``errors``.
+    """
+
+    def __init__(self, renderer, cache, depth, make_surface):
+        self.renderer = renderer
+        self.cache = cache
+        self.depth = depth
+        self.make_surface = make_surface
+        self.render_ms = LatencyHistogram()
+        # (page, size) -> the exception of its render
+        self.errors = {}
+        self._page = None
+        self._size = None
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='page-prefetch', daemon=True)
+        self._thread.start()
+
+    def plan(self, page, size):
+        order = [page]
+        for i in range(1, self.depth + 1):
+            order += [page + i, page - i]
+        return [(p, size) for p in order if 0 <= p < self.renderer.pages]
+
+    def want(self, page, size):
+        with self._cond:
+            self._page = page
+            self._size = size
+            self._cond.notify_all()
+
+    def _next(self):
+        with self._cond:
+            while self._running:
+                if self._page is not None:
+                    plan = self.plan(self._page, self._size)
+                    todo = [key for key in plan if key not in self.cache and key not in self.errors]
+                    if todo:
+                        return todo[0], set(plan)
+                self._cond.wait()
+            return None, None
+
+    def _run(self):
+        while True:
+            key, keep = self._next()
+            if key is None:
+                return
+            page, size = key
+            t0 = time.perf_counter()
+            try:
+                dims, samples = self.renderer.render(page, size)
+                surface, nbytes = self.make_surface(samples, dims)
+            except Exception as e:
+                # a corrupt page must not take the thread, and every later page, with it
+                with self._cond:
+                    self.errors[key] = e
+                    self._cond.notify_all()
+                continue
+            self.render_ms.record((time.perf_counter() - t0) * 1000)
+            self.cache.put(key, surface, nbytes, keep)
+            with self._cond:
+                self._cond.notify_all()
+
+    def wait_for(self, page, size, timeout=None):
+        """The surface of ``page``, waiting for it to be rendered; None after
+        ``timeout`` seconds. Raises the error of a page that failed to render."""
+        key = (page, size)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while key not in self.cache:
+                error = self.errors.get(key)
+                if error is not None:
+                    raise error
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+        return self.cache.get(key)
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(2)
+
+
+class ScoreViewer(PageOutput):
+    """pygame window showing one page at a time.
+
+    ``turn()`` is called from the dispatch thread and only posts an event; the
+    window is drawn from the thread running ``run()``.
+    """
+
+    name = 'viewer'
+
+    def __init__(self, path, prefetch=PREFETCH, cache_mb=CACHE_MB, size=WINDOW_SIZE, page=0):
+        import pygame
+        self.pygame = pygame
+        pygame.display.init()
+        self.screen = pygame.display.set_mode(size, pygame.RESIZABLE)
+        self.title = os.path.basename(path)
+        pygame.display.set_caption(self.title)
+        self.TURN = pygame.event.custom_type()
+        self.renderer = PdfRenderer(path)
+        self.cache = PageCache(cache_mb * 1024 * 1024)
+        self.prefetcher = Prefetcher(self.renderer, self.cache, prefetch, self.make_surface)
+        self.page = max(0, min(self.renderer.pages - 1, page))
+        # pedal edge handed to turn() until the page is on screen
+        self.turn_to_pixels = LatencyHistogram()
+        # a placeholder is on screen until the page is rendered
+        self.pending = False
+        self.prefetcher.want(self.page, self.screen.get_size())
+
+    def make_surface(self, samples, size):
+        # convert once here so the blit on a page turn is a plain copy
+        surface = self.pygame.image.frombuffer(samples, size, 'RGB').convert()
+        return surface, size[0] * size[1] * surface.get_bytesize()
+
+    def turn(self, turn, count=1):
+        if turn.action not in ('next', 'prev'):
+            return
+        step = count if turn.action == 'next' else -count
+        self.pygame.event.post(self.pygame.event.Event(self.TURN, step=step, queued=time.perf_counter()))
+
+    def go(self, page):
+        self.page = max(0, min(self.renderer.pages - 1, page))
+        self.prefetcher.want(self.page, self.screen.get_size())
+        self.show()
+
+    def show(self):
+        size = self.screen.get_size()
+        surface = self.cache.get((self.page, size))
+        self.pending = False
+        if surface is None:
+            # not prefetched yet (first page, jump, resize)
+            self.prefetcher.want(self.page, size)
+            try:
+                surface = self.prefetcher.wait_for(self.page, size, RENDER_TIMEOUT)
+            except Exception as e:
+                self.show_message(f'Page {self.page + 1} cannot be rendered: {e}', ERROR_BACKGROUND)
+                return
+            if surface is None:
+                # still rendering: run() shows it when it is in the cache
+                self.pending = True
+                self.show_message(f'Rendering page {self.page + 1} ...', BACKGROUND)
+                return
+        self.screen.fill(BACKGROUND)
+        rect = surface.get_rect(center=(size[0] // 2, size[1] // 2))
+        self.screen.blit(surface, rect)
+        self.pygame.display.set_caption(self.title)
+        self.pygame.display.flip()
+
+    def show_message(self, text, background):
+        pygame = self.pygame
+        size = self.screen.get_size()
+        self.screen.fill(background)
+        try:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            label = pygame.font.SysFont(None, 32).render(text, True, (0, 0, 0))
+            self.screen.blit(label, label.get_rect(center=(size[0] // 2, size[1] // 2)))
+        except Exception:
+            # no font support in this pygame build, the title still says it
+            pass
+        pygame.display.set_caption(text)
+        pygame.display.flip()
+
+    def run(self, stop=None):
+        """Event loop. Returns when the window is closed or ``stop`` is set."""
+        pygame = self.pygame
+        keys = {
+            pygame.K_PAGEDOWN: 1, pygame.K_RIGHT: 1, pygame.K_DOWN: 1, pygame.K_SPACE: 1,
+            pygame.K_PAGEUP: -1, pygame.K_LEFT: -1, pygame.K_UP: -1, pygame.K_BACKSPACE: -1,
+        }
+        self.show()
+        while stop is None or not stop.is_set():
+            ev = pygame.event.wait(250)
+            if self.pending and (self.page, self.screen.get_size()) in self.cache:
+                self.show()
+            if ev.type == pygame.QUIT:
+                return
+            if ev.type == self.TURN:
+                self.go(self.page + ev.step)
+                self.turn_to_pixels.record((time.perf_counter() - ev.queued) * 1000)
+            elif ev.type == pygame.KEYDOWN:
+                if ev.key in (pygame.K_q, pygame.K_ESCAPE):
+                    return
+                if ev.key == pygame.K_HOME:
+                    self.go(0)
+                elif ev.key == pygame.K_END:
+                    self.go(self.renderer.pages - 1)
+                elif ev.key in keys:
+                    self.go(self.page + keys[ev.key])
+            elif ev.type == pygame.VIDEORESIZE:
+                # pages are cached per window size
+                self.cache.clear()
+                self.go(self.page)
+
+    def format(self):
+        t = self.turn_to_pixels.summary()
+        r = self.prefetcher.render_ms.summary()
+        return (f'turn to pixels p50 <= {t["p50_ms"]} ms  p99 <= {t["p99_ms"]} ms  max {t["max_ms"]:.1f} ms  '
+                f'render p50 <= {r["p50_ms"]} ms  cache {len(self.cache)} pages {self.cache.used / 1e6:.0f} MB  '
+                f'hits {self.cache.hits}  misses {self.cache.misses}  evictions {self.cache.evictions}')
+
+    def close(self):
+        # close_output() of the receive thread: the window outlives it (end of a
+        # replay, input error), shutdown() is called once run() has returned
+        pass
+
+    def shutdown(self):
+        self.prefetcher.stop()
+        if not self.prefetcher._thread.is_alive():
+            # MuPDF is not thread safe: never close the document under a render
+            self.renderer.close()
+        self.pygame.display.quit()
+
+
+def main(argv=None):
+    import midi_page_turn2
+    from midi_record import ReplayInput, replay_speed
+
+    parser = argparse.ArgumentParser(description='Show a score and turn its pages with MIDI pedals')
+    parser.add_argument('score', help='PDF file')
+    parser.add_argument('--prefetch', type=int, default=PREFETCH, help='pages rendered ahead on each side')
+    parser.add_argument('--cache-mb', type=int, default=CACHE_MB, help='memory budget of the page cache')
+    parser.add_argument('--page', type=int, default=1, help='first page shown')
+    parser.add_argument('--backend', default=None, choices=['rtmidi', 'pygame'])
+    parser.add_argument('--mapping', default=None, metavar='FILE', help='pedal mapping file (TOML or YAML)')
+    parser.add_argument('--replay', default=None, metavar='FILE', help='replay a recording instead of reading a device')
+    parser.add_argument('--speed', type=replay_speed, default=1.0, help='replay speed')
+    args = parser.parse_args(argv)
+
+    try:
+        mapping = midi_page_turn2.load_mapping_config(args.mapping)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    inports = None if args.replay is not None else midi_page_turn2.get_port_from_user()
+
+    viewer = ScoreViewer(args.score, args.prefetch, args.cache_mb, page=args.page - 1)
+    use_output(viewer)
+    stop = threading.Event()
+    midi_in = ReplayInput(args.replay, speed=args.speed) if args.replay is not None else None
+    # the pedals are read on a thread, pygame wants its window on the main thread
+    receiver = threading.Thread(target=midi_page_turn2.midi_page_turn, name='midi-receive', daemon=True,
+                                args=(inports,), kwargs=dict(backend=args.backend, midi_in=midi_in,
+                                                             mapping=mapping, stop=stop))
+    receiver.start()
+    try:
+        viewer.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        receiver.join(2)
+        viewer.shutdown()
+        print(viewer.format())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
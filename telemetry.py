@@ -0,0 +1,259 @@
+"""Lightweight runtime statistics for the receive loops."""
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of an iterable of numbers, or 0 if empty."""
+    data = sorted(values)
+    if not data:
+        return 0
+    k = max(0, min(len(data) - 1, math.ceil(p / 100 * len(data)) - 1))
+    return data[k]
+
+
+class LoopStats:
+    """Idle CPU usage and pedal-to-handler latency of a receive loop.
+
+    CPU usage is measured from ``time.process_time()`` so it covers the whole
+    process, which is what we care about on a stage laptop. Latency samples are
+    the difference between the device timestamp of a pedal edge and the time the
+    handler saw it, both in milliseconds on the backend clock.
+    """
+
+    def __init__(self, max_samples=4096):
+        self.latencies = deque(maxlen=max_samples)
+        self.reset()
+
+    def reset(self):
+        self.start_wall = time.monotonic()
+        self.start_cpu = time.process_time()
+        self.latencies.clear()
+        self.events = 0
+
+    def record_latency(self, ms):
+        self.latencies.append(ms)
+
+    def count_events(self, n):
+        self.events += n
+
+    def cpu_percent(self):
+        wall = time.monotonic() - self.start_wall
+        if wall <= 0:
+            return 0.0
+        return (time.process_time() - self.start_cpu) / wall * 100
+
+    def summary(self):
+        lat = self.latencies
+        return {
+            'cpu_percent': self.cpu_percent(),
+            'events': self.events,
+            'edges': len(lat),
+            'latency_mean_ms': (sum(lat) / len(lat)) if lat else 0,
+            'latency_p50_ms': percentile(lat, 50),
+            'latency_p99_ms': percentile(lat, 99),
+            'latency_max_ms': max(lat) if lat else 0,
+        }
+
+    def format(self):
+        s = self.summary()
+        return ('cpu {cpu_percent:.1f}%  events {events}  edges {edges}  '
+                'latency mean {latency_mean_ms:.2f} ms  p50 {latency_p50_ms} ms  '
+                'p99 {latency_p99_ms} ms  max {latency_max_ms} ms').format(**s)
+
+
+class EventRateStore:
+    """Fixed-size ring of per-bucket event counts keyed on ``time.monotonic()``.
+
+    The receive thread calls ``add()`` once per batch; readers (the UI, at their
+    own refresh rate) call ``series()`` and ``summary()``. The ring covers the
+    last ``capacity * width`` seconds. Whole-session summaries come from a
+    histogram of the per-bucket counts, so memory stays fixed however long the
+    session is.
+    """
+
+    def __init__(self, capacity=300, width=1.0, clock=time.monotonic):
+        self.capacity = capacity
+        self.width = width
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = array('Q', bytes(8 * self.capacity))
+            # bucket number stored in each slot, -1 = never used
+            self._stamps = array('q', [-1]) * self.capacity
+            self._start = int(self.clock() / self.width)
+            self._last = self._start
+            # closed bucket count -> number of buckets, for whole-session summaries
+            self._session = Counter()
+            self.total = 0
+
+    def _bucket(self, now):
+        return int((self.clock() if now is None else now) / self.width)
+
+    def _advance(self, bucket):
+        # close every bucket between the last one we saw and ``bucket``
+        last = self._last
+        if bucket <= last:
+            return
+        slot = last % self.capacity
+        self._session[self._counts[slot] if self._stamps[slot] == last else 0] += 1
+        gap = bucket - last - 1
+        if gap:
+            self._session[0] += gap
+        self._last = bucket
+
+    def add(self, n=1, now=None):
+        bucket = self._bucket(now)
+        slot = bucket % self.capacity
+        with self._lock:
+            self._advance(bucket)
+            if self._stamps[slot] != bucket:
+                self._stamps[slot] = bucket
+                self._counts[slot] = 0
+            self._counts[slot] += n
+            self.total += n
+
+    def series(self, seconds, now=None):
+        """Counts of the complete buckets of the last ``seconds``, oldest first."""
+        n = min(self.capacity - 1, max(1, int(seconds / self.width)))
+        current = self._bucket(now)
+        out = []
+        with self._lock:
+            for bucket in range(current - n, current):
+                slot = bucket % self.capacity
+                out.append(self._counts[slot] if self._stamps[slot] == bucket else 0)
+        return out
+
+    def summary(self, seconds=None, now=None):
+        """min / max / mean / percentiles of events per bucket.
+
+        ``seconds=None`` summarises the whole session.
+        """
+        if seconds is not None:
+            values = self.series(seconds, now)
+            hist = Counter(values)
+        else:
+            with self._lock:
+                self._advance(self._bucket(now))
+                hist = Counter(self._session)
+        n = sum(hist.values())
+        if not n:
+            return {'min': 0, 'max': 0, 'mean': 0, 'p50': 0, 'p90': 0, 'p99': 0, 'buckets': 0}
+        ordered = sorted(hist.items())
+
+        def pct(p):
+            rank = max(1, math.ceil(p / 100 * n))
+            seen = 0
+            for value, count in ordered:
+                seen += count
+                if seen >= rank:
+                    return value
+            return ordered[-1][0]
+
+        return {
+            'min': ordered[0][0],
+            'max': ordered[-1][0],
+            'mean': sum(v * c for v, c in ordered) / n,
+            'p50': pct(50),
+            'p90': pct(90),
+            'p99': pct(99),
+            'buckets': n,
+        }
+
+
+# upper bounds in ms; the last bucket catches everything slower
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 50, 75, 100, 150, 250, 500, 1000)
+# for calls of a few microseconds: a read(), a decode, an XTest key press
+FAST_BUCKETS_MS = (0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram in milliseconds.
+
+    Recording is a bisect and an increment, so it can sit on the hot path for
+    the whole session. Percentiles are reported as the upper bound of the
+    bucket they fall in.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = tuple(bounds)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, ms):
+        self.counts[bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.sum += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        rank = max(1, math.ceil(p / 100 * self.count))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.sum / self.count if self.count else 0,
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max,
+            'buckets': {(str(b) if i < len(self.bounds) else '+Inf'): n
+                        for i, (b, n) in enumerate(zip(self.bounds + (None,), self.counts))},
+        }
+
+    def format(self, width=40):
+        """Text histogram, one line per non-empty bucket."""
+        lines = []
+        peak = max(self.counts) or 1
+        low = 0
+        for i, n in enumerate(self.counts):
+            high = self.bounds[i] if i < len(self.bounds) else float('inf')
+            if n:
+                bar = '#' * max(1, round(n / peak * width))
+                lines.append(f'{low:>7g}-{high:<7g} ms {n:7d} {bar}')
+            low = high
+        return '\n'.join(lines)
+
+
+class PollTimings:
+    """Where the ``poll()`` calls of a PedalSession go, in ms.
+
+    ``read`` is the input's read(), ``decode`` the decoder and ``latency`` the
+    device timestamp of each edge to its decoding. Off unless assigned to
+    ``session.timings`` (the metrics exporter does), it costs three clock reads
+    per batch.
+    """
+
+    def __init__(self):
+        self.polls = 0
+        self.edges = 0
+        self.read = LatencyHistogram(FAST_BUCKETS_MS)
+        self.decode = LatencyHistogram(FAST_BUCKETS_MS)
+        self.latency = LatencyHistogram()
+
+    def record(self, start, read_done, decode_done, edges):
+        self.polls += 1
+        self.edges += edges
+        self.read.record((read_done - start) * 1000)
+        self.decode.record((decode_done - read_done) * 1000)
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+from dispatch import (
+    KeyDispatcher, coalescing, COALESCE_ADJACENT, COALESCE_ENV, COALESCE_NONE, MAX_COALESCE, SOURCE_FOLLOWER,
+)
+
+
+def run(dispatcher, keys, sources=None):
+    """Queue ``keys`` before the worker starts, so they are all waiting at once."""
+    sent = []
+    dispatcher.send = lambda key, count: sent.append((key, count))
+    for i, key in enumerate(keys):
+        dispatcher.put(key, **({"source": sources[i]} if sources else {}))
+    dispatcher.start().stop()
+    return sent
+
+
+def test_adjacent_presses_are_coalesced():
+    sent = run(KeyDispatcher(None), ["next", "next", "next", "prev", "next", "next"])
+    assert sent == [("next", 3), ("prev", 1), ("next", 2)]
+
+
+def test_coalesce_limit():
+    dispatcher = KeyDispatcher(None, max_coalesce=2)
+    assert run(dispatcher, ["next"] * 5) == [("next", 2), ("next", 2), ("next", 1)]
+    assert (dispatcher.dispatched, dispatcher.coalesced) == (5, 2)
+
+
+def test_no_coalescing():
+    assert run(KeyDispatcher(None, coalesce=COALESCE_NONE), ["next"] * 3) == [("next", 1)] * 3
+
+
+def test_sources_are_not_coalesced_together():
+    sent = run(KeyDispatcher(None), ["next"] * 3, sources=[0, SOURCE_FOLLOWER, SOURCE_FOLLOWER])
+    assert sent == [("next", 1), ("next", 2)]
+
+
+def test_full_queue_drops():
+    dispatcher = KeyDispatcher(None, maxsize=2)
+    assert [dispatcher.put("next") for _ in range(4)] == [True, True, False, False]
+    assert (dispatcher.dropped, dispatcher.depth, dispatcher.max_depth) == (2, 2, 2)
+
+
+def test_slow_send_does_not_block_put():
+    sending = threading.Event()
+    release = threading.Event()
+    sent = []
+
+    def send(key, count):
+        sending.set()
+        release.wait(2)
+        sent.append((key, count))
+
+    dispatcher = KeyDispatcher(send, maxsize=4).start()
+    try:
+        dispatcher.put("next")
+        # the worker holds the first key, the next ones wait and are merged
+        assert sending.wait(2)
+        assert all(dispatcher.put("next") for _ in range(3))
+        release.set()
+    finally:
+        dispatcher.stop()
+    assert sent == [("next", 1), ("next", 3)]
+
+
+def test_send_errors_are_counted():
+    def send(key, count):
+        raise OSError("no display")
+
+    dispatcher = KeyDispatcher(send)
+    dispatcher.put("next")
+    dispatcher.start().stop()
+    assert (dispatcher.errors, dispatcher.dispatched) == (1, 0)
+    assert isinstance(dispatcher.last_error, OSError)
+
+
+def test_coalescing_spec(monkeypatch):
+    monkeypatch.delenv(COALESCE_ENV, raising=False)
+    assert coalescing() == (COALESCE_ADJACENT, MAX_COALESCE)
+    assert coalescing("none") == (COALESCE_NONE, MAX_COALESCE)
+    assert coalescing("adjacent:3") == (COALESCE_ADJACENT, 3)
+    monkeypatch.setenv(COALESCE_ENV, "none")
+    assert coalescing() == (COALESCE_NONE, MAX_COALESCE)
+    assert coalescing("adjacent") == (COALESCE_ADJACENT, MAX_COALESCE)
+
+
+@pytest.mark.parametrize("spec", ["all", "adjacent:0", "adjacent:x", "none:-1"])
+def test_bad_coalescing_spec(spec):
+    with pytest.raises(ValueError):
+        coalescing(spec)
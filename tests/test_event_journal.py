@@ -0,0 +1,72 @@
+import pytest
+
+from dispatch import SOURCE_FOLLOWER
+from event_journal import (
+    DISPATCH, DROPPED, EDGE, ERROR, MAGIC, OVERFLOW, RECORD, STATS, EventJournal, Record, read_journal, summarize,
+)
+from midi_decoder import PedalEdge
+from midi_input import Gap
+from page_output import Turn
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "session.mptlog")
+    journal = EventJournal(path, flush_interval=60)
+    journal.edge(PedalEdge(0, 67, "Page_Down", 1000, "next", None, 127), 0.25)
+    journal.dispatch(Turn("next", "Page_Down", None), 2, 1000, 1.5, 3.0)
+    journal.dispatch(Turn("next", "Page_Down", None), 1, None, 0.5, None, SOURCE_FOLLOWER)
+    journal.dropped("prev", 1200)
+    journal.error(Turn("prev", "Page_Up", None), 1300, SOURCE_FOLLOWER)
+    journal.stats(2000, 42, suppressed=3, connected=False)
+    journal.overflow(Gap(1400, 1500, None))
+    journal.close()
+    assert journal.records == 7
+
+    start, records = read_journal(path)
+    assert start > 0
+    assert records == [
+        Record(EDGE, "next", 0, 67, 127, 1000, 0, 0.25),
+        Record(DISPATCH, "next", 0, 2, 0, 1000, 1500, 3.0),
+        Record(DISPATCH, "next", SOURCE_FOLLOWER, 1, 0, 0, 500, -1.0),
+        Record(DROPPED, "prev", 0, 0, 0, 1200, 0, 0.0),
+        Record(ERROR, "prev", SOURCE_FOLLOWER, 0, 0, 1300, 0, 0.0),
+        Record(STATS, None, 0, 0, 0, 2000, 42, 3.0),
+        Record(OVERFLOW, None, 0, 0, 0, 1400, 1500, -1.0),
+    ]
+
+    summary = summarize(records)
+    assert (summary["edges"], summary["turns"], summary["auto_turns"]) == (1, 2, 1)
+    assert (summary["dropped"], summary["errors"], summary["overflows"]) == (1, 1, 1)
+    assert (summary["events"], summary["debounced"], summary["disconnected"]) == (42, 3, 1)
+
+
+def test_follower_turns_do_not_hide_missed_edges(tmp_path):
+    path = str(tmp_path / "session.mptlog")
+    journal = EventJournal(path, flush_interval=60)
+    for ts in (0, 500):
+        journal.edge(PedalEdge(0, 67, "Page_Down", ts, "next", None), 0.1)
+    journal.dispatch("next", 1, 0, 1.0, 1.0)
+    journal.dispatch("next", 1, None, 1.0, None, SOURCE_FOLLOWER)
+    journal.close()
+    assert summarize(read_journal(path)[1])["missed"] == 1
+
+
+def test_truncated_journal(tmp_path):
+    path = str(tmp_path / "session.mptlog")
+    journal = EventJournal(path, flush_interval=60)
+    journal.dropped("next", 1)
+    journal.dropped("prev", 2)
+    journal.close()
+    with open(path, "rb") as f:
+        data = f.read()
+    # cut in the middle of the last record by a crash
+    with open(path, "wb") as f:
+        f.write(data[:-RECORD.size // 2])
+    assert [r.action for r in read_journal(path)[1]] == ["next"]
+
+
+def test_not_a_journal(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"x" * len(MAGIC))
+    with pytest.raises(ValueError):
+        read_journal(str(path))
@@ -0,0 +1,17 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("textual")
+pytest.importorskip("pygame")
+
+from benchmarks.soak_indicator import soak
+
+
+def test_presses_create_no_timers_and_refresh_time_stays_flat():
+    rows = asyncio.run(soak(presses=2000, chunk=500))
+    assert [timers for _done, timers, _p50, _p99 in rows] == [0, 0, 0, 0]
+    first, last = rows[0], rows[-1]
+    # a timer or widget leaked per press makes every refresh slower
+    assert last[2] < first[2] * 2 + 0.05
+    assert last[3] < first[3] * 2 + 0.5
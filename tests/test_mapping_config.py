@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from mapping_config import MappingError, load_mapping, parse_rule
+from midi_decoder import DEBOUNCE_MS, PRESS_THRESHOLD, RELEASE_THRESHOLD, Rule
+
+ACTIONS = {"next": "Page_Down", "prev": "Page_Up"}
+
+
+def write(tmp_path, text, name="mapping.toml"):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def test_load_toml(tmp_path):
+    path = write(tmp_path, """
+debounce_ms = 50
+window = "0x3a00007"
+
+[[rule]]
+cc = 67
+action = "next"
+
+[[rule]]
+note = 60
+channel = 10
+action = "prev"
+threshold = 20
+release = 10
+window = "class:okular"
+
+[[rule]]
+program = 5
+action = "Home"
+""")
+    config = load_mapping(path, ACTIONS)
+    assert config.debounce_ms == 50
+    assert config.path == path
+    assert config.rules == [
+        Rule("cc", None, 67, "next", "Page_Down", PRESS_THRESHOLD, RELEASE_THRESHOLD, "0x3a00007"),
+        Rule("note", 9, 60, "prev", "Page_Up", 20, 10, "class:okular"),
+        Rule("program", None, 5, "Home", "Home", PRESS_THRESHOLD, RELEASE_THRESHOLD, "0x3a00007"),
+    ]
+
+
+def test_defaults(tmp_path):
+    config = load_mapping(write(tmp_path, '[[rule]]\ncc = 66\naction = "prev"\n'), ACTIONS)
+    assert config.debounce_ms == DEBOUNCE_MS
+    assert config.rules[0].window is None
+
+
+def test_key_overrides_the_action():
+    rule = parse_rule({"cc": 67, "action": "next", "key": "space"}, ACTIONS)
+    assert (rule.action, rule.key) == ("next", "space")
+
+
+@pytest.mark.parametrize("entry, message", [
+    ({"action": "next"}, "exactly one of"),
+    ({"cc": 67, "note": 60, "action": "next"}, "exactly one of"),
+    ({"cc": 67}, "needs an action"),
+    ({"cc": 67, "action": "next", "channel": 0}, "not in 1-16"),
+    ({"cc": 67, "action": "next", "channel": 17}, "not in 1-16"),
+])
+def test_bad_rules(entry, message):
+    with pytest.raises(MappingError, match=message):
+        parse_rule(entry, ACTIONS)
+
+
+@pytest.mark.parametrize("text, message", [
+    ("", "no rules"),
+    ("[[rule]]\ncc = 67\n", "rule 1: a rule needs an action"),
+    ('[[rule]]\ncc = "pedal"\naction = "next"\n', "rule 1"),
+    ('[[rule]]\ncc = 67\naction = "next"\nthreshold = 20\nrelease = 30\n', "release threshold"),
+    ('[[rule]]\ncc = 200\naction = "next"\n', "out of range"),
+    ("[[rule]\n", "mapping.toml"),
+])
+def test_bad_files(tmp_path, text, message):
+    with pytest.raises(MappingError, match=message):
+        load_mapping(write(tmp_path, text), ACTIONS)
+
+
+def test_missing_file(tmp_path):
+    with pytest.raises(OSError):
+        load_mapping(str(tmp_path / "missing.toml"), ACTIONS)
+
+
+def test_example_mapping():
+    config = load_mapping(os.path.join(os.path.dirname(__file__), "..", "mapping.example.toml"), ACTIONS)
+    assert config.rules
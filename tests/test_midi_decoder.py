@@ -0,0 +1,116 @@
+import pytest
+
+from midi_decoder import ActionTable, PedalDecoder, Rule
+
+NEXT = Rule("cc", None, 67, "next", "Page_Down")
+PREV = Rule("cc", 0, 66, "prev", "Page_Up")
+
+
+def cc(number, value, ts, channel=0):
+    return [[0xB0 | channel, number, value, 0], ts]
+
+
+def test_table_maps_only_the_rules():
+    table = ActionTable([NEXT, PREV, Rule("note", 9, 60, "left", "Left"), Rule("program", None, 5, "right", "Right")])
+    assert len(table) == 16 + 1 + 2 + 16
+    mapped = table.indices()
+    assert ActionTable._index(0xB3, 67) in mapped
+    assert ActionTable._index(0xB0, 66) in mapped
+    assert ActionTable._index(0xB1, 66) not in mapped
+    assert ActionTable._index(0x99, 60) in mapped
+    assert ActionTable._index(0x89, 60) in mapped
+    assert ActionTable._index(0xB0, 64) not in mapped
+
+
+def test_later_rules_win():
+    decoder = PedalDecoder([NEXT, Rule("cc", None, 67, "prev", "Page_Up")])
+    [edge] = decoder.decode([cc(67, 127, 0)])
+    assert (edge.action, edge.key) == ("prev", "Page_Up")
+
+
+@pytest.mark.parametrize("rule", [
+    Rule("cc", None, 67, "next", "Page_Down", 64, 64),
+    Rule("cc", None, 128, "next", "Page_Down"),
+    Rule("pitch", None, 0, "next", "Page_Down"),
+])
+def test_bad_rules(rule):
+    with pytest.raises(ValueError):
+        ActionTable([rule])
+
+
+def test_unmapped_messages_are_skipped():
+    decoder = PedalDecoder([NEXT])
+    batch = [cc(7, 100, 0), [[0xF8, 0, 0, 0], 1], [[0x90, 60, 100, 0], 2], cc(67, 127, 3), [[0x10, 0, 0, 0], 4]]
+    edges = decoder.decode(batch)
+    assert [(e.cc, e.timestamp, e.value) for e in edges] == [(67, 3, 127)]
+
+
+def test_hysteresis():
+    decoder = PedalDecoder([NEXT], debounce_ms=0)
+    # a half pedal hovering between the thresholds turns one page
+    edges = decoder.decode([cc(67, 70, 0), cc(67, 50, 10), cc(67, 90, 20), cc(67, 40, 30), cc(67, 64, 40)])
+    assert [e.timestamp for e in edges] == [0]
+    # back to the release threshold re-arms the pedal
+    edges = decoder.decode([cc(67, 32, 50), cc(67, 64, 60)])
+    assert [e.timestamp for e in edges] == [60]
+
+
+def test_channels_have_their_own_state():
+    decoder = PedalDecoder([NEXT], debounce_ms=0)
+    edges = decoder.decode([cc(67, 127, 0, channel=0), cc(67, 127, 1, channel=1), cc(67, 127, 2, channel=0)])
+    assert [(e.channel, e.timestamp) for e in edges] == [(0, 0), (1, 1)]
+
+
+def test_debounce():
+    decoder = PedalDecoder([NEXT], debounce_ms=100)
+    edges = decoder.decode([cc(67, 127, 1000), cc(67, 0, 1020), cc(67, 127, 1099), cc(67, 0, 1110),
+                            cc(67, 127, 1100 + 100)])
+    assert [e.timestamp for e in edges] == [1000, 1200]
+    assert decoder.suppressed == 1
+
+
+def test_debounce_per_pedal():
+    decoder = PedalDecoder([NEXT, PREV], debounce_ms=100)
+    edges = decoder.decode([cc(67, 127, 0), cc(66, 127, 10)])
+    assert [e.action for e in edges] == ["next", "prev"]
+
+
+def test_notes_release_on_note_off():
+    decoder = PedalDecoder([Rule("note", None, 60, "next", "Page_Down")], debounce_ms=0)
+    batch = [[[0x90, 60, 100, 0], 0], [[0x90, 60, 100, 0], 1], [[0x80, 60, 64, 0], 2], [[0x90, 60, 100, 0], 3],
+             [[0x90, 60, 0, 0], 4], [[0x90, 60, 100, 0], 5]]
+    assert [e.timestamp for e in decoder.decode(batch)] == [0, 3, 5]
+
+
+def test_program_change_releases_itself():
+    decoder = PedalDecoder([Rule("program", None, 5, "next", "Page_Down")], debounce_ms=0)
+    batch = [[[0xC0, 5, 0, 0], 0], [[0xC0, 5, 0, 0], 1], [[0xC0, 6, 0, 0], 2]]
+    assert [e.timestamp for e in decoder.decode(batch)] == [0, 1]
+
+
+def test_rearm_keeps_the_debounce():
+    decoder = PedalDecoder([NEXT], debounce_ms=100)
+    decoder.decode([cc(67, 127, 0)])
+    # the release was lost in an overflow
+    decoder.rearm()
+    assert decoder.decode([cc(67, 127, 50)]) == []
+    decoder.rearm()
+    assert [e.timestamp for e in decoder.decode([cc(67, 127, 150)])] == [150]
+
+
+def test_adopt_keeps_a_held_pedal():
+    old = PedalDecoder([NEXT], debounce_ms=0)
+    old.decode([cc(67, 127, 0)])
+    new = PedalDecoder([Rule("cc", None, 67, "prev", "Page_Up")], debounce_ms=0)
+    new.adopt(old)
+    assert new.decode([cc(67, 127, 10)]) == []
+    assert [e.action for e in new.decode([cc(67, 0, 20), cc(67, 127, 30)])] == ["prev"]
+
+
+def test_dict_mapping():
+    decoder = PedalDecoder({67: "Page_Down"}, channels=[2], debounce_ms=0)
+    assert decoder.is_mapped(2, 67) and not decoder.is_mapped(0, 67)
+    [edge] = decoder.decode([cc(67, 0, 0, channel=0), cc(67, 127, 1, channel=0), cc(67, 127, 2, channel=2)])
+    assert (edge.channel, edge.key) == (2, "Page_Down")
+    with pytest.raises(ValueError):
+        PedalDecoder({67: "Page_Down"}, press_threshold=32, release_threshold=32)
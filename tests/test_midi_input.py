@@ -0,0 +1,83 @@
+from midi_input import (
+    BUFFER_ENV, BUFFER_SIZE, MAX_READ, Gap, InputHealth, ReadBatch, RtMidiInput, input_buffer_size, is_overflow,
+)
+
+
+def test_full_reads_double_the_batch():
+    batch = ReadBatch(min_size=32, max_size=MAX_READ)
+    sizes = []
+    for _ in range(7):
+        batch.update(batch.size)
+        sizes.append(batch.size)
+    assert sizes == [64, 128, 256, 512, 1024, 1024, 1024]
+    assert batch.full == 7
+
+
+def test_batch_shrinks_back_when_idle():
+    batch = ReadBatch(min_size=32, max_size=MAX_READ)
+    for _ in range(5):
+        batch.update(batch.size)
+    assert batch.size == 1024
+    sizes = []
+    for _ in range(60):
+        batch.update(0)
+        sizes.append(batch.size)
+    # at most one halving per read, down to the minimum
+    assert all(a in (b, b * 2) for a, b in zip([1024] + sizes, sizes))
+    assert sizes[-1] == 32
+
+
+def test_batch_follows_a_steady_rate():
+    batch = ReadBatch(min_size=32, max_size=MAX_READ)
+    for _ in range(200):
+        # 100 events waiting at each read
+        batch.update(min(batch.size, 100))
+    assert batch.size == 128
+
+
+def test_buffer_size(monkeypatch):
+    monkeypatch.delenv(BUFFER_ENV, raising=False)
+    assert input_buffer_size() == BUFFER_SIZE
+    monkeypatch.setenv(BUFFER_ENV, "256")
+    assert input_buffer_size() == 256
+    assert input_buffer_size(64) == 64
+
+
+def test_is_overflow():
+    assert is_overflow(RuntimeError("PortMidi: `Buffer overflow'"))
+    assert not is_overflow(RuntimeError("PortMidi: `Bad pointer'"))
+
+
+def test_health():
+    health = InputHealth(max_gaps=2)
+    health.lost(0, 10, 5)
+    health.lost(20, 30)
+    health.lost(40, 50, 1)
+    assert (health.overflows, health.dropped) == (3, 6)
+    assert list(health.gaps) == [Gap(20, 30, None), Gap(40, 50, 1)]
+
+
+def cc(number, value):
+    return ((0xB0, number, value), 0.0)
+
+
+def test_rtmidi_overflow_is_reported_when_the_queue_drains():
+    midi_in = RtMidiInput(None, "test", buffer_size=4)
+    midi_in.time = lambda: 100
+    for _ in range(7):
+        midi_in._on_message(cc(7, 10))
+    assert midi_in.health.overflows == 0
+    assert len(midi_in.read(2)) == 2
+    midi_in.time = lambda: 150
+    midi_in._on_message(cc(7, 10))
+    assert (midi_in.health.overflows, midi_in.health.dropped) == (1, 3)
+    assert list(midi_in.health.gaps) == [Gap(100, 150, 3)]
+
+
+def test_rtmidi_full_queue_keeps_the_pedals():
+    midi_in = RtMidiInput(None, "test", buffer_size=2)
+    midi_in.priority = frozenset({(0xB0 & 0x7F) << 7 | 67})
+    for _ in range(3):
+        midi_in._on_message(cc(7, 10))
+    midi_in._on_message(cc(67, 127))
+    assert [msg[:3] for msg, _ts in midi_in.read(10)] == [[0xB0, 7, 10], [0xB0, 7, 10], [0xB0, 67, 127]]
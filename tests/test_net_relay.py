@@ -0,0 +1,52 @@
+from net_relay import SEQ_MASK, SeqWindow, decode, encode
+
+
+def accepted(window, seqs):
+    return [seq for seq in seqs if window.accept(seq)]
+
+
+def test_duplicates_are_dropped():
+    window = SeqWindow()
+    assert accepted(window, [1, 1, 1, 2, 2, 3, 2, 1]) == [1, 2, 3]
+    assert window.lost == 0
+
+
+def test_reordering():
+    window = SeqWindow()
+    assert accepted(window, [1, 4, 2, 3, 3, 5]) == [1, 4, 2, 3, 5]
+    assert window.lost == 0
+
+
+def test_lost_until_late():
+    window = SeqWindow()
+    assert accepted(window, [1, 5]) == [1, 5]
+    assert window.lost == 3
+    window.accept(3)
+    assert window.lost == 2
+
+
+def test_too_late_is_dropped():
+    window = SeqWindow()
+    accepted(window, [1, 1 + SeqWindow.SIZE])
+    assert not window.accept(1)
+    assert window.accept(2)
+    # a jump past the window forgets everything before it
+    accepted(window, [1000])
+    assert not window.accept(1000 - SeqWindow.SIZE)
+    assert window.accept(999)
+
+
+def test_wraparound():
+    window = SeqWindow()
+    assert accepted(window, [SEQ_MASK - 1, SEQ_MASK, 0, 1, SEQ_MASK, 0]) == [SEQ_MASK - 1, SEQ_MASK, 0, 1]
+    assert window.lost == 0
+    # reordered across the wrap
+    window = SeqWindow()
+    assert accepted(window, [SEQ_MASK - 1, 1, SEQ_MASK, 0, 1]) == [SEQ_MASK - 1, 1, SEQ_MASK, 0]
+    assert window.lost == 0
+
+
+def test_packet_round_trip():
+    packet = encode(7, SEQ_MASK, "next", count=3, sent_ns=123)
+    assert decode(packet) == (7, SEQ_MASK, "next", 3, 123)
+    assert decode(b"not a page turn") is None
@@ -1,35 +1,48 @@
 from datetime import datetime
+import argparse
+import asyncio
 import os
-import time
-from time import sleep
 from time import monotonic
+from types import SimpleNamespace
 from random import randint
 
 # Suppress the pygame support prompt.
 # This must be set before importing pygame.
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "1"
-
-import pygame
-import pygame.midi
+# pygame.midi is imported where devices are opened, like in midi_input.py
 
 from textual.app import App, ComposeResult
 from textual.widgets import Footer, Header, DataTable, Sparkline, Digits, Label, Static
 from textual import events, work
-from textual.worker import get_current_worker
+from textual.worker import get_current_worker, WorkerError
 from textual.reactive import reactive
 from textual.containers import Horizontal, Vertical
 
 from rich.text import Text
 
 
+from device_watcher import DeviceWatcher, DeviceInfo, ReconnectingInput, pygame_devices, rescan_pygame_devices, diff_devices
+from telemetry import EventRateStore
+from daemon import DaemonClient
+from dispatch import KeyDispatcher, coalescing
+from pedal_session import PedalSession
+from pedal_stream import PedalStream
+from midi_decoder import ActionTable, rule_label
+from mapping_config import MappingWatcher, MAPPING_ENV
+from page_output import OUTPUT_ENV, close_output, output_names
+from telemetry import PollTimings
+import midi_page_turn2
 from midi_page_turn2 import (
-    sendkey, CCDATA, is_windows,
-    VK_DOWN, VK_UP, VK_LEFT, VK_RIGHT,
-    LEFT_PEDAL, MID_PEDAL
+    turn_page, needs_window, is_windows, init_midi, select_target_window, load_mapping_config,
+    ACTIONS,
 )
 
 
 RECV_TIME_WINDOW = 30  # seconds
+# windows of the event rate summary, cycled with 'w'; None is the whole session
+RATE_WINDOWS = (RECV_TIME_WINDOW, 5 * 60, None)
+RATE_REFRESH_INTERVAL = 1  # seconds
+TURN_INDICATOR_HOLD = 1  # seconds a turn indicator stays lit
 
 
 class ThreadQuit:
@@ -74,6 +87,53 @@ class TimeDisplay(Digits):
         self.time = 0
         
         
+class IndicatorScheduler:
+    """Lights turn indicators and turns them off again with one reusable timer each.
+
+    Lighting an indicator turns the others off and restarts its timer, so any
+    number of presses leaves the number of live timers unchanged. All style
+    changes of one press are applied in a single batched refresh.
+    """
+
+    def __init__(self, app, hold=TURN_INDICATOR_HOLD, on="green", off="black"):
+        self.app = app
+        self.hold = hold
+        self.on = on
+        self.off = off
+        self.widgets = {}
+        self.timers = {}
+        self.lit = set()
+
+    def register(self, name, widget):
+        self.widgets[name] = widget
+        self.timers[name] = self.app.set_interval(self.hold, lambda: self.release(name), pause=True)
+
+    def _apply(self, lit):
+        with self.app.batch_update():
+            for name, widget in self.widgets.items():
+                if (name in lit) != (name in self.lit):
+                    widget.styles.background = self.on if name in lit else self.off
+        self.lit = lit
+
+    def press(self, name):
+        for other in self.lit - {name}:
+            self.timers[other].pause()
+        self._apply({name})
+        timer = self.timers[name]
+        timer.reset()
+        timer.resume()
+
+    def release(self, name):
+        self.timers[name].pause()
+        if name in self.lit:
+            self._apply(self.lit - {name})
+
+    def release_all(self):
+        for timer in self.timers.values():
+            timer.pause()
+        self._apply(set())
+
+
 class MidiPageTurnApp(App):
     """A Textual app to configure MIDI page turner settings."""
 
@@ -82,24 +142,59 @@ class MidiPageTurnApp(App):
         # ("d", "toggle_dark", "Toggle dark mode"),
         ("space", "start_receiving", "Select device and wait for messages"),
         ("f5", "refresh", "Refresh device list"),
+        ("w", "cycle_rate_window", "Event rate window"),
+        ("p", "toggle_profiler", "Profiler"),
         ("q", "quit", "Quit")
     ]
 
     # midi_data = reactive([randint(0, 256) for _ in range(RECV_TIME_WINDOW)])
     midi_data = reactive([0 for _ in range(RECV_TIME_WINDOW)])
-
-    def __init__(self, driver_class = None, css_path = None, watch_css = False, ansi_color = False):
-        pygame.init()
-        pygame.midi.init()
+    rate_window = reactive(0, init=False)
+
+    def __init__(self, driver_class = None, css_path = None, watch_css = False, ansi_color = False, client = None,
+                 mapping = None, journal = None, metrics = None, profile_dir = None, buffer_size = None, thru = None,
+                 coalesce = None):
+        # attached to a daemon (daemon.py), which owns the MIDI port
+        self.client = client
+        if client is None:
+            init_midi()
+        # MappingConfig, see mapping_config.py; the daemon has its own in attached mode
+        self.mapping = mapping or (load_mapping_config() if client is None else None)
+        self.mapping_watcher = None
+        self.session = None
+        # file the receive worker journals edges and page turns to, see event_journal.py
+        self.journal_path = journal
+        # sampling profiler toggled with 'p', metrics exported if ``metrics`` is given, see metrics.py
+        from metrics import SamplingProfiler
+        self.profiler = SamplingProfiler(directory=profile_dir)
+        self.metrics = metrics
+        # messages the input buffers between two reads, see midi_input.py
+        self.buffer_size = buffer_size
+        # (policy, max_coalesce) of the page turn dispatcher, see dispatch.coalescing()
+        self.coalesce = coalesce or coalescing()
+        # output spec of the MIDI thru (midi_thru.py) and the output while listening
+        self.thru = thru
+        self.thru_output = None
+        self.exporter = None
+        self.dispatcher = None
         
         self.table = None
+        self.columns = None
+        self.devices = []
+        self.listening_input = None
+        # while listening: device rescans go through it, see pedal_stream.py
+        self.pedal_stream = None
+        self.watcher = None
+        # written by the receive worker, read by update_midi_data() at its own pace
+        self.event_rates = EventRateStore(capacity=max(w for w in RATE_WINDOWS if w) + 1)
+        self.indicators = None
         super().__init__(driver_class, css_path, watch_css, ansi_color)
 
     def compose(self) -> ComposeResult:
         yield Header()
 
         self.table = DataTable()
-        self.table.add_columns("ID", "TYPE", "NAME", "STATUS")
+        self.columns = self.table.add_columns("ID", "TYPE", "NAME", "STATUS")
         self.table.cursor_type = "row"
         # self.table.zebra_stripes = True
         self.table.focus()
@@ -122,8 +217,8 @@ class MidiPageTurnApp(App):
                 id="midi_events_container"
             ),
             Horizontal(
-                Static("PREV (CC 67)", id="turn_prev", classes="turn_style"),
-                Static("NEXT (CC 66)", id="turn_next", classes="turn_style"),
+                Static(self.turn_label("prev"), id="turn_prev", classes="turn_style"),
+                Static(self.turn_label("next"), id="turn_next", classes="turn_style"),
                 id="turn_event_container"
             ),
             TimeDisplay("00:00:00.00", id="midi_count"),
@@ -142,30 +237,78 @@ class MidiPageTurnApp(App):
     #     self.query_one(Digits).update(f"{clock:%T}")
     def init_midi(self):
         try:
+            import pygame.midi
             pygame.midi.init()
         except Exception as e:
             pass
         
-    def update_midi_data(self, value):
-        self.midi_data.append(value)
-        if len(self.midi_data) > RECV_TIME_WINDOW:
-            self.midi_data.pop(0)
+    def update_midi_data(self):
+        if self.session is not None:
+            # counters of the listening session to its journal, if any
+            self.session.log_stats()
+        window = RATE_WINDOWS[self.rate_window]
+        self.midi_data = self.event_rates.series(window or self.event_rates.capacity - 1)
         sparkline = self.query_one(Sparkline)
-        sparkline.refresh()
+        sparkline.data = self.midi_data
+
+        summary = self.event_rates.summary(window)
+        self.query_one("#midi_legend_min", Static).update(
+            "min {min} / max {max} / p50 {p50} / p90 {p90} / p99 {p99} events/s".format(**summary))
+
+    def watch_rate_window(self, index):
+        window = RATE_WINDOWS[index]
+        if window is None:
+            legend = "whole session"
+        elif window >= 60:
+            legend = f"{window // 60} minutes"
+        else:
+            legend = f"{window} seconds"
+        self.query_one("#midi_legend_max", Static).update(legend)
+        self.update_midi_data()
+
+    def action_cycle_rate_window(self):
+        self.rate_window = (self.rate_window + 1) % len(RATE_WINDOWS)
+
+    def action_toggle_profiler(self):
+        path = self.profiler.toggle()
+        if path is None:
+            self.notify("Profiling, press p again to stop", severity="information")
+        else:
+            self.log(self.profiler.format())
+            self.notify(f"Profile written to {path}", severity="information")
         
-    def update_turn_status(self, status):
-        if status == LEFT_PEDAL:
-            self.query_one("#turn_next", Static).styles.background = "green"
-            self.query_one("#turn_prev", Static).styles.background = "black"
-        elif status == MID_PEDAL:
-            self.query_one("#turn_next", Static).styles.background = "black"
-            self.query_one("#turn_prev", Static).styles.background = "green"
+    def turn_label(self, action):
+        """Indicator text with the pedals mapped to ``action``, e.g. "NEXT (CC 67)"."""
+        if self.client is not None:
+            triggers = [r["label"] for r in self.client.request("stats")["rules"] if r["action"] == action]
+        else:
+            triggers = [rule_label(r) for r in self.mapping.rules if r.action == action]
+        return f"{action.upper()} ({', '.join(triggers) or 'unmapped'})"
+
+    def update_turn_labels(self):
+        for action in ("prev", "next"):
+            self.query_one(f"#turn_{action}", Static).update(self.turn_label(action))
+
+    def on_mapping_changed(self, config):
+        # mapping watcher thread
+        self.mapping = config
+        session = self.session
+        if session is not None:
+            session.remap(ActionTable(config.rules), debounce_ms=config.debounce_ms)
+        self.call_from_thread(self.update_turn_labels)
+        self.call_from_thread(self.notify, f"Reloaded {config.path}", severity="information")
+
+    def on_mapping_error(self, e):
+        self.call_from_thread(self.notify, f"{e}, keeping the previous mapping", severity="error")
+
+    def update_turn_status(self, action):
+        if action == "next":
+            self.indicators.press("turn_next")
+        elif action == "prev":
+            self.indicators.press("turn_prev")
         else:
-            self.query_one("#turn_next", Static).styles.background = "black"
-            self.query_one("#turn_prev", Static).styles.background = "black"
+            self.indicators.release_all()
             
-        self.set_interval(1, lambda: self.update_turn_status(None), pause=False)
-        
     async def on_key(self, event: events.Key) -> None:
         # Check if the table is focused and Space is pressed
         if self.table.has_focus and event.key == "space":
@@ -203,6 +346,8 @@ class MidiPageTurnApp(App):
                 time_display.stop()
                 time_display.reset()
                 self.worker.cancel()
+                if self.client is not None:
+                    self.client.request("select", device=None)
                 self.table.update_cell_at((row, 3), self.get_bool_text("CLOSED", False))
                 raise Exception({"message": "Device closed", "servity": "information"})
             else:
@@ -217,104 +362,145 @@ class MidiPageTurnApp(App):
         finally:
             return inport
         
-    @work(exclusive=True, thread=True)
-    def action_start_receiving(self) -> None:
+    def action_start_receiving(self):
         # Action when Space is pressed on the DataTable
         # inport = self.get_input_device()
         inport = self.midi_device
         if inport is None:
-            return
-        
+            return None
+        if self.client is not None:
+            return self.receive_from_daemon(inport)
+        return self.receive_midi(inport)
+
+    @work(exclusive=True)
+    async def receive_midi(self, inport):
+        """Receive worker, a task on the app's event loop (pedal_stream.py).
+
+        Edges come out on the loop thread, the widgets are updated directly.
+        Cancelling the worker ends it at its next await.
+        """
+        session = None
+        dispatcher = None
+        journal = None
+        thru = None
         try:
-            midi_in = None
-            
-            worker = get_current_worker()
-            if worker.is_cancelled:
-                # finally block will be executed
-                return
-
-            self.call_from_thread(self.log, "Listening MIDI events ... ")
+            if needs_window():
+                if not is_windows() and midi_page_turn2.WINDOW is None and not os.environ.get(midi_page_turn2.WINDOW_ENV):
+                    self.notify("Click the music sheet viewer window", severity="information")
+                # blocks on the xdotool pick, keep it off the event loop
+                await asyncio.to_thread(select_target_window)
+
+            self.log("Listening MIDI events ... ")
+            import pygame.midi
             pygame.midi.init()
-            midi_in = pygame.midi.Input(inport)
-        
-            start_time = time.time()
-            delay_ms = 1000
-            event_size = 0
-            while True:
-                worker = get_current_worker()
+            # reopened by name when the device is unplugged and plugged back
+            mapping = self.mapping
+            if self.journal_path is not None:
+                from event_journal import EventJournal
+                journal = EventJournal(self.journal_path)
+            if self.thru is not None:
+                from midi_thru import open_thru
+                thru = self.thru_output = open_thru(self.thru)
+                self.log(f"MIDI thru to {thru.port}")
+            session = PedalSession(ReconnectingInput(inport, buffer_size=self.buffer_size), ActionTable(mapping.rules),
+                                   journal=journal, thru=thru,
+                                   debounce_ms=mapping.debounce_ms).open()
+            self.session = session
+            midi_in = session.midi_in
+            stats = session.stats
+            self.listening_input = midi_in
+            self.log(f"Using {midi_in.name} input backend")
+            coalesce, max_coalesce = self.coalesce
+            dispatcher = KeyDispatcher(turn_page, coalesce=coalesce, max_coalesce=max_coalesce,
+                                       journal=journal).start()
+            self.dispatcher = dispatcher
+            if self.exporter is not None:
+                session.timings = PollTimings()
+            event_rates = self.event_rates
+            event_rates.reset()
+
+            self.pedal_stream = PedalStream(session, dispatcher, on_rescan=self.on_listening_rescan)
+            events = 0
+            overflows = 0
+            async for edges in self.pedal_stream:
+                event_rates.add(stats.events - events)
+                events = stats.events
+                for edge in edges:
+                    self.update_turn_status(edge.action)
+                if session.overflows != overflows:
+                    overflows = session.overflows
+                    self.notify(f"MIDI input buffer overflow ({overflows} so far), messages were lost",
+                                severity="warning")
+        except Exception as e:
+            self.log(f"Error in MIDI listening thread: {e}")
+        finally:
+            self.pedal_stream = None
+            self.listening_input = None
+            self.session = None
+            self.dispatcher = None
+            if session is not None:
+                session.close()
+            if dispatcher is not None:
+                dispatcher.stop()
+            if session is not None:
+                self.log(f"{session.stats.format()}  debounced {session.decoder.suppressed}")
+            if dispatcher is not None:
+                self.log(dispatcher.format())
+            if journal is not None:
+                journal.close()
+                self.log(f"Journal: {journal.records} records in {journal.path}")
+            if thru is not None:
+                self.thru_output = None
+                thru.close()
+                self.log(f"MIDI thru: {thru.forwarded} forwarded, {thru.filtered} kept back, {thru.errors} errors")
+            import pygame.midi
+            pygame.midi.quit()
+
+    def on_listening_rescan(self, devices, reconnected):
+        # called by the pedal stream, on the event loop
+        midi_in = self.listening_input
+        self.update_device_table(devices)
+        if reconnected:
+            self.notify(f"Reconnected {midi_in.device_name}", severity="information")
+        elif not midi_in.connected:
+            self.notify(f"Lost {midi_in.device_name}, waiting for it to come back", severity="warning")
+
+    @work(exclusive=True, thread=True)
+    def receive_from_daemon(self, inport):
+        """Worker body in attached mode: the daemon decodes and injects, we only display."""
+        worker = get_current_worker()
+        try:
+            device = self.client.request("select", device=inport)["device"]
+            self.listening_input = SimpleNamespace(device_name=device["name"], connected=True, name="daemon")
+            self.call_from_thread(self.refresh_devices)
+            self.event_rates.reset()
+            last_total = None
+            for event in self.client.events():
                 if worker.is_cancelled:
                     break
-
-                sleep(0)
-
-                current_time = time.time()
-                if (current_time - start_time) * 1000 >= delay_ms:
-                    start_time = current_time
-                    self.log(f"Need update MIDI data... {current_time}")
-                    # self.call_from_thread(self.log, f"Need update MIDI data... {current_time}")
-                    need_update = True
-                    self.call_from_thread(self.log, f'event size: {event_size}')
-                    
-                else:
-                    need_update = False
-                    
-                if not midi_in.poll():
-                    #spinner.stop()
-                    if need_update:
-                        self.log(f"update MIDI data... {0}")
-                        self.call_from_thread(self.update_midi_data, event_size)
-                        event_size = 0
+                if event is None:
                     continue
-
-                # spinner.start()
-
-                # status, controller, value, ?, ?
-                # [[176, 67, 127, 0], 41834]
-                data = midi_in.read(256)
-
-                for d in data:
-                    st = d[0][0]
-                    cc = d[0][1]
-                    val = d[0][2]
-
-                    # control message
-                    # 0b1011CCCC : 1011 : control, CCCC: channel
-                    # print('{:b}'.format(st & 0b10110000))
-                    if st >> 4 != 0b1011:
-                        continue
-
-                    if cc not in CCDATA.keys():
-                        break
-
-                    # print(d)
-
-                    # print(f'ControlCode : {cc}, Value: {val}')
-                    if val > 0:
-                        if CCDATA[cc][0]:
-                            sendkey(CCDATA[cc][1])
-                            self.call_from_thread(self.update_turn_status, cc)
-                            CCDATA[cc][0] = False
-                            # print('-'*20)
-                            # print('')
-                            # spinner.stop()
-                            # pinner.write( '  🎼 {0} {1:d}'.format(('NEXT' if cc == LEFT_PEDAL else "PREV"), int(time.time())))
-                        # spinner.start()
-                        # spinner.ok('✔')
-                        # print('-'*20)
-                    else:  # val is zero (means end of control message)
-                        CCDATA[cc][0] = True
-                        
-                event_size += len(data)
-                    
+                kind = event["event"]
+                if kind == "edge":
+                    self.call_from_thread(self.update_turn_status, event["action"])
+                elif kind == "tick":
+                    if last_total is not None:
+                        self.event_rates.add(event["events"] - last_total)
+                    last_total = event["events"]
+                    self.listening_input.connected = event["connected"]
+                elif kind == "devices":
+                    devices = [DeviceInfo(**d) for d in event["devices"]]
+                    self.call_from_thread(self.update_device_table, devices)
+                elif kind == "mapping":
+                    self.call_from_thread(self.update_turn_labels)
+                elif kind == "error":
+                    self.call_from_thread(self.notify, f"Daemon: {event['error']}", severity="error")
         except Exception as e:
-            self.log(f"Error in MIDI listening thread: {e}")
+            self.log(f"Error in daemon client thread: {e}")
+            self.call_from_thread(self.notify, f"Daemon: {e}", severity="error")
         finally:
-            # self.call_from_thread(self.notify, "Exiting MIDI listening thread ... ")
-            # label = self.call_from_thread(self.query_one, "#midi_label")
-            if 'midi_in' in locals() and midi_in is not None and hasattr(midi_in, "get_open") and midi_in.get_open():
-                midi_in.close()
-            pygame.midi.quit()
-            
+            self.listening_input = None
+
     # Assume this code is inside a Textual App or Widget
     def get_bool_text(self, value, is_true):
         # self.log(f'Styles: {self.theme_variables}')
@@ -328,63 +514,120 @@ class MidiPageTurnApp(App):
         
         return Text(value, style=style)
     
+    def device_row(self, device):
+        opened = device.opened
+        listening = self.listening_input
+        if listening is not None and listening.connected and device.is_input and device.name == listening.device_name:
+            opened = True
+        status = "OPENED" if opened else "CLOSED"
+        status = self.get_bool_text(status, status == 'OPENED')
+        typestr = self.get_bool_text(device.type, 'IN' in device.type)
+        name = self.get_bool_text(device.name, 'IN' in device.type)
+        return device.id, typestr, name, status
+
+    def update_device_table(self, devices):
+        """Apply a new device list to the DataTable, touching only the rows that changed."""
+        added, removed, _changed = diff_devices(self.devices, devices)
+        for device in removed:
+            self.table.remove_row(device.key)
+        new_keys = {d.key for d in added}
+        for device in devices:
+            row = self.device_row(device)
+            if device.key in new_keys:
+                self.table.add_row(*row, key=device.key)
+                continue
+            # PortMidi ids shift after a rescan, compare every cell
+            for column, value in zip(self.columns, row):
+                current = self.table.get_cell(device.key, column)
+                if str(current) != str(value):
+                    self.table.update_cell(device.key, column, value)
+        self.devices = devices
+
     def read_available_devices(self):
+        if self.client is not None:
+            self.update_device_table(self.client.devices())
+            return
         self.init_midi()
         
         # Populate the DataTable with MIDI device information
-        for i in range(pygame.midi.get_count()):
-            ret = pygame.midi.get_device_info(i)
-            typestr = ''
-            if ret[2] and ret[3]:
-                typestr = "IN/OUT"
-            elif ret[2]:
-                typestr = "IN"
-            elif ret[3]:
-                typestr = "OUT"
-            status = "CLOSED" if ret[4] == 0 else "OPENED"
-            status = self.get_bool_text(status, status == 'OPENED')
-            typestr = self.get_bool_text(typestr, 'IN' in typestr)
-            name = self.get_bool_text(ret[1].decode("utf-8"), 'IN' in typestr)
-            self.table.add_row(i, typestr, name, status, key=str(i))
+        self.update_device_table(pygame_devices())
+
+    def on_devices_changed(self):
+        # called from the watcher thread
+        stream = self.pedal_stream
+        if stream is not None:
+            # PortMidi belongs to the receive worker while it is listening
+            stream.rescan()
+        else:
+            self.call_from_thread(self.refresh_devices)
+
+    def refresh_devices(self):
+        if self.client is not None:
+            self.update_device_table(self.client.devices())
+            return
+        if self.pedal_stream is not None:
+            self.pedal_stream.rescan()
+            return
+        self.update_device_table(rescan_pygame_devices())
             
     async def on_mount(self) -> None:
+        self.indicators = IndicatorScheduler(self)
+        for name in ("turn_prev", "turn_next"):
+            self.indicators.register(name, self.query_one(f"#{name}", Static))
         self.read_available_devices()
+        self.set_interval(RATE_REFRESH_INTERVAL, self.update_midi_data)
+        if self.metrics is not None:
+            # the listening session and its dispatcher, whichever they are at scrape time
+            from metrics import MetricsRegistry, start_exporter
+            registry = MetricsRegistry(lambda: [self.session], lambda: self.dispatcher, self.profiler,
+                                       lambda: self.thru_output)
+            try:
+                self.exporter = start_exporter(registry, self.metrics)
+                self.log(f"Metrics: {self.exporter.where}")
+            except OSError as e:
+                self.notify(f"Metrics: {e}", severity="error")
+        if self.client is not None:
+            # the daemon watches devices and sends "devices" events
+            return
+        if self.mapping.path is not None:
+            self.mapping_watcher = MappingWatcher(self.mapping.path, ACTIONS, self.on_mapping_changed,
+                                                  self.on_mapping_error).start()
+        self.watcher = DeviceWatcher(self.on_devices_changed).start()
+        if not self.watcher.available:
+            self.log("No MIDI port watcher available, use F5 after plugging devices")
             
     async def action_quit(self):
         """Called when the 'q' key is pressed."""
-        if hasattr(self, 'worker') and self.worker is not None:
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.mapping_watcher is not None:
+            self.mapping_watcher.stop()
+        if self.profiler.running:
+            self.profiler.stop()
+        if getattr(self, 'worker', None) is not None and not self.worker.is_finished:
+            # the MIDI worker is a task on this loop: its cleanup has run when wait() returns
             self.worker.cancel()
             try:
-                while not self.worker.is_cancelled:
-                    await self.worker.wait()
-            except Exception as e:
-                self.log(f"Error while waiting for worker to cancel: {e}")
-        pygame.midi.quit()
-        pygame.quit()
+                await self.worker.wait()
+            except WorkerError:
+                pass
+        if self.exporter is not None:
+            self.exporter.stop()
+        if self.client is not None:
+            # the daemon keeps listening
+            self.client.close()
+        else:
+            import pygame.midi
+            pygame.midi.quit()
+            close_output()
         
         self.exit()
         
     async def action_refresh(self) -> None:
         """Called when the 'f5' key is pressed."""
         try:
-            if hasattr(self, 'worker') and self.worker is not None:
-                self.worker.cancel()
-                try:
-                    while not self.worker.is_cancelled:
-                        await self.worker.wait()
-                except Exception as e:
-                    self.log(f"Error while waiting for worker to cancel: {e}")
-                    
-            pygame.midi.quit()
-            
-            self.table.clear()
-            self.read_available_devices()
-
-            # label = self.query_one("#midi_label")
-            # label.update("MIDI Input Events (number of events per second)")
-            time_display = self.query_one(TimeDisplay)
-            time_display.stop()
-            time_display.reset()
+            # the listening worker keeps running and reopens its input by name
+            self.refresh_devices()
             self.notify("MIDI device list refreshed", severity="information")
         except Exception as e:
             self.log(f"Error while refreshing MIDI devices: {e}")
@@ -394,5 +637,37 @@ class MidiPageTurnApp(App):
         
         
 if __name__ == "__main__":
-    app = MidiPageTurnApp()
+    parser = argparse.ArgumentParser(description="MIDI page turner")
+    parser.add_argument("--attach", nargs="?", const="", default=None, metavar="SOCKET",
+                        help="attach to a running daemon.py instead of opening the MIDI port")
+    parser.add_argument("--mapping", default=None, metavar="FILE",
+                        help=f"pedal mapping file (TOML or YAML), default ${MAPPING_ENV}")
+    parser.add_argument("--output", default=None, choices=output_names(),
+                        help=f"where page turns go, default ${OUTPUT_ENV} or keys")
+    parser.add_argument("--journal", default=None, metavar="FILE",
+                        help="write pedal edges and page turns to FILE, see event_journal.py")
+    parser.add_argument("--buffer-size", type=int, default=None, metavar="MESSAGES",
+                        help="MIDI messages buffered between two reads, default $MIDI_PAGE_TURN_BUFFER or 4096")
+    parser.add_argument("--coalesce", default=None, metavar="POLICY",
+                        help="how queued presses of one key are merged: none, adjacent or adjacent:MAX, "
+                             "default $MIDI_PAGE_TURN_COALESCE or adjacent:8")
+    parser.add_argument("--thru", nargs="?", const="", default=None, metavar="OUTPUT",
+                        help="forward what is played, pedals excepted, to a PortMidi output id or name, default "
+                             "$MIDI_PAGE_TURN_THRU or a virtual port")
+    parser.add_argument("--metrics", nargs="?", const="", default=None, metavar="PORT_OR_FILE",
+                        help="export OpenMetrics on localhost:PORT (default 9747) or to FILE, see metrics.py")
+    parser.add_argument("--profile-dir", default=None, metavar="DIR",
+                        help="where the sampling profiler ('p') writes its stacks")
+    args = parser.parse_args()
+    midi_page_turn2.OUTPUT = args.output
+
+    try:
+        mapping = load_mapping_config(args.mapping) if args.attach is None else None
+        coalesce = coalescing(args.coalesce)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    client = DaemonClient(args.attach or None) if args.attach is not None else None
+    app = MidiPageTurnApp(client=client, mapping=mapping, journal=args.journal, metrics=args.metrics,
+                          profile_dir=args.profile_dir, buffer_size=args.buffer_size, thru=args.thru,
+                          coalesce=coalesce)
     app.run()
@@ -0,0 +1,258 @@
+"""The X11 window the page turn keys go to.
+
+``xdotool windowactivate --sync`` used to run before every key: a round trip to
+the X server and a wait for the focus change even when the sheet viewer already
+had the focus. A ``WindowTarget``:
+
+- resolves the window once and caches its id;
+- follows the focus through X events (``_NET_ACTIVE_WINDOW`` changes on the root
+  window), so checking whether the viewer has the focus costs nothing and the
+  window is only activated when the focus has actually moved;
+- re-resolves the window by class or name when it goes away, e.g. after the
+  viewer was restarted.
+
+Window specs (MIDI_PAGE_TURN_WINDOW, ``window`` of the mapping rules)::
+
+    0x3a00007        a window id; its class is remembered for re-resolving
+    class:okular     the first visible window of that WM_CLASS
+    name:Score.pdf   the first visible window whose title matches
+
+Focus is followed with python-xlib when it is installed, otherwise with one
+long-running ``xprop -spy`` process. Without either the window is activated
+before every key, as before.
+"""
+import re
+import shutil
+import subprocess
+import threading
+
+
+def xdotool(*args):
+    return subprocess.check_output(('xdotool',) + args, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+
+
+class FocusTracker:
+    """Follows the focused window from a background thread.
+
+    ``active`` is the id of the focused window, None while unknown.
+    """
+
+    name = 'base'
+
+    def __init__(self):
+        self.active = None
+
+    def watch(self, window_id, on_destroy):
+        """Call ``on_destroy(window_id)`` when the window is destroyed, if we can tell."""
+
+    def close(self):
+        pass
+
+
+class XlibFocusTracker(FocusTracker):
+    """PropertyNotify / DestroyNotify events on a dedicated X connection."""
+
+    name = 'xlib'
+
+    def __init__(self):
+        super().__init__()
+        # locking, so the injector thread can add watches while we wait for events
+        import Xlib.threaded  # noqa: F401
+        from Xlib import X, display
+        self._X = X
+        self.display = display.Display()
+        self.root = self.display.screen().root
+        self._net_active_window = self.display.intern_atom('_NET_ACTIVE_WINDOW')
+        self._watched = {}
+        self._closed = False
+        self.root.change_attributes(event_mask=X.PropertyChangeMask)
+        self._read_active()
+        self._thread = threading.Thread(target=self._run, name='focus-tracker', daemon=True)
+        self._thread.start()
+
+    def _read_active(self):
+        prop = self.root.get_full_property(self._net_active_window, self._X.AnyPropertyType)
+        self.active = prop.value[0] if prop is not None and len(prop.value) else None
+
+    def watch(self, window_id, on_destroy):
+        window = self.display.create_resource_object('window', window_id)
+        window.change_attributes(event_mask=self._X.StructureNotifyMask)
+        self.display.flush()
+        self._watched[window_id] = on_destroy
+
+    def _run(self):
+        X = self._X
+        while not self._closed:
+            try:
+                ev = self.display.next_event()
+                if ev.type == X.PropertyNotify and ev.atom == self._net_active_window:
+                    self._read_active()
+                elif ev.type == X.DestroyNotify:
+                    on_destroy = self._watched.pop(ev.window.id, None)
+                    if on_destroy is not None:
+                        on_destroy(ev.window.id)
+            except Exception:
+                # connection closed
+                return
+
+    def close(self):
+        self._closed = True
+        self.display.close()
+
+
+class XpropFocusTracker(FocusTracker):
+    """``xprop -spy`` prints the active window every time it changes."""
+
+    name = 'xprop'
+
+    _ID = re.compile(r'#\s*(0x[0-9a-fA-F]+)')
+
+    def __init__(self):
+        super().__init__()
+        self.process = subprocess.Popen(['xprop', '-spy', '-root', '_NET_ACTIVE_WINDOW'],
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                        text=True, bufsize=1)
+        self._thread = threading.Thread(target=self._run, name='focus-tracker', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        for line in self.process.stdout:
+            match = self._ID.search(line)
+            window_id = int(match.group(1), 16) if match else 0
+            self.active = window_id or None
+        # xprop exited, the focus is unknown from now on
+        self.active = None
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def focus_tracker():
+    """The process-wide focus tracker, or None when the focus cannot be followed."""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            for cls in (XlibFocusTracker, XpropFocusTracker):
+                if cls is XpropFocusTracker and not shutil.which('xprop'):
+                    continue
+                try:
+                    _tracker = cls()
+                    break
+                except Exception:
+                    # no python-xlib, no display, ...
+                    continue
+        return _tracker
+
+
+def close_focus_tracker():
+    global _tracker
+    with _tracker_lock:
+        if _tracker is not None:
+            _tracker.close()
+            _tracker = None
+
+
+class WindowTarget:
+    """A window spec resolved to a cached X window id."""
+
+    def __init__(self, spec, tracker=None):
+        self.spec = spec
+        self.tracker = tracker
+        self.window_id = None
+        self.activations = 0
+        self.skipped = 0
+        self.resolves = 0
+        kind, _, value = spec.partition(':')
+        if kind in ('class', 'name') and value:
+            self.match = (kind, value)
+        else:
+            self.match = None
+            self._use(int(spec, 0))
+            self._remember_class()
+
+    def _remember_class(self):
+        """Keep the class of a window picked by id, to find it again after a restart."""
+        try:
+            self.match = ('class', xdotool('getwindowclassname', str(self.window_id)))
+        except (OSError, subprocess.CalledProcessError):
+            # xdotool before 3.2021 has no getwindowclassname
+            try:
+                self.match = ('name', re.escape(xdotool('getwindowname', str(self.window_id))))
+            except (OSError, subprocess.CalledProcessError):
+                pass
+
+    def _use(self, window_id):
+        self.window_id = window_id
+        if self.tracker is not None:
+            try:
+                self.tracker.watch(window_id, self._destroyed)
+            except Exception:
+                pass
+
+    def _destroyed(self, window_id):
+        if window_id == self.window_id:
+            self.window_id = None
+
+    def resolve(self):
+        """Look the window up by class or name. Raises LookupError."""
+        if self.match is None:
+            raise LookupError(f'Window {self.spec} is gone and cannot be found again')
+        kind, value = self.match
+        try:
+            found = xdotool('search', '--onlyvisible', f'--{kind}', value).split()
+        except subprocess.CalledProcessError:
+            # xdotool search exits with 1 when nothing matches
+            found = []
+        if not found:
+            raise LookupError(f'No window matches {kind} {value!r}')
+        self.resolves += 1
+        self._use(int(found[0]))
+        return self.window_id
+
+    def get(self):
+        """The window id, resolved again if the window went away."""
+        if self.window_id is None:
+            return self.resolve()
+        return self.window_id
+
+    def lost(self):
+        self.window_id = None
+
+    def has_focus(self):
+        tracker = self.tracker
+        return tracker is not None and tracker.active is not None and tracker.active == self.window_id
+
+    def ensure_active(self, activate):
+        """Call ``activate(window_id)`` unless the window already has the focus.
+
+        Returns True if ``activate`` was called. A failed activation is retried
+        once on the re-resolved window, for a viewer that has been restarted.
+        """
+        if self.has_focus():
+            self.skipped += 1
+            return False
+        window_id = self.get()
+        try:
+            activate(window_id)
+        except (OSError, subprocess.CalledProcessError):
+            # xdotool exits non-zero, XTestInjector turns X errors (BadWindow) into OSError
+            self.lost()
+            window_id = self.resolve()
+            activate(window_id)
+        self.activations += 1
+        if self.tracker is not None:
+            # until the PropertyNotify arrives
+            self.tracker.active = window_id
+        return True
+
+
+def window_target(window):
+    """WindowTarget for a spec string, None for None; WindowTargets are returned as is."""
+    if window is None or isinstance(window, WindowTarget):
+        return window
+    return WindowTarget(str(window), focus_tracker())